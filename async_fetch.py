@@ -0,0 +1,321 @@
+import asyncio
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import AsyncGenerator, List
+
+import minio
+import pyarrow as pa
+from pyarrow import Table
+from pytz import timezone
+
+from cache import ObjectCache
+from fetch import ObjectPipeline, default_parse_date, get_available_dates
+from listing import ListingIndex
+from merge import ObjectMerger, merge_columns
+from metrics import METRICS
+from planning import plan_day, planned_objects, select_overlapping
+from storage import DEFAULT_BUCKET, RETRIED_ERRORS, backoff_delay, get_client
+
+try:
+    import aiohttp
+except ImportError:
+    # Listed in the requirements, without it object GETs run in threads for their duration only
+    aiohttp = None
+
+# Bytes of a response body read at once, at most that much of an object is in memory per request in flight
+CHUNK_SIZE = 1024 * 1024
+
+# Errors an object GET is retried on
+_RETRIED_ERRORS = RETRIED_ERRORS + ((aiohttp.ClientError,) if aiohttp else ())
+
+# Threads running the blocking client calls (listings, GETs without aiohttp, disk writes, cache lookups), each
+# one only for the duration of the call
+IO_THREADS = 32
+
+_pools = {}
+
+
+def _get_pool(name: str) -> ThreadPoolExecutor:
+    if name not in _pools:
+        # Arrow releases the GIL while decoding, decoding threads run in parallel
+        max_workers = IO_THREADS if name == "io" else os.cpu_count() or 4
+        _pools[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+    return _pools[name]
+
+
+async def _blocking(function, *args, **kwargs):
+    """Run a blocking call in the I/O pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_pool("io"), lambda: function(*args, **kwargs))
+
+
+async def get_available_dates_async(folder: str, client: minio.Minio = None, bucket: str = None, **kwargs):
+    """``fetch.get_available_dates`` without blocking the event loop."""
+    return await _blocking(get_available_dates, folder, client=client, bucket=bucket, **kwargs)
+
+
+async def plan_objects_async(
+        client,
+        bucket: str,
+        feed_path: str,
+        start_date: datetime,
+        end_date: datetime,
+        timezone_str: str,
+        naming: str = None,
+        parse_date=None,
+        listing: ListingIndex = None,
+        semaphore: asyncio.Semaphore = None,
+):
+    """
+    The objects overlapping [start_date, end_date) (timezone aware), in time order, as ``fetch._plan_objects``
+    plans them. The day folders of the window are listed concurrently, up to ``semaphore`` at a time.
+    """
+    if listing is not None:
+        with METRICS.timer("list"):
+            await _blocking(listing.refresh, client)
+        return listing.query(start_date, end_date)
+
+    first_day = start_date.date()
+    last_day = (end_date - timedelta(microseconds=1)).date()
+    days_of_request = [
+        (first_day + timedelta(days=i)).strftime("%Y-%m-%d")
+        for i in range((last_day - first_day).days + 1)
+    ]
+
+    semaphore = semaphore or asyncio.Semaphore(8)
+
+    async def list_objects(prefix):
+        async with semaphore:
+            with METRICS.timer("list"):
+                return await _blocking(lambda: list(client.list_objects(bucket, prefix)))
+
+    days_in_cloud_names = {day.object_name.split("/")[-2] for day in await list_objects(feed_path)}
+    days_of_request = [day for day in days_of_request if day in days_in_cloud_names]
+    listings = await asyncio.gather(*(list_objects(feed_path + day + "/") for day in days_of_request))
+
+    planned = []
+    for day, objects in zip(days_of_request, listings):
+        objects = [file for file in objects if not file.object_name.endswith("/")]
+        METRICS.increment("objects_listed", len(objects))
+        with METRICS.timer("plan"):
+            plan = plan_day(objects, day, timezone_str, naming=naming, parse_date=parse_date)
+            selected = planned_objects(select_overlapping(plan, start_date, end_date))
+        METRICS.increment("objects_skipped", plan.num_rows - len(selected))
+        planned += selected
+    return planned
+
+
+async def _download_object_async(client, bucket: str, file, file_path: str, semaphore: asyncio.Semaphore,
+                                 session=None, retries: int = 3, backoff: float = 0.5) -> str:
+    """
+    Download ``file`` to ``file_path``, by ``session`` (aiohttp) through a presigned URL, or by the client in
+    a thread without one. At most ``semaphore`` requests are in flight. The body is streamed to disk in chunks
+    of ``CHUNK_SIZE`` bytes, objects are never held in memory.
+    """
+    for attempt in range(retries + 1):
+        try:
+            async with semaphore:
+                with METRICS.timer("download"):
+                    if session is not None:
+                        # Signed locally, the region of the bucket has been looked up beforehand
+                        url = client.presigned_get_object(bucket, file.object_name, expires=timedelta(hours=1))
+                        async with session.get(url) as response:
+                            response.raise_for_status()
+                            with open(file_path, "wb") as sink:
+                                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                                    await _blocking(sink.write, chunk)
+                    else:
+                        await _blocking(client.fget_object, bucket, file.object_name, file_path)
+            METRICS.increment("objects_fetched")
+            METRICS.increment("bytes_transferred", os.path.getsize(file_path))
+            return file_path
+        except _RETRIED_ERRORS:
+            if attempt == retries:
+                raise
+            await asyncio.sleep(backoff_delay(attempt, backoff))
+
+
+async def _fetch_object_async(client, bucket: str, file, file_path: str, semaphore: asyncio.Semaphore,
+                              session=None, retries: int = 3, cache: ObjectCache = None) -> str:
+    """The path of ``file``: its cached path, or ``file_path`` it was downloaded to (moved to the cache if any)."""
+    if cache is not None:
+        path = await _blocking(cache.get, bucket, file.object_name, file.etag)
+        if path is not None:
+            return path
+
+    await _download_object_async(client, bucket, file, file_path, semaphore, session=session, retries=retries)
+    if cache is None:
+        return file_path
+    return await _blocking(cache.get_or_fetch, bucket, file.object_name, file.etag,
+                           lambda path: shutil.move(file_path, path))
+
+
+async def fetch_batches_async(
+        start_date,
+        end_date,
+        feed_path: str,
+        parse_date=None,
+        access_key=os.environ.get("MINIO_ACCESS_KEY"),
+        secret_key=os.environ.get("MINIO_SECRET_KEY"),
+        timezone_str="Europe/Brussels",
+        limit: int = None,
+        max_workers: int = 8,
+        retries: int = 3,
+        cache: ObjectCache = None,
+        prefetch: int = 8,
+        batch_size: int = 65536,
+        columns: List[str] = None,
+        filters=None,
+        time_column: str = None,
+        listing: ListingIndex = None,
+        client: minio.Minio = None,
+        bucket: str = None,
+        naming: str = None,
+        order_by: str = None,
+        id_column: str = None,
+        deduplicate: bool = False,
+        lateness: float = 60,
+        dedup_on: str = None,
+        session=None,
+        semaphore: asyncio.Semaphore = None,
+        executor=None,
+) -> AsyncGenerator[pa.RecordBatch, None]:
+    """
+    Asynchronous ``fetch.fetch_batches``: yield the record batches of the objects of ``feed_path`` overlapping
+    [start_date, end_date), in time order, with the same arguments and semantics but for ``range_reads`` and
+    ``index_columns``, which are not available.
+
+    Objects are fetched by coroutines, at most ``prefetch`` ahead of the one being read, and their GETs are
+    bounded by ``semaphore`` (``max_workers`` requests by default). Pass one semaphore to every call to
+    bound the requests of a whole service. With aiohttp installed the GETs are multiplexed on the event loop
+    through presigned URLs, by ``session`` if given (a shared ``aiohttp.ClientSession``); otherwise each one
+    runs in a thread while it is in flight. Batches are decoded by ``executor``, a shared thread pool by
+    default, Arrow releasing the GIL while decoding.
+
+    With ``order_by`` rows are ordered by time through the streaming merge of ``fetch.fetch_batches``, each
+    object being merged in ``executor`` as it is loaded.
+
+    As in ``fetch.fetch_batches``, objects are streamed to temporary files (or to the ``cache``) and decoded
+    from there one batch at a time, so memory does not grow with ``prefetch`` nor with the number of calls.
+    """
+    if naming is None and parse_date in (None, default_parse_date):
+        naming = "range"
+    if deduplicate and (order_by is None or id_column is None):
+        raise ValueError("deduplicate needs order_by and id_column")
+
+    client = client or get_client(access_key, secret_key)
+    bucket = bucket or DEFAULT_BUCKET
+    semaphore = semaphore or asyncio.Semaphore(max_workers)
+    executor = executor or _get_pool("decode")
+    loop = asyncio.get_running_loop()
+
+    time_zone = timezone(timezone_str)
+    start_date = time_zone.localize(start_date)
+    end_date = time_zone.localize(end_date)
+
+    plan = await plan_objects_async(
+        client,
+        bucket,
+        feed_path,
+        start_date,
+        end_date,
+        timezone_str,
+        naming=naming,
+        parse_date=parse_date,
+        listing=listing,
+        semaphore=semaphore,
+    )
+
+    own_session = session is None and aiohttp is not None and isinstance(client, minio.Minio)
+    if own_session:
+        session = aiohttp.ClientSession()
+    if session is not None and plan:
+        # The client looks the region of the bucket up once and caches it, later URLs are signed locally
+        await _blocking(client.presigned_get_object, bucket, plan[0].object_name)
+
+    read_columns = merge_columns(columns, order_by, id_column, dedup_on) if order_by is not None else columns
+    merger = None
+    if order_by is not None:
+        merger = ObjectMerger(order_by, id_column, deduplicate, lateness, dedup_on)
+
+    def merge(batches, following_start):
+        ready = merger.push(batches, following_start)
+        if ready is None:
+            return []
+        return [batch.select(columns) if read_columns != columns else batch
+                for batch in ready.to_batches(max_chunksize=batch_size) if batch.num_rows]
+
+    files = enumerate(plan)
+    pending = deque()
+    remaining = limit
+    loaded = 0
+    with ObjectPipeline(client, bucket, retries, cache, batch_size=batch_size, columns=read_columns,
+                        filters=filters, time_column=time_column, start_date=start_date,
+                        end_date=end_date) as pipeline:
+        def load(index, file):
+            return asyncio.ensure_future(_fetch_object_async(
+                client, bucket, file, pipeline.file_path(index), semaphore, session=session, retries=retries,
+                cache=cache,
+            ))
+
+        try:
+            while True:
+                while len(pending) <= (prefetch if prefetch is not None else len(plan)):
+                    planned = next(files, None)
+                    if planned is None:
+                        break
+                    pending.append(load(*planned))
+                if not pending:
+                    return
+
+                source = await pending.popleft()
+                loaded += 1
+                if merger is not None:
+                    following_start = plan[loaded].start.timestamp() if loaded < len(plan) else None
+                    batches = iter(await loop.run_in_executor(
+                        executor, merge, pipeline.read([source]), following_start,
+                    ))
+                else:
+                    batches = pipeline.read([source], limit=remaining)
+
+                # Batches are decoded one at a time, as they are consumed
+                while (batch := await loop.run_in_executor(executor, next, batches, None)) is not None:
+                    if remaining is not None:
+                        batch = batch.slice(0, remaining)
+                        remaining -= batch.num_rows
+                    yield batch
+                    if remaining is not None and remaining <= 0:
+                        return
+        finally:
+            # Downloads still pending write to the pipeline's directory, they are cancelled and awaited first
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            if own_session:
+                await session.close()
+
+
+async def fetch_data_async(
+        start_date,
+        end_date,
+        feed_path: str,
+        combine_chunks: bool = False,
+        **kwargs,
+) -> pa.Table:
+    """
+    Asynchronous ``fetch.fetch_data``: the objects of ``feed_path`` overlapping [start_date, end_date) as one
+    table, or None if there are none. ``kwargs`` are those of ``fetch_batches_async``, ``spill`` is not
+    available.
+    """
+    batches = [batch async for batch in fetch_batches_async(start_date, end_date, feed_path, **kwargs)]
+    if not batches:
+        return None
+
+    with METRICS.timer("concat"):
+        table = Table.from_batches(batches)
+        if combine_chunks:
+            table = table.combine_chunks()
+    return table
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+
+
+class FakeObject:
+    def __init__(self, object_name: str, size: int = 0, etag: str = None, is_dir: bool = False):
+        self.object_name = object_name
+        self.size = size
+        self.etag = etag
+        self.is_dir = is_dir
+        self.last_modified = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeResponse:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def read(self, *args):
+        return self.data
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+class FakeMinio:
+    """
+    In-process stand-in for the part of ``minio.Minio`` the fetchers use, serving the files of ``directory`` as
+    the objects of any bucket (``<directory>/<object name>``).
+
+    Every request waits ``latency`` seconds, as a round trip to the server would, and is counted in
+    ``requests`` along with the bytes served, so that benchmarks measure the client side with a repeatable
+    network cost.
+    """
+
+    def __init__(self, directory: str, latency: float = 0.01):
+        self.directory = directory
+        self.latency = latency
+        self.requests = 0
+        self.bytes_served = 0
+        self._lock = threading.Lock()
+        self._names = sorted(
+            os.path.relpath(os.path.join(root, name), directory).replace(os.sep, "/")
+            for root, _, files in os.walk(directory)
+            for name in files
+            if not name.startswith(".")
+        )
+        self._etags = {}
+
+    def list_objects(self, bucket, prefix=None, recursive=False, start_after=None):
+        self._request(0)
+        prefix = prefix or ""
+        folders = set()
+        objects = []
+        for name in self._names:
+            if not name.startswith(prefix) or (start_after is not None and name <= start_after):
+                continue
+            rest = name[len(prefix):]
+            if "/" in rest and not recursive:
+                folder = prefix + rest.split("/")[0] + "/"
+                if folder not in folders and (start_after is None or folder > start_after):
+                    folders.add(folder)
+                    objects.append(FakeObject(folder, is_dir=True))
+            else:
+                objects.append(self.stat_object(bucket, name))
+        return iter(objects)
+
+    def stat_object(self, bucket, object_name):
+        path = self._path(object_name)
+        return FakeObject(object_name, os.path.getsize(path), self._etag(object_name))
+
+    def fget_object(self, bucket, object_name, file_path, **kwargs):
+        source = self._path(object_name)
+        self._request(os.path.getsize(source))
+        shutil.copyfile(source, file_path)
+
+    def get_object(self, bucket, object_name, offset=0, length=0, **kwargs):
+        with open(self._path(object_name), "rb") as file:
+            file.seek(offset)
+            data = file.read(length) if length else file.read()
+        self._request(len(data))
+        return FakeResponse(data)
+
+    def _request(self, size: int):
+        time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            self.bytes_served += size
+
+    def _path(self, object_name: str) -> str:
+        return os.path.join(self.directory, *object_name.split("/"))
+
+    def _etag(self, object_name: str) -> str:
+        if object_name not in self._etags:
+            stat = os.stat(self._path(object_name))
+            self._etags[object_name] = hashlib.md5(f"{object_name}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+        return self._etags[object_name]
@@ -0,0 +1,290 @@
+"""
+Benchmarks of the fetch, export and trajectory paths against synthetic feeds.
+
+    python -m benchmarks.run --quick
+    python -m benchmarks.run --providers riga ovapi --fleets 50 500 2000 --output results.json
+
+Datasets are generated once into ``--data-dir`` and served by an in-process MinIO stand-in with a fixed
+latency per request (or uploaded to the MinIO/S3 server at ``--endpoint``). Each operation of each scenario
+runs ``--repeat`` times in a fresh process, so that its peak RSS is its own. Results are written as JSON.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from benchmarks.fake_minio import FakeMinio
+from benchmarks.synthetic import generate
+from providers import FeedType, get_provider
+
+START_DAY = datetime(2024, 3, 4)
+
+WINDOWS = {
+    "hour": (START_DAY + timedelta(hours=8), timedelta(hours=1)),
+    "day": (START_DAY, timedelta(days=1)),
+    "week": (START_DAY, timedelta(days=7)),
+}
+
+OPERATIONS = ["listing", "fetch_data", "fetch_batches", "export_days", "export_spool", "trajectory"]
+
+# Operations holding the whole window in memory, skipped above ``--max-rows``
+IN_MEMORY = {"fetch_data", "trajectory"}
+
+
+def _peak_rss() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _client(config: dict):
+    if config["endpoint"] is None:
+        return FakeMinio(config["data_dir"], latency=config["latency"])
+    import minio
+    return minio.Minio(
+        config["endpoint"],
+        access_key=config["access_key"],
+        secret_key=config["secret_key"],
+        secure=False,
+    )
+
+
+def _run_operation(config: dict, scenario: dict) -> dict:
+    """Run one operation of a scenario, in the worker process it is measured in."""
+    from export import export_to_spool
+    from fetch import fetch_batches, fetch_data, fetch_data_per_days, get_available_dates
+    from metrics import Collector
+    from trajectory import build_trips
+
+    provider = get_provider(scenario["provider"])
+    feed_type = FeedType(scenario["feed"])
+    start_date, length = WINDOWS[scenario["window"]]
+    end_date = start_date + length
+    client = _client(dict(config, data_dir=scenario["data_dir"]))
+    bucket = config["bucket"]
+    operation = scenario["operation"]
+    kwargs = provider.fetch_kwargs(feed_type, stream=operation in ("fetch_batches", "export_spool"))
+    baseline = _peak_rss()
+
+    result = {"rows": 0}
+    started = time.perf_counter()
+    with Collector() as collector:
+        if operation == "listing":
+            result["rows"] = len(get_available_dates(provider.feeds[feed_type], client=client, bucket=bucket))
+        elif operation == "fetch_data":
+            table = fetch_data(start_date, end_date, client=client, bucket=bucket, **kwargs)
+            result.update(rows=table.num_rows, decoded_bytes=table.nbytes)
+        elif operation == "fetch_batches":
+            for batch in fetch_batches(start_date, end_date, client=client, bucket=bucket, **kwargs):
+                if "first_batch_seconds" not in result:
+                    result["first_batch_seconds"] = time.perf_counter() - started
+                result["rows"] += batch.num_rows
+                result["decoded_bytes"] = result.get("decoded_bytes", 0) + batch.nbytes
+        elif operation == "export_days":
+            with tempfile.TemporaryDirectory() as output_dir:
+                exported = fetch_data_per_days(
+                    start_date,
+                    end_date,
+                    kwargs["feed_path"],
+                    parse_date=kwargs["parse_date"],
+                    timezone_str=kwargs["timezone_str"],
+                    naming=kwargs["naming"],
+                    output_dir=output_dir,
+                    client=client,
+                    bucket=bucket,
+                )
+                result["rows"] = sum(day.rows for day in exported)
+        elif operation == "export_spool":
+            spool = export_to_spool(fetch_batches(start_date, end_date, client=client, bucket=bucket, **kwargs))
+            result["rows"] = pq.ParquetFile(spool).metadata.num_rows
+            result["output_bytes"] = spool.seek(0, io.SEEK_END)
+        elif operation == "trajectory":
+            table = fetch_data(start_date, end_date, client=client, bucket=bucket, **kwargs)
+            # Only the trajectory builder is timed, as the GUI builds them from a table it already has
+            started = time.perf_counter()
+            trips = build_trips(
+                table,
+                provider.column("id"),
+                provider.time_column,
+                provider.column("longitude"),
+                provider.column("latitude"),
+                top_n=100,
+            )
+            result.update(rows=table.num_rows, trips=trips.num_rows)
+        else:
+            raise ValueError(f"Unknown operation {operation!r}, expected one of {OPERATIONS}")
+
+    result["seconds"] = time.perf_counter() - started
+    result["stages"] = collector.stages()
+    result["peak_rss_bytes"] = _peak_rss()
+    result["baseline_rss_bytes"] = baseline
+    # The objects of the trajectory scenario are fetched outside of the timed section
+    if isinstance(client, FakeMinio) and operation != "trajectory":
+        result["requests"] = client.requests
+        result["transferred_bytes"] = client.bytes_served
+    return result
+
+
+def _measure(config: dict, scenario: dict, repeat: int) -> dict:
+    runs = []
+    for _ in range(repeat):
+        # A fresh process per run, the peak RSS of a process never goes down
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            runs.append(pool.submit(_run_operation, config, scenario).result())
+
+    seconds = statistics.median(run["seconds"] for run in runs)
+    last = runs[-1]
+    summary = {
+        key: value for key, value in scenario.items() if key != "data_dir"
+    }
+    summary.update(
+        rows=last["rows"],
+        seconds=seconds,
+        runs=[run["seconds"] for run in runs],
+        rows_per_second=last["rows"] / seconds if seconds else None,
+        peak_rss_bytes=max(run["peak_rss_bytes"] for run in runs),
+        baseline_rss_bytes=min(run["baseline_rss_bytes"] for run in runs),
+    )
+    for key in ("trips", "requests", "transferred_bytes", "decoded_bytes", "output_bytes"):
+        if key in last:
+            summary[key] = last[key]
+    if "transferred_bytes" in last and seconds:
+        summary["transferred_megabytes_per_second"] = last["transferred_bytes"] / 1e6 / seconds
+    summary["stages"] = last["stages"]
+    if "first_batch_seconds" in last:
+        summary["first_batch_seconds"] = statistics.median(run["first_batch_seconds"] for run in runs)
+    return summary
+
+
+def _upload(client, bucket: str, directory: str):
+    """Upload the objects of a generated dataset missing from ``bucket`` of a real server."""
+    if not client.bucket_exists(bucket):
+        client.make_bucket(bucket)
+    existing = {file.object_name for file in client.list_objects(bucket, recursive=True)}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.startswith("."):
+                continue
+            path = os.path.join(root, name)
+            object_name = os.path.relpath(path, directory).replace(os.sep, "/")
+            if object_name not in existing:
+                client.fput_object(bucket, object_name, path)
+
+
+def _metadata(config: dict) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(dt_timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "pyarrow": pa.__version__,
+        "numpy": np.__version__,
+        "server": config["endpoint"] or "fake",
+        "latency": config["latency"] if config["endpoint"] is None else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--providers", nargs="+", default=["riga", "ovapi"])
+    parser.add_argument("--feeds", nargs="+", default=[FeedType.VEHICLE_POSITION.value],
+                        choices=[FeedType.VEHICLE_POSITION.value, FeedType.TRIP_UPDATE.value])
+    parser.add_argument("--windows", nargs="+", default=list(WINDOWS), choices=list(WINDOWS))
+    parser.add_argument("--fleets", nargs="+", type=int, default=[50, 500, 2000])
+    parser.add_argument("--operations", nargs="+", default=OPERATIONS, choices=OPERATIONS)
+    parser.add_argument("--interval", type=int, default=30, help="Seconds between two reports of a vehicle")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.01, help="Seconds per request of the fake server")
+    parser.add_argument("--max-rows", type=int, default=12_000_000,
+                        help="Windows above this many rows skip the operations holding them in memory")
+    parser.add_argument("--quick", action="store_true", help="Hour and day windows of small fleets, one run each")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "emeralds-benchmarks"))
+    parser.add_argument("--endpoint", help="MinIO/S3 server to benchmark against instead of the fake one")
+    parser.add_argument("--bucket", default="public")
+    parser.add_argument("--output", help="JSON file to write the results to, stdout by default")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.windows = [window for window in args.windows if window != "week"]
+        args.fleets = [fleet for fleet in args.fleets if fleet <= 500] or [min(args.fleets)]
+        args.repeat = 1
+
+    config = {
+        "endpoint": args.endpoint,
+        "access_key": os.environ.get("MINIO_ACCESS_KEY"),
+        "secret_key": os.environ.get("MINIO_SECRET_KEY"),
+        "bucket": args.bucket,
+        "latency": args.latency,
+    }
+    days = max(WINDOWS[window][1] for window in args.windows).days or 1
+    results = []
+    for provider_key in args.providers:
+        provider = get_provider(provider_key)
+        for feed in args.feeds:
+            feed_type = FeedType(feed)
+            if feed_type not in provider.feeds:
+                continue
+            for fleet in args.fleets:
+                data_dir = os.path.join(
+                    args.data_dir, f"{provider_key}-{feed}-{fleet}-{args.interval}s-{START_DAY:%Y%m%d}-{days}d")
+                print(f"Generating {data_dir}", file=sys.stderr)
+                generate(provider, feed_type, fleet, START_DAY, days, data_dir, interval=args.interval)
+                if args.endpoint is not None:
+                    _upload(_client(config), args.bucket, data_dir)
+
+                for window in args.windows:
+                    rows = fleet * (3600 // args.interval) * WINDOWS[window][1] // timedelta(hours=1)
+                    for operation in args.operations:
+                        scenario = {
+                            "provider": provider_key,
+                            "feed": feed,
+                            "window": window,
+                            "fleet": fleet,
+                            "operation": operation,
+                            "data_dir": data_dir,
+                        }
+                        if operation in IN_MEMORY and rows > args.max_rows:
+                            continue
+                        if operation == "export_days" and window == "hour":
+                            # Exports whole days only
+                            continue
+                        if operation == "trajectory" and feed_type != FeedType.VEHICLE_POSITION:
+                            continue
+                        if operation == "listing" and window != args.windows[0]:
+                            # Independent of the window
+                            continue
+                        print(f"{provider_key} {feed} {window} fleet={fleet} {operation}", file=sys.stderr)
+                        results.append(_measure(config, scenario, args.repeat))
+
+    report = json.dumps({"metadata": _metadata(config), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pytz import timezone
+
+from providers import FeedType, Provider
+
+# Where the synthetic fleets of each provider drive around
+CENTRES = {
+    "riga": (56.95, 24.11),
+    "ovapi": (52.09, 5.12),
+    "ovapi-train": (52.09, 5.12),
+    "york": (53.96, -1.08),
+}
+
+# Stops announced by each TripUpdate entity
+STOPS_AHEAD = 5
+
+COMPLETE_MARKER = ".complete"
+
+
+def object_name(provider: Provider, feed_type: FeedType, day: datetime, hour: int) -> str:
+    """Name of the object of ``hour`` (local time) of ``day`` under the provider's naming scheme."""
+    folder = provider.feeds[feed_type] + day.strftime("%Y-%m-%d") + "/"
+    if provider.naming == "hour":
+        return folder + f"{hour}.parquet"
+    # The last object of the day ends at 23:59:59, an end of 00:00:00 would read as the start of the day
+    end = f"{hour + 1:02d}-00-00" if hour < 23 else "23-59-59"
+    return folder + f"{hour:02d}-00-00_to_{end}.parquet"
+
+
+def _labels(prefix: str, values: np.ndarray, suffix: str = "") -> np.ndarray:
+    """``prefix<value><suffix>`` for each of ``values`` (small non-negative integers), formatted once per value."""
+    labels = np.char.add(np.char.add(prefix, np.arange(values.max() + 1).astype(str)), suffix)
+    return labels[values]
+
+
+def _vehicle_positions(provider: Provider, vehicles, seconds, latitudes, longitudes, hour) -> dict:
+    ids = _labels("v", vehicles)
+    trips = _labels("v", vehicles, f":{hour}")
+    if provider.naming == "hour":
+        return {
+            "id": ids,
+            "vehicle_id": ids,
+            "trip_id": trips,
+            "timestamp": seconds,
+            "vehicle_position_latitude": latitudes,
+            "vehicle_position_longitude": longitudes,
+            "vehicle_position_bearing": (vehicles * 37 % 360).astype(np.float32),
+            "vehicle_position_speed": np.full(len(vehicles), 8.5, np.float32),
+        }
+    return {
+        "id": ids,
+        "trip_tripId": trips,
+        "trip_routeId": _labels("r", vehicles % 97),
+        "trip_startDate": np.full(len(vehicles), "20240304"),
+        "vehicle_id": ids,
+        "vehicle_label": ids,
+        "position_latitude": latitudes,
+        "position_longitude": longitudes,
+        "position_bearing": (vehicles * 37 % 360).astype(np.float32),
+        "timestamp": seconds - 5,
+        "fetchTime": seconds,
+    }
+
+
+def _trip_updates(provider: Provider, vehicles, seconds, hour) -> dict:
+    sequences = np.tile(np.arange(STOPS_AHEAD), len(vehicles))
+    vehicles = np.repeat(vehicles, STOPS_AHEAD)
+    seconds = np.repeat(seconds, STOPS_AHEAD)
+    ids = _labels("v", vehicles)
+    trips = _labels("v", vehicles, f":{hour}")
+    stops = _labels("s", (vehicles * 13 + sequences) % 5000)
+    delays = (vehicles % 300 - 60).astype(np.int32)
+    arrivals = seconds + 120 * (sequences + 1) + delays
+    if provider.naming == "hour":
+        return {
+            "id": ids,
+            "trip_update_trip_trip_id": trips,
+            "trip_update_vehicle_id": ids,
+            "stop_time_update_stop_sequence": sequences.astype(np.int32),
+            "stop_time_update_stop_id": stops,
+            "stop_time_update_arrival_delay": delays,
+            "stop_time_update_arrival_time": arrivals,
+            "timestamp": seconds,
+        }
+    return {
+        "id": ids,
+        "trip_tripId": trips,
+        "trip_routeId": _labels("r", vehicles % 97),
+        "vehicle_id": ids,
+        "stopTimeUpdate_stopSequence": sequences.astype(np.int32),
+        "stopTimeUpdate_stopId": stops,
+        "stopTimeUpdate_arrival_delay": delays,
+        "stopTimeUpdate_arrival_time": arrivals,
+        "stopTimeUpdate_departure_delay": delays,
+        "timestamp": seconds - 5,
+        "fetchTime": seconds,
+    }
+
+
+def generate(
+        provider: Provider,
+        feed_type: FeedType,
+        fleet: int,
+        start_day: datetime,
+        days: int,
+        directory: str,
+        interval: int = 30,
+        seed: int = 0,
+) -> int:
+    """
+    Write ``days`` days of a synthetic flattened feed of ``provider`` to ``directory``, one object per hour
+    laid out as in the bucket (``<directory>/<feed path>/<day>/<object name>``), and return the number of rows.
+
+    ``fleet`` vehicles report every ``interval`` seconds, each one random walking around the provider's
+    centre; TripUpdate entities announce ``STOPS_AHEAD`` stops each. Objects follow the provider's naming
+    scheme and carry its columns, so that they go through the same planning and reading paths as the real
+    feeds. A directory already generated with the same parameters is left as is.
+    """
+    marker = os.path.join(directory, COMPLETE_MARKER)
+    if os.path.exists(marker):
+        with open(marker) as file:
+            return int(file.read())
+
+    random = np.random.default_rng(seed)
+    time_zone = timezone(provider.timezone)
+    latitude, longitude = CENTRES.get(provider.key, (0.0, 0.0))
+    latitudes = latitude + random.normal(0, 0.05, fleet)
+    longitudes = longitude + random.normal(0, 0.08, fleet)
+    polls = 3600 // interval
+
+    rows = 0
+    for day_index in range(days):
+        day = start_day + timedelta(days=day_index)
+        for hour in range(24):
+            start = int(time_zone.localize(datetime(day.year, day.month, day.day, hour)).timestamp())
+            # Rows ordered by poll then vehicle, as the feed is fetched
+            steps_latitude = random.normal(0, 0.0004, (polls, fleet)).cumsum(axis=0) + latitudes
+            steps_longitude = random.normal(0, 0.0006, (polls, fleet)).cumsum(axis=0) + longitudes
+            latitudes, longitudes = steps_latitude[-1], steps_longitude[-1]
+            vehicles = np.tile(np.arange(fleet), polls)
+            seconds = np.repeat(start + np.arange(polls, dtype=np.int64) * interval, fleet)
+
+            if feed_type == FeedType.TRIP_UPDATE:
+                columns = _trip_updates(provider, vehicles, seconds, hour)
+            else:
+                columns = _vehicle_positions(
+                    provider, vehicles, seconds, steps_latitude.ravel(), steps_longitude.ravel(), hour)
+
+            table = pa.table(columns)
+            path = os.path.join(directory, *object_name(provider, feed_type, day, hour).split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            pq.write_table(table, path)
+            rows += table.num_rows
+
+    with open(marker, "w") as file:
+        file.write(str(rows))
+    return rows
@@ -0,0 +1,149 @@
+import glob
+import hashlib
+import os
+import tempfile
+import threading
+
+from metrics import METRICS
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "EMERALDS_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "emeralds"),
+)
+DEFAULT_CACHE_MAX_BYTES = int(os.environ.get("EMERALDS_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+
+class ObjectCache:
+    """
+    Persistent on-disk cache of MinIO objects, keyed by bucket, object name and ETag.
+
+    An object that is rewritten gets a new ETag, hence a new entry; the stale one simply ages out.
+    The total size is capped at ``max_bytes``, least recently used entries are evicted first.
+    """
+
+    def __init__(self, directory: str = None, max_bytes: int = None):
+        self.directory = directory or DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes if max_bytes is not None else DEFAULT_CACHE_MAX_BYTES
+        self.objects_dir = os.path.join(self.directory, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._entries = self._scan()
+
+    @staticmethod
+    def key(bucket: str, object_name: str, etag: str) -> str:
+        return hashlib.sha256(f"{bucket}/{object_name}@{etag}".encode("utf-8")).hexdigest()
+
+    def path(self, bucket: str, object_name: str, etag: str) -> str:
+        key = self.key(bucket, object_name, etag)
+        return os.path.join(self.objects_dir, key[:2], key + ".parquet")
+
+    def get(self, bucket: str, object_name: str, etag: str):
+        """Return the cached path of the object, or None on a miss."""
+        path = self.path(bucket, object_name, etag)
+        try:
+            # Bumping the mtime is what the LRU order is based on
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._misses += 1
+                self._entries.pop(path, None)
+            METRICS.increment("cache_misses", cache="object")
+            return None
+
+        with self._lock:
+            self._hits += 1
+            if path in self._entries:
+                self._entries[path] = (self._entries[path][0], os.path.getmtime(path))
+        METRICS.increment("cache_hits", cache="object")
+        return path
+
+    def get_or_fetch(self, bucket: str, object_name: str, etag: str, download):
+        """
+        Return the cached path of the object, calling ``download(file_path)`` to populate the entry on a miss.
+
+        The download goes to a temporary file that is atomically renamed, so concurrent readers never see a
+        partial object.
+        """
+        path = self.get(bucket, object_name, etag)
+        if path is not None:
+            return path
+
+        path = self.path(bucket, object_name, etag)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        os.close(fd)
+        try:
+            download(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._entries[path] = (os.path.getsize(path), os.path.getmtime(path))
+        self._evict(keep=path)
+        return path
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "directory": self.directory,
+                "entries": len(self._entries),
+                "bytes": sum(size for size, _ in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
+
+    def clear(self):
+        with self._lock:
+            for path in list(self._entries):
+                self._remove(path)
+            self._entries = {}
+
+    def _scan(self):
+        entries = {}
+        for root, _, files in os.walk(self.objects_dir):
+            for file in files:
+                if not file.endswith(".parquet"):
+                    continue
+                path = os.path.join(root, file)
+                try:
+                    entries[path] = (os.path.getsize(path), os.path.getmtime(path))
+                except FileNotFoundError:
+                    pass
+        return entries
+
+    def _evict(self, keep=None):
+        with self._lock:
+            total = sum(size for size, _ in self._entries.values())
+            if total <= self.max_bytes:
+                return
+            # Another process may share the directory, re-scan before deciding what to drop
+            self._entries = self._scan()
+            total = sum(size for size, _ in self._entries.values())
+            for path, (size, _) in sorted(self._entries.items(), key=lambda entry: entry[1][1]):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                self._remove(path)
+                del self._entries[path]
+                total -= size
+                self._evictions += 1
+
+    @staticmethod
+    def _remove(path):
+        # Files derived from the object, as its index (see ``spatial_index``), are stored next to it and go with it
+        stem = os.path.splitext(path)[0]
+        for file in {path} | set(glob.glob(glob.escape(stem) + ".*")):
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,157 @@
+from datetime import datetime
+
+from providers import FeedType, Provider
+from storage import DEFAULT_BUCKET, DEFAULT_ENDPOINT, DEFAULT_SECURE
+
+
+# Body of ``parse_date`` in the generated code, per naming scheme
+_PARSE_DATE_CODE = {
+    "range": """
+    start_time = file_name.split("/")[-1].split("_")[0]
+    end_time = (
+        file_name.split("/")[-1]
+        .split("_")[2]
+        .replace(".parquet", "")
+    )
+
+    date_str = date.strftime("%Y-%m-%d")
+    file_start_date = datetime.strptime(
+        date_str + "_" + start_time, "%Y-%m-%d_%H-%M-%S"
+    )
+    file_end_date = datetime.strptime(
+        date_str + "_" + end_time, "%Y-%m-%d_%H-%M-%S"
+    )
+
+    if file_start_date == file_end_date:
+        file_end_date = file_start_date + timedelta(days=1)
+
+    return file_start_date, file_end_date
+""",
+    "hour": """
+    hour = int(file_name.split("/")[-1].split(".")[0])
+    return (
+        datetime(date.year, date.month, date.day, hour, 0, 0),
+        datetime(date.year, date.month, date.day, hour, 59, 59)
+    )
+""",
+}
+
+CODE_TEMPLATE = """
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import minio
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pytz import timezone
+
+ENDPOINT = os.environ.get("EMERALDS_MINIO_ENDPOINT", {endpoint})
+BUCKET = os.environ.get("EMERALDS_MINIO_BUCKET", {bucket})
+SECURE = os.environ.get("EMERALDS_MINIO_SECURE", {secure}).lower() not in ("0", "false", "no")
+
+
+def parse_date(date, file_name):{parse_date}
+
+
+def fetch_data_per_days(
+        start_date={start_date},
+        end_date={end_date},
+        feed_path: str = {feed_path},
+        access_key=os.environ.get("MINIO_ACCESS_KEY"),
+        secret_key=os.environ.get("MINIO_SECRET_KEY"),
+        timezone_str={timezone_str},
+        output_dir="data",
+):
+    \"\"\"Write every day of [start_date, end_date) to ``<output_dir>/<YYYY-MM-DD>.csv``.\"\"\"
+    os.makedirs(output_dir, exist_ok=True)
+    days = [
+        start_date + timedelta(days=i)
+        for i in range((end_date - start_date).days)
+    ]
+    for day in days:
+        df = fetch_data(
+            day,
+            day + timedelta(days=1),
+            feed_path,
+            access_key=access_key,
+            secret_key=secret_key,
+            timezone_str=timezone_str,
+        )
+        if df is not None:
+            df.to_csv(os.path.join(output_dir, f"{day.isoformat()[:10]}.csv"), index=False)
+
+
+def fetch_data(
+        start_date={start_date},
+        end_date={end_date},
+        feed_path: str = {feed_path},
+        access_key=os.environ.get("MINIO_ACCESS_KEY"),
+        secret_key=os.environ.get("MINIO_SECRET_KEY"),
+        timezone_str={timezone_str},
+) -> pd.DataFrame:
+    \"\"\"The rows of the objects of ``feed_path`` overlapping [start_date, end_date), in time order, or None.\"\"\"
+    client = minio.Minio(ENDPOINT, access_key=access_key, secret_key=secret_key, secure=SECURE)
+
+    time_zone = timezone(timezone_str)
+    start_date = time_zone.localize(start_date)
+    end_date = time_zone.localize(end_date)
+
+    # Every local day touched by the window, including the last one when the window ends during it
+    first_day = start_date.date()
+    last_day = (end_date - timedelta(microseconds=1)).date()
+    days_of_request = [
+        (first_day + timedelta(days=i)).strftime("%Y-%m-%d")
+        for i in range((last_day - first_day).days + 1)
+    ]
+
+    days_in_cloud = list(client.list_objects(BUCKET, feed_path))
+    days_in_cloud_names = {day.object_name.split("/")[-2] for day in days_in_cloud}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        files = []
+        for day in days_of_request:
+            if day not in days_in_cloud_names:
+                continue
+            for file in client.list_objects(BUCKET, feed_path + day + "/"):
+                if file.object_name.endswith("/"):
+                    continue
+                file_start_date, file_end_date = parse_date(datetime.strptime(day, "%Y-%m-%d"), file.object_name)
+                file_start_date = time_zone.localize(file_start_date, is_dst=None)
+                file_end_date = time_zone.localize(file_end_date, is_dst=None)
+                if end_date <= file_start_date or start_date >= file_end_date:
+                    continue
+
+                file_path = os.path.join(tmpdir, f"{len(files):06d}.parquet")
+                client.fget_object(BUCKET, file.object_name, file_path)
+                files.append((file_start_date, file_path))
+
+        if not files:
+            return None
+
+        # Objects in time order, concatenated once
+        files.sort()
+        table = pa.concat_tables([pq.read_table(file_path) for _, file_path in files])
+
+    return table.to_pandas()  # Convert to pandas DataFrame for easier handling
+"""
+
+
+def generate_code(provider: Provider, feed_type: FeedType, start_date: datetime, end_date: datetime) -> str:
+    """Standalone script fetching a feed of ``provider`` with minio and pyarrow only, for local use."""
+    if provider.naming not in _PARSE_DATE_CODE:
+        raise ValueError(f"No code template for the naming scheme {provider.naming!r} of {provider.key!r}")
+
+    def literal(date):
+        return f"datetime({date.year}, {date.month}, {date.day}, {date.hour}, {date.minute}, 0, 0)"
+
+    # Placeholders are replaced one by one, the code itself is full of braces
+    code = CODE_TEMPLATE.replace("{parse_date}", _PARSE_DATE_CODE[provider.naming])
+    code = code.replace("{start_date}", literal(start_date))
+    code = code.replace("{end_date}", literal(end_date))
+    code = code.replace("{feed_path}", f'"{provider.feeds[feed_type]}"')
+    code = code.replace("{endpoint}", f'"{DEFAULT_ENDPOINT}"')
+    code = code.replace("{bucket}", f'"{DEFAULT_BUCKET}"')
+    code = code.replace("{secure}", '"true"' if DEFAULT_SECURE else '"false"')
+    return code.replace("{timezone_str}", f'"{provider.timezone}"')
@@ -0,0 +1,242 @@
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, NamedTuple
+
+import pyarrow as pa
+import pyarrow.csv as csv
+import pyarrow.parquet as pq
+
+from cache import ObjectCache
+from metrics import METRICS
+
+SUCCESS_MARKER = "_SUCCESS"
+
+EXTENSIONS = {
+    "parquet": "parquet",
+    "csv": "csv",
+    "arrow": "arrow",
+    # Newline-delimited JSON, one object per row
+    "json": "jsonl",
+}
+
+
+class ExportedDay(NamedTuple):
+    day: str
+    path: str
+    rows: int
+    skipped: bool
+
+
+class BatchWriter:
+    """
+    Incremental writer of record batches to a Parquet, CSV, Arrow IPC or newline-delimited JSON file.
+
+    ``sink`` is a path or a binary file object, which is left open. The file is only created with the first
+    batch, since its schema is the one of the whole file. Later batches are cast to it. Nested columns
+    cannot be represented in CSV and are dropped in that format.
+    """
+
+    def __init__(self, sink, format: str = "parquet"):
+        if format not in EXTENSIONS:
+            raise ValueError(f"Unsupported export format {format!r}, expected one of {list(EXTENSIONS)}")
+        self.sink = sink
+        self.format = format
+        self.schema = None
+        self.rows = 0
+        self._writer = None
+        self._file = None
+
+    def write(self, batch: pa.RecordBatch):
+        with METRICS.timer("write", format=self.format):
+            self._write(batch)
+
+    def _write(self, batch: pa.RecordBatch):
+        if self.format == "csv":
+            nested = [field.name for field in batch.schema if pa.types.is_nested(field.type)]
+            if nested:
+                batch = batch.drop_columns(nested)
+
+        if self._writer is None:
+            self.schema = batch.schema
+            if self.format == "parquet":
+                self._writer = pq.ParquetWriter(self.sink, self.schema)
+            elif self.format == "csv":
+                self._writer = csv.CSVWriter(self.sink, self.schema)
+            elif self.format == "arrow":
+                self._writer = pa.ipc.new_file(self.sink, self.schema)
+            else:
+                self._file = open(self.sink, "wb") if isinstance(self.sink, str) else None
+                self._writer = self._file or self.sink
+        elif batch.schema != self.schema:
+            batch = batch.cast(self.schema)
+
+        if self.format == "json":
+            # Serialised by pandas' C encoder one batch at a time, not through a Python object per cell
+            self._writer.write(batch.to_pandas().to_json(orient="records", lines=True, date_format="iso").encode("utf-8"))
+        else:
+            self._writer.write_batch(batch)
+        self.rows += batch.num_rows
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        elif self._writer is not None and self.format != "json":
+            self._writer.close()
+
+
+def export_to_spool(batches, format: str = "parquet", max_size: int = 32 * 1024 * 1024):
+    """
+    Write ``batches`` to a spooled temporary file, rewound and ready to be read.
+
+    The file stays in memory up to ``max_size`` bytes and rolls over to disk beyond, while batches are
+    consumed one at a time: peak memory is about one batch, whatever the size of the export.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=max_size)
+    writer = BatchWriter(spool, format)
+    try:
+        for batch in batches:
+            writer.write(batch)
+    finally:
+        writer.close()
+    spool.seek(0)
+    return spool
+
+
+def partition_path(output_dir: str, day: str) -> str:
+    return os.path.join(output_dir, f"date={day}")
+
+
+def is_complete(output_dir: str, day: str, format: str) -> bool:
+    """Whether the partition of ``day`` has been exported in ``format``, which its marker records."""
+    try:
+        with open(os.path.join(partition_path(output_dir, day), SUCCESS_MARKER)) as marker:
+            return marker.read() == format
+    except FileNotFoundError:
+        return False
+
+
+def part_path(output_dir: str, day: str, format: str) -> str:
+    return os.path.join(partition_path(output_dir, day), f"part-0.{EXTENSIONS[format]}")
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def _export_day(day: str, feed_path: str, output_dir: str, format: str, cache_config, fetch_kwargs: dict,
+                cancel=None, on_batch=None):
+    """
+    Export one day to its partition. ``cancel`` (a ``threading.Event``) is checked between batches, once set
+    the partial file is removed and ``ExportCancelled`` is raised. ``on_batch`` is called with each batch written.
+    """
+    # fetch imports this module, import it lazily to avoid the cycle
+    from fetch import fetch_batches
+
+    partition = partition_path(output_dir, day)
+    os.makedirs(partition, exist_ok=True)
+    path = part_path(output_dir, day, format)
+    tmp_path = path + ".part"
+    # The partition is incomplete until exported again
+    marker = os.path.join(partition, SUCCESS_MARKER)
+    if os.path.exists(marker):
+        os.remove(marker)
+
+    start_date = datetime.strptime(day, "%Y-%m-%d")
+    cache = ObjectCache(*cache_config) if cache_config is not None else None
+
+    writer = BatchWriter(tmp_path, format)
+    cancelled = False
+    try:
+        for batch in fetch_batches(start_date, start_date + timedelta(days=1), feed_path, cache=cache, **fetch_kwargs):
+            if cancel is not None and cancel.is_set():
+                cancelled = True
+                break
+            writer.write(batch)
+            if on_batch is not None:
+                on_batch(batch)
+    finally:
+        writer.close()
+
+    if cancelled:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise ExportCancelled(day)
+
+    if writer.rows == 0:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        path = None
+    else:
+        os.replace(tmp_path, path)
+    # Nothing is left of a previous export of the day, in this format or another one
+    for other_format in EXTENSIONS:
+        other_path = part_path(output_dir, day, other_format)
+        if other_path != path and os.path.exists(other_path):
+            os.remove(other_path)
+
+    # Written last, a partition without marker is redone by the next run
+    with open(marker, "w") as file:
+        file.write(format)
+    return ExportedDay(day, path, writer.rows, False)
+
+
+def export_days(
+        start_date: datetime,
+        end_date: datetime,
+        feed_path: str,
+        output_dir: str = "data",
+        format: str = "parquet",
+        processes: int = 1,
+        overwrite: bool = False,
+        cache: ObjectCache = None,
+        **fetch_kwargs,
+) -> List[ExportedDay]:
+    """
+    Export every day of [start_date, end_date) to a Hive-partitioned dataset, ``<output_dir>/date=YYYY-MM-DD/``.
+
+    Days are exported in this process by default, or concurrently by up to ``processes`` worker processes
+    (``None`` for one per CPU). Workers are spawned, so a script exporting with several processes must call
+    this under ``if __name__ == "__main__":``. Each day is streamed batch by batch from ``fetch.fetch_batches``
+    into an incremental Parquet, CSV, Arrow IPC or JSON writer, so no day is ever held in memory as a whole.
+    A partition is marked complete in its format once written, and partitions complete in the requested format
+    are skipped by later runs unless ``overwrite`` is set, so an interrupted backfill resumes where it stopped.
+
+    ``fetch_kwargs`` are passed to ``fetch_batches`` and must be picklable to be sent to worker processes.
+    Objects holding connections or locks (``client``, ``listing``) are not, only pass them with
+    ``processes=1``. The ``cache`` is re-opened from its directory in each worker.
+    """
+    if format not in EXTENSIONS:
+        raise ValueError(f"Unsupported export format {format!r}, expected one of {list(EXTENSIONS)}")
+
+    days = [
+        (start_date + timedelta(days=i)).strftime("%Y-%m-%d")
+        for i in range((end_date - start_date).days)
+    ]
+    cache_config = (cache.directory, cache.max_bytes) if cache is not None else None
+    results = {}
+    todo = []
+    for day in days:
+        if not overwrite and is_complete(output_dir, day, format):
+            path = part_path(output_dir, day, format)
+            results[day] = ExportedDay(day, path if os.path.exists(path) else None, 0, True)
+        else:
+            todo.append(day)
+
+    if processes == 1 or len(todo) <= 1:
+        for day in todo:
+            results[day] = _export_day(day, feed_path, output_dir, format, cache_config, fetch_kwargs)
+    else:
+        # Spawned workers don't inherit the thread pools and connections of this process
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=processes or min(len(todo), os.cpu_count()), mp_context=context) as pool:
+            futures = {
+                day: pool.submit(_export_day, day, feed_path, output_dir, format, cache_config, fetch_kwargs)
+                for day in todo
+            }
+            for day, future in futures.items():
+                results[day] = future.result()
+
+    return [results[day] for day in days]
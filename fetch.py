@@ -1,46 +1,55 @@
-import enum
+import logging
+import math
 import os
 import tempfile
-from datetime import datetime, timedelta
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
 from typing import List, Generator
 
 import minio
 import pyarrow as pa
-import pyarrow.parquet as pq
-from pyarrow import Table
+import pyarrow.dataset as ds
+from pyarrow import Table, fs
 from pytz import timezone
 
+from cache import ObjectCache
+from export import ExportedDay, export_days
+from listing import ListingIndex
+from merge import merge_columns, merge_objects
+from metrics import METRICS
+from planning import day_folder, is_settled, plan_day, planned_objects, select_overlapping
+from providers import FeedType, get_provider
+from remote import RemoteFile
+from spatial_index import IndexColumns, load_index, read_matching
+from spill import open_spilled, spill as spill_batches, spill_path
+from storage import DEFAULT_BUCKET, RETRIED_ERRORS, backoff_delay, get_client
 
-class FeedType(enum.Enum):
-    VEHICLE_POSITION = "VehiclePosition"
-    TRIP_UPDATE = "TripUpdate"
-    ALERT = "Alert"
+logger = logging.getLogger(__name__)
 
 
 def get_available_dates(
         folder: str,
         access_key=os.environ.get("MINIO_ACCESS_KEY"),
         secret_key=os.environ.get("MINIO_SECRET_KEY"),
+        listing: ListingIndex = None,
+        client: minio.Minio = None,
+        bucket: str = None,
 ) -> List[datetime.date]:
-    client = minio.Minio(
-        "minio-api.apps.emeralds.ari-aidata.eu",
-        access_key=access_key,
-        secret_key=secret_key,
-        secure=True,
-    )
-
-    bucket = "public"
-    print(f"Fetching available dates from {folder} in bucket {bucket}")
-    days_in_cloud = list(client.list_objects(bucket, folder))
-    print(f"Found {len(days_in_cloud)} days in cloud")
-    days_in_cloud_names = [day.object_name.split("/")[-2] for day in days_in_cloud]
+    client = client or get_client(access_key, secret_key)
+    bucket = bucket or DEFAULT_BUCKET
 
-    # Parse to dates
-    days_in_cloud_dates = [
-        datetime.strptime(day, "%Y-%m-%d").date() for day in days_in_cloud_names if day not in ["individual", "latest"]
-    ]
+    if listing is not None:
+        listing.refresh(client)
+        return listing.days()
 
-    return days_in_cloud_dates
+    logger.info("Fetching available dates from %s in bucket %s", folder, bucket)
+    with METRICS.timer("list"):
+        days_in_cloud = list(client.list_objects(bucket, folder))
+    logger.info("Found %d days in cloud", len(days_in_cloud))
+    days_in_cloud_names = [day_folder(folder, day.object_name) for day in days_in_cloud]
+    return [datetime.strptime(day, "%Y-%m-%d").date() for day in days_in_cloud_names if day is not None]
 
 
 def default_parse_date(date, file_name):
@@ -73,167 +82,432 @@ def fetch_data_per_days(
         access_key=os.environ.get("MINIO_ACCESS_KEY"),
         secret_key=os.environ.get("MINIO_SECRET_KEY"),
         timezone_str="Europe/Brussels",
-        output_dir=  "data"
-
-):
-    os.makedirs(output_dir, exist_ok=True)
-    days = [
-        start_date + timedelta(days=i)
-        for i in range((end_date - start_date).days)
-    ]
-    for day in days:
-        table = fetch_data(
-            day,
-            day + timedelta(days=1),
-            feed_path,
-            parse_date=parse_date,
-            access_key=access_key,
-            secret_key=secret_key,
-            timezone_str=timezone_str,
-        )
-        if table is not None:
-            table.to_pandas().to_csv(f"data/{day.isoformat()[:10]}.csv", index=False)
-
+        output_dir=  "data",
+        cache: ObjectCache = None,
+        listing: ListingIndex = None,
+        client: minio.Minio = None,
+        bucket: str = None,
+        naming: str = None,
+        format: str = "parquet",
+        processes: int = 1,
+        overwrite: bool = False,
+
+) -> List[ExportedDay]:
+    """
+    Export every day of [start_date, end_date) to ``output_dir`` as a Hive-partitioned dataset
+    (``date=YYYY-MM-DD/part-0.<format>``), see ``export.export_days``.
+
+    Days are exported in this process, or by ``processes`` spawned worker processes, which needs the call to be
+    under ``if __name__ == "__main__":``. A ``client`` or ``listing`` cannot be shared with other processes,
+    with one of them the export runs in this process.
+    """
+    fetch_kwargs = dict(
+        parse_date=parse_date,
+        access_key=access_key,
+        secret_key=secret_key,
+        timezone_str=timezone_str,
+        bucket=bucket,
+        naming=naming,
+    )
+    if client is not None or listing is not None:
+        fetch_kwargs.update(client=client, listing=listing)
+        processes = 1
 
-def fetch_data(
+    return export_days(
         start_date,
         end_date,
-        feed_path: str,
-        parse_date=None,
-        access_key=os.environ.get("MINIO_ACCESS_KEY"),
-        secret_key=os.environ.get("MINIO_SECRET_KEY"),
-        timezone_str="Europe/Brussels",
-        limit: int = None,
-) -> pa.Table:
-    parse_date = parse_date or default_parse_date
+        feed_path,
+        output_dir=output_dir,
+        format=format,
+        processes=processes,
+        overwrite=overwrite,
+        cache=cache,
+        **fetch_kwargs,
+    )
 
-    client = minio.Minio(
-        "minio-api.apps.emeralds.ari-aidata.eu",
-        access_key=access_key,
-        secret_key=secret_key,
-        secure=True,
+
+def _list_day_objects(client, bucket, day_path):
+    with METRICS.timer("list"):
+        objects = [file for file in client.list_objects(bucket, day_path) if not file.object_name.endswith("/")]
+    METRICS.increment("objects_listed", len(objects))
+    return objects
+
+
+def _download_object(client, bucket, object_name, file_path, retries=3, backoff=0.5):
+    for attempt in range(retries + 1):
+        try:
+            with METRICS.timer("download"):
+                client.fget_object(bucket, object_name, file_path)
+            METRICS.increment("objects_fetched")
+            METRICS.increment("bytes_transferred", os.path.getsize(file_path))
+            return file_path
+        except RETRIED_ERRORS:
+            if attempt == retries:
+                raise
+            time.sleep(backoff_delay(attempt, backoff))
+
+
+def _fetch_object(client, bucket, file, file_path, retries=3, cache: ObjectCache = None, range_reads: bool = False,
+                  index_columns: IndexColumns = None):
+    """
+    Return a readable source for ``file``: its cached path if any, a ``RemoteFile`` when ``range_reads`` is set,
+    otherwise the path it was downloaded to (in the cache if there is one). Objects fetched into the cache are
+    indexed on ``index_columns`` if given, unless they already are.
+    """
+    if range_reads:
+        path = cache.get(bucket, file.object_name, file.etag) if cache is not None else None
+        if path is not None:
+            return path
+        METRICS.increment("objects_fetched")
+        return RemoteFile(client, bucket, file.object_name, size=file.size, retries=retries)
+
+    if cache is None:
+        return _download_object(client, bucket, file.object_name, file_path, retries)
+
+    path = cache.get_or_fetch(
+        bucket,
+        file.object_name,
+        file.etag,
+        lambda path: _download_object(client, bucket, file.object_name, path, retries),
     )
+    if index_columns is not None:
+        load_index(path, index_columns)
+    return path
 
-    time_zone = timezone(timezone_str)
 
-    start_date = time_zone.localize(
+def _plan_objects(
+        client,
+        bucket,
+        feed_path,
         start_date,
-    )
-    end_date = time_zone.localize(
         end_date,
-    )
-    bucket = "public"
-    days_of_request = []
-    current_date = start_date
-    while current_date < end_date:
-        days_of_request.append(current_date.strftime("%Y-%m-%d"))
-        current_date = current_date + timedelta(days=1)
-    service_path = feed_path
-    t = datetime.now()
-
-    days_in_cloud = list(client.list_objects(bucket, service_path))
+        timezone_str,
+        naming: str = None,
+        parse_date=None,
+        listing: ListingIndex = None,
+):
+    """
+    Yield the objects (``PlannedObject``) overlapping [start_date, end_date), in time order.
+
+    With a ``listing`` index the objects are looked up in it, after an incremental refresh. Otherwise days are
+    listed one by one, in the background so the next day is already listed while the current day is being
+    consumed, and each day listing is planned in one vectorised pass (see ``planning.plan_day``).
+    """
+    if listing is not None:
+        with METRICS.timer("list"):
+            listing.refresh(client)
+        yield from listing.query(start_date, end_date)
+        return
+
+    # Every local day touched by the window, including the last one when the window ends during it
+    first_day = start_date.date()
+    last_day = (end_date - timedelta(microseconds=1)).date()
+    days_of_request = [
+        (first_day + timedelta(days=i)).strftime("%Y-%m-%d")
+        for i in range((last_day - first_day).days + 1)
+    ]
+
+    with METRICS.timer("list"):
+        days_in_cloud = list(client.list_objects(bucket, feed_path))
     days_in_cloud_names = [day.object_name.split("/")[-2] for day in days_in_cloud]
+    days_of_request = [day for day in days_of_request if day in days_in_cloud_names]
+
+    list_pool = ThreadPoolExecutor(max_workers=1)
+    try:
+        listings = [
+            list_pool.submit(_list_day_objects, client, bucket, feed_path + day + "/")
+            for day in days_of_request
+        ]
+
+        for day, day_listing in zip(days_of_request, listings):
+            with METRICS.timer("plan"):
+                plan = plan_day(day_listing.result(), day, timezone_str, naming=naming, parse_date=parse_date)
+                selected = planned_objects(select_overlapping(plan, start_date, end_date))
+            METRICS.increment("objects_skipped", plan.num_rows - len(selected))
+            yield from selected
+    finally:
+        list_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _prefetch(pool, items, submit, depth: int = None):
+    """
+    Yield the results of ``submit(pool, item)`` in the order of ``items``, keeping at most ``depth`` items
+    submitted ahead of the one being consumed (``None`` submits everything upfront).
+    """
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(submit(pool, item))
+            while depth is not None and len(pending) > depth:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class ObjectPipeline:
+    """
+    Fetches objects into a temporary directory (or the ``cache``) and decodes them, for the fetchers and the tail.
+
+    Used as a context manager, the temporary directory is removed on exit. ``sources`` fetches objects in a
+    thread pool and ``read`` decodes them as ``read_batches`` does, with the read options given here.
+    ``range_reads`` and ``index_columns`` are those of ``fetch_batches``.
+    """
+
+    def __init__(
+            self,
+            client,
+            bucket: str,
+            retries: int = 3,
+            cache: ObjectCache = None,
+            range_reads: bool = False,
+            index_columns: IndexColumns = None,
+            batch_size: int = 65536,
+            columns: List[str] = None,
+            filters=None,
+            time_column: str = None,
+            start_date: datetime = None,
+            end_date: datetime = None,
+    ):
+        self.client = client
+        self.bucket = bucket
+        self.retries = retries
+        self.cache = cache
+        self.range_reads = range_reads
+        self.index_columns = index_columns
+        self.batch_size = batch_size
+        self.columns = columns
+        self.filters = filters
+        self.time_column = time_column
+        self.start_date = start_date
+        self.end_date = end_date
+        self.directory = None
+        self._tmpdir = None
+        self._pools = []
+
+    def __enter__(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.directory = self._tmpdir.name
+        return self
+
+    def __exit__(self, *exc_info):
+        # In-flight downloads must be done before the temporary directory goes away, sources may not be closed yet
+        for pool in self._pools:
+            pool.shutdown(wait=True, cancel_futures=True)
+        self._tmpdir.cleanup()
+
+    def file_path(self, index: int) -> str:
+        """Where the ``index``-th object is downloaded to outside of the cache."""
+        return os.path.join(self.directory, f"{index:06d}.parquet")
+
+    def fetch(self, index: int, file) -> str:
+        """A readable source for the ``index``-th object ``file``, see ``_fetch_object``."""
+        logger.debug("Fetching object %s", file.object_name)
+        return _fetch_object(self.client, self.bucket, file, self.file_path(index), self.retries, self.cache,
+                             self.range_reads, self.index_columns)
+
+    def sources(self, files, max_workers: int = 8, prefetch: int = None):
+        """
+        Yield ``(file, source)`` for ``files`` in order, fetched by up to ``max_workers`` threads and at most
+        ``prefetch`` ahead of the one being consumed (``None`` fetches everything upfront).
+        """
+        def submit(pool, indexed):
+            index, file = indexed
+            return pool.submit(lambda: (file, self.fetch(index, file)))
+
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._pools.append(pool)
+        try:
+            yield from _prefetch(pool, enumerate(files), submit, depth=prefetch)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def read(self, sources, limit: int = None, columns: List[str] = None) -> Generator[pa.RecordBatch, None, None]:
+        """The record batches of ``sources``, see ``read_batches``. Downloads are removed once read."""
+        return read_batches(
+            sources,
+            limit=limit,
+            batch_size=self.batch_size,
+            cleanup=self.cache is None,
+            columns=columns if columns is not None else self.columns,
+            filters=self.filters,
+            time_column=self.time_column,
+            start_date=self.start_date,
+            end_date=self.end_date,
+        )
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        for day in days_of_request:
-            if day in days_in_cloud_names:
-                day_path = service_path + day + "/"
-                for file in client.list_objects(bucket, day_path):
-                    if file.object_name.endswith("/"):
-                        continue
-                    current_date = datetime.strptime(day, "%Y-%m-%d")
-                    file_start_date, file_end_date = parse_date(current_date, file.object_name)
-                    file_start_date = time_zone.localize(file_start_date, is_dst=None)
-                    file_end_date = time_zone.localize(file_end_date, is_dst=None)
-                    print(file, file_start_date, file_end_date)
-                    if end_date <= file_start_date or start_date >= file_end_date:
-                        continue
-                    print("Fetching file:", file.object_name)
-                    client.fget_object(
-                        bucket,
-                        file.object_name,
-                        tmpdir
-                        + "/"
-                        + f"{file_start_date.strftime('%Y-%m-%d_%H-%M-%S')}_{file_end_date.strftime('%Y-%m-%d_%H-%M-%S')}.parquet",
-                    )
-
-        table = None
-
-        for file in os.listdir(tmpdir):
-            print(file)
-
-            for batch in pq.ParquetFile(tmpdir + "/" + file).iter_batches(batch_size=limit or 65536):
-                batch = Table.from_batches(batches=[batch])
-
-                if table is None:
-                    table = batch
-                else:
-                    table = pa.concat_tables([table, batch])
-
-                if table is not None and limit is not None and len(table) >= limit:
-                    break
-
-    if limit is not None and table is not None:
-        table = table[:limit]
 
-    return table
+def build_filter(
+        schema: pa.Schema,
+        filters=None,
+        time_column: str = None,
+        start_date: datetime = None,
+        end_date: datetime = None,
+) -> ds.Expression:
+    """
+    Build the dataset expression selecting the rows matching ``filters`` whose ``time_column`` falls in
+    [start_date, end_date).
+
+    ``filters`` is either an expression, used as is, or a mapping of column name to a value (equality) or
+    a list of values (membership). The time column may be a timestamp or a numeric POSIX time in seconds,
+    ``schema`` tells which one it is, and the bounds are built in its type.
+    """
+    if filters is None:
+        expression = None
+    elif isinstance(filters, ds.Expression):
+        expression = filters
+    else:
+        expression = None
+        for column, value in filters.items():
+            if isinstance(value, (list, tuple, set)):
+                condition = ds.field(column).isin(list(value))
+            else:
+                condition = ds.field(column) == value
+            expression = condition if expression is None else expression & condition
+
+    if time_column is None:
+        return expression
+
+    time_type = schema.field(time_column).type
+    bounds = []
+    for bound in (start_date, end_date):
+        if bound is None:
+            bounds.append(None)
+        elif pa.types.is_timestamp(time_type):
+            if time_type.tz is None:
+                bound = bound.astimezone(dt_timezone.utc).replace(tzinfo=None)
+            bounds.append(pa.scalar(bound).cast(time_type))
+        elif pa.types.is_integer(time_type):
+            # Arrow does not compare integer columns to floats, rows in [start, end) are those >= ceil(start)
+            # and < ceil(end) in whole seconds
+            bounds.append(pa.scalar(math.ceil(bound.timestamp())).cast(time_type))
+        else:
+            bounds.append(pa.scalar(bound.timestamp()).cast(time_type))
+
+    if bounds[0] is not None:
+        condition = ds.field(time_column) >= bounds[0]
+        expression = condition if expression is None else expression & condition
+    if bounds[1] is not None:
+        condition = ds.field(time_column) < bounds[1]
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def read_batches(
+        files,
+        limit: int = None,
+        batch_size: int = 65536,
+        cleanup: bool = False,
+        columns: List[str] = None,
+        filters=None,
+        time_column: str = None,
+        start_date: datetime = None,
+        end_date: datetime = None,
+):
+    """
+    Yield the record batches of ``files`` in order, stopping once ``limit`` rows have been yielded. With
+    ``cleanup`` each file is removed once it has been read. Files are either local paths or file objects,
+    which are closed once read.
+
+    Only ``columns`` are decoded and the filter is pushed down to the Parquet reader, so row groups whose
+    statistics cannot match are skipped without being read.
+    """
+    if limit is not None:
+        batch_size = max(1, min(batch_size, limit))
+
+    remaining = limit
+    for file in files:
+        logger.debug("Reading %s", file)
+        if isinstance(file, str):
+            fragment = ds.ParquetFileFormat().make_fragment(file, filesystem=fs.LocalFileSystem())
+            scan_options = None
+        else:
+            fragment = ds.ParquetFileFormat().make_fragment(file)
+            # Pre-buffering would request every selected row group at once, RemoteFile coalesces reads itself
+            scan_options = ds.ParquetFragmentScanOptions(pre_buffer=False)
+
+        def decode():
+            # Reading the footer and building the filter are part of decoding
+            filter_expression = build_filter(fragment.physical_schema, filters, time_column, start_date, end_date)
+            yield from fragment.to_batches(
+                columns=columns,
+                filter=filter_expression,
+                batch_size=batch_size,
+                fragment_scan_options=scan_options,
+            )
 
+        try:
+            for batch in METRICS.timed(decode(), "decode"):
+                if batch.num_rows == 0:
+                    continue
+                METRICS.increment("rows_decoded", batch.num_rows)
+                if remaining is not None:
+                    batch = batch.slice(0, remaining)
+                    remaining -= batch.num_rows
+                yield batch
 
+                if remaining is not None and remaining <= 0:
+                    return
+        finally:
+            if not isinstance(file, str):
+                file.close()
 
-riga_code = """
-from datetime import datetime, timedelta
-import os
-import tempfile
-import minio
-import pyarrow as pa
-import pyarrow.parquet as pq
-from pytz import timezone
-import pandas as pd
+        if cleanup and isinstance(file, str):
+            os.remove(file)
 
 
-def fetch_data_per_days(
+def fetch_batches(
         start_date,
         end_date,
         feed_path: str,
+        parse_date=None,
         access_key=os.environ.get("MINIO_ACCESS_KEY"),
         secret_key=os.environ.get("MINIO_SECRET_KEY"),
         timezone_str="Europe/Brussels",
-        output_dir=  "data"
-
-):
-    os.makedirs(output_dir, exist_ok=True)
-    days = [
-        start_date + timedelta(days=i)
-        for i in range((end_date - start_date).days)
-    ]
-    for day in days:
-        table = fetch_data(
-            day,
-            day + timedelta(days=1),
-            feed_path,
-            access_key=access_key,
-            secret_key=secret_key,
-            timezone_str=timezone_str,
-        )
-        if table is not None:
-            table.to_csv(f"data/{day.isoformat()[:10]}.csv", index=False)
-
-
-def fetch_data(
-        start_date={start_date},
-        end_date={end_date},
-        feed_path: str = {feed_path},
-        access_key=os.environ.get("MINIO_ACCESS_KEY"),
-        secret_key=os.environ.get("MINIO_SECRET_KEY"),
-        parse_date=None,
-        timezone_str="Europe/Brussels",
-) -> pd.DataFrame:
-    client = minio.Minio(
-        "minio-api.apps.emeralds.ari-aidata.eu",
-        access_key=access_key,
-        secret_key=secret_key,
-        secure=True,
-    )
+        limit: int = None,
+        max_workers: int = 8,
+        retries: int = 3,
+        cache: ObjectCache = None,
+        prefetch: int = 8,
+        batch_size: int = 65536,
+        columns: List[str] = None,
+        filters=None,
+        time_column: str = None,
+        range_reads: bool = False,
+        listing: ListingIndex = None,
+        client: minio.Minio = None,
+        bucket: str = None,
+        naming: str = None,
+        order_by: str = None,
+        id_column: str = None,
+        deduplicate: bool = False,
+        lateness: float = 60,
+        dedup_on: str = None,
+        index_columns: IndexColumns = None,
+) -> Generator[pa.RecordBatch, None, None]:
+    """
+    Yield the record batches of the objects of ``feed_path`` overlapping [start_date, end_date), in time order.
+
+    ``max_workers`` objects are downloaded at once, each retried ``retries`` times, and at most ``prefetch`` ahead
+    of the one being read (``None`` for all of them upfront). ``columns`` and ``filters`` (see ``build_filter``)
+    are pushed down to the reader, and ``time_column`` trims rows to the window. ``range_reads`` reads uncached
+    objects in place (see ``RemoteFile``), ``listing`` looks objects up in a ``ListingIndex``, and ``naming``
+    or ``parse_date`` parse their periods (see ``planning.NAMING_SCHEMES``, ``"range"`` by default).
+
+    ``order_by``, ``id_column``, ``lateness``, ``deduplicate`` and ``dedup_on`` order and deduplicate rows
+    through a streaming merge, see ``merge.merge_objects``. ``index_columns`` indexes the objects fetched
+    into the ``cache``, for ``fetch_matching``.
+    """
+    if naming is None and parse_date in (None, default_parse_date):
+        naming = "range"
+    if deduplicate and (order_by is None or id_column is None):
+        raise ValueError("deduplicate needs order_by and id_column")
+
+    client = client or get_client(access_key, secret_key)
+    bucket = bucket or DEFAULT_BUCKET
 
     time_zone = timezone(timezone_str)
 
@@ -243,189 +517,217 @@ def fetch_data(
     end_date = time_zone.localize(
         end_date,
     )
-    bucket = "public"
-    days_of_request = []
-    current_date = start_date
-    while current_date < end_date:
-        days_of_request.append(current_date.strftime("%Y-%m-%d"))
-        current_date = current_date + timedelta(days=1)
-    service_path = feed_path
-
-    days_in_cloud = list(client.list_objects(bucket, service_path))
-    days_in_cloud_names = [day.object_name.split("/")[-2] for day in days_in_cloud]
-
-    def parse_date(date, file_name):
-        hour = int(file_name.split("/")[-1].split(".")[0])
-        return (
-            datetime(date.year, date.month, date.day, hour, 0, 0),
-            datetime(date.year, date.month, date.day, hour, 59, 59)
-        )
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        for day in days_of_request:
-            if day in days_in_cloud_names:
-                day_path = service_path + day + "/"
-                for file in client.list_objects(bucket, day_path):
-                    if file.object_name.endswith("/"):
-                        continue
-                    current_date = datetime.strptime(day, "%Y-%m-%d")
-                    file_start_date, file_end_date = parse_date(current_date, file.object_name)
-                    file_start_date = time_zone.localize(file_start_date, is_dst=None)
-                    file_end_date = time_zone.localize(file_end_date, is_dst=None)
-
-                    if end_date <= file_start_date or start_date >= file_end_date:
-                        continue
-
-                    client.fget_object(
-                        bucket,
-                        file.object_name,
-                        tmpdir
-                        + "/"
-                        + f"{file_start_date.strftime('%Y-%m-%d_%H-%M-%S')}_{file_end_date.strftime('%Y-%m-%d_%H-%M-%S')}.parquet",
-                    )
-
-        table = None
-
-        for file in os.listdir(tmpdir):
-            current_table = pq.read_table(
-                tmpdir + "/" + file,
-            )
-
-            if table is None:
-                table = current_table
-            else:
-                table = pa.concat_tables([table, current_table])
-
-    return table.to_pandas()  # Convert to pandas DataFrame for easier handling
+    plan = _plan_objects(
+        client,
+        bucket,
+        feed_path,
+        start_date,
+        end_date,
+        timezone_str,
+        naming=naming,
+        parse_date=parse_date,
+        listing=listing,
+    )
 
-"""
+    with ObjectPipeline(client, bucket, retries, cache, range_reads, index_columns, batch_size, columns, filters,
+                        time_column, start_date, end_date) as pipeline:
+        sources = pipeline.sources(plan, max_workers, prefetch)
+        if order_by is None:
+            yield from pipeline.read((source for _, source in sources), limit=limit)
+            return
+
+        read_columns = merge_columns(columns, order_by, id_column, dedup_on)
+        objects = ((file.start.timestamp(), pipeline.read([source], columns=read_columns)) for file, source in sources)
+        remaining = limit
+        for batch in merge_objects(objects, order_by, id_column, deduplicate, lateness, batch_size, dedup_on):
+            if read_columns != columns:
+                batch = batch.select(columns)
+            if remaining is not None:
+                batch = batch.slice(0, remaining)
+                remaining -= batch.num_rows
+            yield batch
+            if remaining is not None and remaining <= 0:
+                return
 
-all_code = """
-from datetime import datetime, timedelta
-import os
-import tempfile
-import minio
-import pyarrow as pa
-import pyarrow.parquet as pq
-from pytz import timezone
-import pandas as pd
 
-def fetch_data_per_days(
-        start_date={start_date},
-        end_date={end_date},
-        feed_path: str = {feed_path},
+def fetch_data(
+        start_date,
+        end_date,
+        feed_path: str,
+        parse_date=None,
         access_key=os.environ.get("MINIO_ACCESS_KEY"),
         secret_key=os.environ.get("MINIO_SECRET_KEY"),
         timezone_str="Europe/Brussels",
-        output_dir=  "data"
-
-):
-    os.makedirs(output_dir, exist_ok=True)
-    days = [
-        start_date + timedelta(days=i)
-        for i in range((end_date - start_date).days)
-    ]
-    for day in days:
-        table = fetch_data(
-            day,
-            day + timedelta(days=1),
-            feed_path,
-            access_key=access_key,
-            secret_key=secret_key,
-            timezone_str=timezone_str,
+        limit: int = None,
+        max_workers: int = 8,
+        retries: int = 3,
+        cache: ObjectCache = None,
+        batch_size: int = 65536,
+        combine_chunks: bool = False,
+        columns: List[str] = None,
+        filters=None,
+        time_column: str = None,
+        range_reads: bool = False,
+        listing: ListingIndex = None,
+        client: minio.Minio = None,
+        bucket: str = None,
+        naming: str = None,
+        spill: bool = False,
+        order_by: str = None,
+        id_column: str = None,
+        deduplicate: bool = False,
+        lateness: float = 60,
+        dedup_on: str = None,
+        index_columns: IndexColumns = None,
+) -> pa.Table:
+    """
+    Fetch the objects of ``feed_path`` overlapping [start_date, end_date) as one table, or None if there are none.
+
+    Arguments are those of ``fetch_batches``. Reading stops after ``limit`` rows and ``combine_chunks``
+    concatenates the columns of the result. With ``spill`` the result is memory mapped from an Arrow IPC file
+    in the cache directory, reused by later calls once the window has settled (see ``planning.is_settled``).
+    """
+    if spill:
+        # The data of a window grows until its objects have all landed: files written before it settled are
+        # keyed apart and never reused
+        settled = is_settled(end_date, timezone_str)
+        path = spill_path(
+            cache.directory if cache is not None else None,
+            bucket or DEFAULT_BUCKET, feed_path, start_date, end_date, timezone_str, limit, columns,
+            repr(filters), time_column, naming, order_by, id_column, deduplicate, lateness, dedup_on,
+            settled,
         )
-        if table is not None:
-            table.to_csv(f"data/{day.isoformat()[:10]}.csv", index=False)
+        if settled and os.path.exists(path):
+            return open_spilled(path)
 
-
-
-def fetch_data(
-        start_date={start_date},
-        end_date={end_date},
-        feed_path: str = {feed_path},
-        access_key=os.environ.get("MINIO_ACCESS_KEY"),
-        secret_key=os.environ.get("MINIO_SECRET_KEY"),
-        timezone_str="Europe/Brussels",
-) -> pd.DataFrame:
-    client = minio.Minio(
-        "minio-api.apps.emeralds.ari-aidata.eu",
+    batches = fetch_batches(
+        start_date,
+        end_date,
+        feed_path,
+        parse_date=parse_date,
         access_key=access_key,
         secret_key=secret_key,
-        secure=True,
+        timezone_str=timezone_str,
+        limit=limit,
+        max_workers=max_workers,
+        retries=retries,
+        cache=cache,
+        # With a limit only the next object is downloaded ahead, the only one waited for once the limit is hit
+        prefetch=1 if limit is not None else 8 if spill else None,
+        batch_size=batch_size,
+        columns=columns,
+        filters=filters,
+        time_column=time_column,
+        range_reads=range_reads,
+        listing=listing,
+        client=client,
+        bucket=bucket,
+        naming=naming,
+        order_by=order_by,
+        id_column=id_column,
+        deduplicate=deduplicate,
+        lateness=lateness,
+        dedup_on=dedup_on,
+        index_columns=index_columns,
     )
+    if spill:
+        return spill_batches(batches, path)
+
+    # Collecting the batches and building the table once avoids re-wrapping a growing chunk list per batch
+    batches = list(batches)
+    if not batches:
+        return None
+
+    with METRICS.timer("concat"):
+        table = Table.from_batches(batches)
+        if combine_chunks:
+            table = table.combine_chunks()
+    return table
 
-    time_zone = timezone(timezone_str)
 
-    start_date = time_zone.localize(
+def fetch_matching(
         start_date,
-    )
-    end_date = time_zone.localize(
         end_date,
+        feed_path: str,
+        index_columns: IndexColumns,
+        ids: List = None,
+        bbox=None,
+        parse_date=None,
+        access_key=os.environ.get("MINIO_ACCESS_KEY"),
+        secret_key=os.environ.get("MINIO_SECRET_KEY"),
+        timezone_str="Europe/Brussels",
+        max_workers: int = 8,
+        retries: int = 3,
+        cache: ObjectCache = None,
+        batch_size: int = 65536,
+        columns: List[str] = None,
+        listing: ListingIndex = None,
+        client: minio.Minio = None,
+        bucket: str = None,
+        naming: str = None,
+) -> pa.Table:
+    """
+    The rows of the objects of ``feed_path`` overlapping [start_date, end_date) of one of the entities ``ids``
+    and/or inside ``bbox`` (min longitude, min latitude, max longitude, max latitude), or None if there are
+    none.
+
+    Objects go through the ``cache`` (the default one if not given) and are indexed on ``index_columns`` (see
+    ``spatial_index``) the first time: an entity to rows map and a grid of the positions per row group, stored
+    next to them. Only the row groups holding matching rows are then read, the others are skipped. Objects
+    are selected by their name only, rows are not trimmed to the window.
+    """
+    if ids is None and bbox is None:
+        raise ValueError("fetch_matching needs ids, a bbox or both")
+    if naming is None and parse_date in (None, default_parse_date):
+        naming = "range"
+
+    client = client or get_client(access_key, secret_key)
+    bucket = bucket or DEFAULT_BUCKET
+    cache = cache or ObjectCache()
+
+    time_zone = timezone(timezone_str)
+    plan = _plan_objects(
+        client,
+        bucket,
+        feed_path,
+        time_zone.localize(start_date),
+        time_zone.localize(end_date),
+        timezone_str,
+        naming=naming,
+        parse_date=parse_date,
+        listing=listing,
     )
-    bucket = "public"
-    days_of_request = []
-    current_date = start_date
-    while current_date < end_date:
-        days_of_request.append(current_date.strftime("%Y-%m-%d"))
-        current_date = current_date + timedelta(days=1)
-    service_path = feed_path
-
-    days_in_cloud = list(client.list_objects(bucket, service_path))
-    days_in_cloud_names = [day.object_name.split("/")[-2] for day in days_in_cloud]
 
-    def parse_date(date, file_name):
-        start_time = file_name.split("/")[-1].split("_")[0]
-        end_time = (
-            file_name.split("/")[-1]
-            .split("_")[2]
-            .replace(".parquet", "")
-        )
+    batches = []
+    with ObjectPipeline(client, bucket, retries, cache, index_columns=index_columns) as pipeline:
+        for _, path in pipeline.sources(plan, max_workers, prefetch=max_workers):
+            batches += read_matching(path, index_columns, ids=ids, bbox=bbox, columns=columns,
+                                     batch_size=batch_size)
+    if not batches:
+        return None
 
-        date_str = date.strftime("%Y-%m-%d")
-        file_start_date = datetime.strptime(
-            date_str + "_" + start_time, "%Y-%m-%d_%H-%M-%S"
-        )
-        file_end_date = datetime.strptime(
-            date_str + "_" + end_time, "%Y-%m-%d_%H-%M-%S"
-        )
-        
-        if file_start_date == file_end_date:
-            file_end_date = file_start_date + timedelta(days=1)
-
-        return file_start_date, file_end_date
-
-    with tempfile.TemporaryDirectory() as tmpdir:
-        for day in days_of_request:
-            if day in days_in_cloud_names:
-                day_path = service_path + day + "/"
-                for file in client.list_objects(bucket, day_path):
-                    current_date = datetime.strptime(day, "%Y-%m-%d")
-                    file_start_date, file_end_date = parse_date(current_date, file.object_name)
-                    file_start_date = time_zone.localize(file_start_date, is_dst=None)
-                    file_end_date = time_zone.localize(file_end_date, is_dst=None)
-
-                    if end_date <= file_start_date or start_date >= file_end_date:
-                        continue
-
-                    client.fget_object(
-                        bucket,
-                        file.object_name,
-                        tmpdir
-                        + "/"
-                        + f"{file_start_date.strftime('%Y-%m-%d_%H-%M-%S')}_{file_end_date.strftime('%Y-%m-%d_%H-%M-%S')}.parquet",
-                    )
-
-        table = None
-
-        for file in os.listdir(tmpdir):
-            current_table = pq.read_table(
-                tmpdir + "/" + file,
-            )
+    with METRICS.timer("concat"):
+        return Table.from_batches(batches)
 
-            if table is None:
-                table = current_table
-            else:
-                table = pa.concat_tables([table, current_table])
 
-    return table.to_pandas()  # Convert to pandas DataFrame for easier handling
-"""
+def fetch_feed(
+        provider,
+        feed_type,
+        start_date: datetime,
+        end_date: datetime,
+        **kwargs,
+) -> pa.Table:
+    """
+    Fetch a feed of a registered provider (``providers.PROVIDERS``) over [start_date, end_date).
+
+    ``provider`` is a ``Provider`` or its key and ``feed_type`` a ``FeedType`` or its value. The feed path,
+    naming scheme, timezone and tuning come from the registry, ``kwargs`` are passed to ``fetch_data`` and
+    override them. The table is sorted as the provider declares, if it has the sort columns.
+    """
+    if isinstance(provider, str):
+        provider = get_provider(provider)
+    table = fetch_data(start_date, end_date, **{**provider.fetch_kwargs(FeedType(feed_type)), **kwargs})
+    if table is not None and provider.sort and all(name in table.schema.names for name, _ in provider.sort):
+        table = table.sort_by(list(provider.sort))
+    return table
@@ -1,220 +1,198 @@
-import json
-import time
-import uuid
+import logging
+import os
 from datetime import datetime
 from datetime import timedelta
-from io import BytesIO
 
-import plotly.express
-import pyarrow.parquet as pq
-import pydeck
+import pyarrow.compute as pc
 import streamlit as st
-from pyarrow import csv
 from pytz import timezone
 from streamlit_calendar_input import calendar_input
-from streamlit_downloader import downloader
 
-from fetch import FeedType, get_available_dates, fetch_data, riga_code, all_code
+from cache import ObjectCache
+from codegen import generate_code
+from export import export_to_spool
+from fetch import get_available_dates, fetch_batches, fetch_data
+from jobs import DONE, FAILED, CANCELLED, JobRunner
+from listing import ListingIndex
+from map_view import map_view, points_layer, trips_layer
+from metrics import METRICS, METRICS_PORT, serve_prometheus
+from providers import PROVIDERS, FeedType
+from result_cache import ResultCache
+from spill import to_pandas
+from storage import get_client
+from tail import FeedTail
+from tiles import TileStore
+from trajectory import build_trips
 
 st.set_page_config(
     page_title="Emeralds - GTFS RT Data Viewer",
     page_icon="favicon.ico",
 )
 
-if 'download' not in st.session_state:
-    st.session_state['download'] = False
-    st.session_state["current_fetch_day"] = None
-    st.session_state["current_fetch_hour"] = None
+logging.basicConfig(level=os.environ.get("EMERALDS_LOG_LEVEL", "WARNING").upper())
 
+@st.cache_resource
+def get_object_cache():
+    # Shared by every session, the cache directory outlives the Streamlit process
+    return ObjectCache()
 
-def parse_date_riga(date, file_name):
-    hour = int(file_name.split("/")[-1].split(".")[0])
-    return (
-        datetime(date.year, date.month, date.day, hour, 0, 0),
-        datetime(date.year, date.month, date.day, hour, 59, 59)
-    )
 
+@st.cache_resource
+def get_job_runner():
+    # Bulk downloads run in the background of the server, sessions only poll their job
+    return JobRunner()
 
-providers = {
-    "riga": {
-        "name": "Riga Public Transport",
-        "feeds": {
-            FeedType.VEHICLE_POSITION: "data/riga/flattened_position/",
-            FeedType.TRIP_UPDATE: "data/riga/flattened_trip_update/",
-        },
-        "file_to_period": parse_date_riga,
-        "fetch_time_column": "timestamp",
-        "timezone": "Europe/Riga",
-        "code": riga_code,
-        "columns": {
-            "latitude": "vehicle_position_latitude",
-            "longitude": "vehicle_position_longitude",
-            "id": "id"
-        }
-    },
-    "ovapi": {
-        "name": "OVAPI",
-        "path": "data/ovapi",
-        "feeds": {
-            FeedType.VEHICLE_POSITION: "data/ovapi/VehiclePosition/",
-            FeedType.ALERT: "data/ovapi/Alert/",
-            FeedType.TRIP_UPDATE: "data/ovapi/TripUpdate/",
-        },
-        "fetch_time_column": "fetchTime",
-        "timezone": "Europe/Brussels",
-        "code": all_code,
-    },
-    "ovapi-train": {
-        "name": "OVAPI train",
-        "path": "data/ovapi-train",
-        "feeds": {
-            FeedType.TRIP_UPDATE: "data/ovapi-train/TripUpdate/",
-        },
-        "fetch_time_column": "fetchTime",
-        "timezone": "Europe/Brussels",
-        "code": all_code,
-    },
-    "york": {
-        "name": "YORK",
-        "path": "data/york",
-        "feeds": {
-            FeedType.VEHICLE_POSITION: "data/york/VehiclePosition/",
-        },
-        "fetch_time_column": "fetchTime",
-        "timezone": "Europe/London",
-        "code": all_code,
-        "columns": {
-            "id": "trip_tripId"
-        }
-    }
-}
 
-st.logo("logo.png", )
-st.title("Emeralds - GTFS RT Data Viewer")
-st.text(
-    "This application allows you to view and download GTFS RT data from various providers, by selecting a feed and a date.")
-feed = st.selectbox("Select a GTFS RT feed", list(providers.keys()), key="feed_selector", placeholder="Select a feed",
-                    index=None)
+@st.cache_resource
+def get_result_cache():
+    # Shared by every session: reruns and other analysts looking at the same hour don't fetch it again
+    return ResultCache()
+
+
+@st.cache_resource
+def get_metrics_server():
+    # One exporter for the whole server, started by the first session
+    return serve_prometheus(METRICS_PORT) if METRICS_PORT else None
 
 
-def bulk_dl(start_date=None, end_date=None):
-    if 'current_fetch_day' not in st.session_state or st.session_state.current_fetch_day is None:
-        st.session_state.current_fetch_day = start_date
-        st.session_state.current_fetch_hour = 0
+object_cache = get_object_cache()
+result_cache = get_result_cache()
+job_runner = get_job_runner()
+get_metrics_server()
 
-    day = st.session_state.current_fetch_day
-    hour = st.session_state.current_fetch_hour
+with st.sidebar.expander("Object cache"):
+    st.json(object_cache.stats())
 
-    st.text(f"Downloading data for {day.date()} hour {hour}:00 to {hour + 1}:00.")
+with st.sidebar.expander("Result cache"):
+    st.json(result_cache.stats())
 
-    start_dt = day + timedelta(hours=hour)
-    end_dt = start_dt + timedelta(hours=1)
-    print("yo")
-    table = fetch_data(
-        start_date=start_dt,
-        end_date=end_dt,
-        feed_path=feed_path,
-        parse_date=provider.get('file_to_period', None),
-        timezone_str=provider.get('timezone', 'UTC'),
+with st.sidebar.expander("Fetch metrics"):
+    st.json(METRICS.snapshot())
+
+providers = PROVIDERS
+
+
+@st.cache_resource
+def get_tile_store(feed, feed_path):
+    # Tiles are derived once per object and shared by every session
+    provider = providers[feed]
+    return TileStore(
+        get_listing_index(feed, feed_path),
+        id_column=provider.column('id'),
+        time_column=provider.time_column,
+        latitude_column=provider.column('latitude'),
+        longitude_column=provider.column('longitude'),
     )
 
-    print(table)
-
-    # Update hour and day
-    st.session_state.current_fetch_hour += 1
-    if st.session_state.current_fetch_hour >= 24:
-        st.session_state.current_fetch_hour = 0
-        st.session_state.current_fetch_day += timedelta(days=1)
-
-    # Stop condition
-    if st.session_state.current_fetch_day > end_date:
-        st.session_state.current_fetch_day = None
-        st.session_state.current_fetch_hour = None
-        st.session_state.download = False
-        return
-
-    print(table)
-    # Save table
-    if table:
-        download_id = str(uuid.uuid4())
-        file_path = f"{download_id}.csv"
-
-        columns_todrop = ["multiCarriageDetails", "trip_modifiedTrip"]
-        try:
-            table = table.drop(columns_todrop)
-        except Exception:
-            pass
-
-        csv_string = csv.write_csv(table, output_file=file_path)
-        del table
-        downloader(
-            open(file_path, "rb").read(),
-            f"{day.isoformat()[:10]}_{hour:02d}_to_{(hour + 1) % 24:02d}.csv",
-            "text/csv"
-        )
-        print("Downloaded file:", file_path)
-        # rm
-        import os
-        os.remove(file_path)
-
-    time.sleep(1)
-    st.rerun()
+
+@st.cache_resource
+def get_listing_index(feed, feed_path):
+    # One index per feed, shared by every session and refreshed incrementally
+    provider = providers[feed]
+    return ListingIndex(
+        feed_path,
+        provider.parse_date,
+        timezone_str=provider.timezone,
+        naming=provider.naming,
+    )
+
+
+st.logo("logo.png", )
+st.title("Emeralds - GTFS RT Data Viewer")
+st.text(
+    "This application allows you to view and download GTFS RT data from various providers, by selecting a feed and a date.")
+feed = st.selectbox("Select a GTFS RT feed", list(providers.keys()), key="feed_selector", placeholder="Select a feed",
+                    index=None)
 
 
 if feed:
     provider = providers[feed]
-    st.subheader(f"Selected Provider: {provider['name']}")
+    st.subheader(f"Selected Provider: {provider.name}")
     st.write("Available Feeds:")
-    for feed_type in provider['feeds']:
+    for feed_type in provider.feeds:
         st.write(f"- {feed_type.value}")
 
     # Choose feed type
-    feed_type = st.selectbox("Select a feed type", [ft.value for ft in provider['feeds']], key="feed_type_selector",
+    feed_type = st.selectbox("Select a feed type", [ft.value for ft in provider.feeds], key="feed_type_selector",
                              placeholder="Select a feed type", index=None)
 
     if feed_type:
         feed_type_enum = FeedType(feed_type)
-        feed_path = provider['feeds'][feed_type_enum]
+        feed_path = provider.feeds[feed_type_enum]
+        listing = get_listing_index(feed, feed_path)
 
-        tab1, tab2 = st.tabs(["General", "Bulk download"])
+        tab1, tab2, tab3, tab4 = st.tabs(["General", "Bulk download", "Overview", "Live"])
         with tab2:
             start_date = st.date_input(key="start_date", label="Start Date", value=datetime.now() - timedelta(days=7))
             end_date = st.date_input(key="end_date", label="End Date", value=datetime.now())
             start_date = datetime(start_date.year, start_date.month, start_date.day)
             end_date = datetime(end_date.year, end_date.month, end_date.day)
-            if feed_type_enum != FeedType.VEHICLE_POSITION:
-                st.warning(
-                    "Bulk download on web is only supported for vehicle position feeds. Please use the code below")
-            elif provider['name'] == 'OVAPI':
-                st.warning("Bulk download on web is not supported for OVAPI, Streamlit cloud does not offer enough RAM")
-            else:
-                st.write(
-                    "Specify a start and end date. Then click on download button. CSV files for each day will be downloaded. For large provider such as OVAPI you can expect to wait close to a minute per file.")
-
-                download = st.button("Download")
-                if download:
-                    st.session_state["download"] = True
-
-                if st.session_state.download:
-                    if st.button("Stop download"):
-                        st.session_state.download = False
-                        st.session_state.current_fetch_day = None
+            st.write(
+                "Specify a start and end date, then click on the download button. The whole range is fetched in the background and packed into a single zip archive, with one folder per day.")
+            bulk_format = st.radio("Format", ["parquet", "csv"], horizontal=True, key="bulk_format",
+                                   format_func=lambda value: {"parquet": "Parquet", "csv": "CSV"}[value])
+            # Trip updates carry one row per stop for the same entity and time, only positions repeat
+            merge_kwargs = {}
+            if feed_type_enum == FeedType.VEHICLE_POSITION and st.checkbox(
+                    "Order rows by time and drop repeated vehicle snapshots", key="bulk_deduplicate"):
+                merge_kwargs = {
+                    "order_by": provider.time_column,
+                    "id_column": provider.column('id'),
+                    "deduplicate": True,
+                }
+                # Polls repeat the snapshot of a vehicle with its own report time, not with the poll time
+                if provider.report_time_column != provider.time_column:
+                    merge_kwargs["dedup_on"] = provider.report_time_column
+
+            if st.button("Download"):
+                previous = job_runner.get(st.session_state.get("bulk_job_id"))
+                if previous is not None:
+                    job_runner.remove(previous.id)
+                job = job_runner.submit(
+                    start_date,
+                    end_date + timedelta(days=1),
+                    format=bulk_format,
+                    cache=object_cache,
+                    listing=listing,
+                    **provider.fetch_kwargs(feed_type_enum, stream=True),
+                    **merge_kwargs,
+                )
+                st.session_state["bulk_job_id"] = job.id
+
+            job = job_runner.get(st.session_state.get("bulk_job_id"))
+            if job is not None:
+                polling = not job.finished
+
+                # Only the status is rerun while the job runs, the page is rerun once when it finishes
+                @st.fragment(run_every=1 if polling else None)
+                def bulk_job_status():
+                    if polling and job.finished:
+                        st.rerun()
+
+                    if job.status == DONE:
+                        st.success(f"{job.days_total} days, {job.rows} rows ready.")
+                        with open(job.path, "rb") as archive:
+                            st.download_button(
+                                label="Download archive",
+                                data=archive,
+                                file_name=f"{feed_type}_{start_date.strftime('%Y-%m-%d')}_{end_date.strftime('%Y-%m-%d')}.zip",
+                                mime="application/zip",
+                            )
+                    elif job.status == FAILED:
+                        st.error(f"Download failed: {job.error}")
+                    elif job.status == CANCELLED:
+                        st.info("Download cancelled.")
+                    else:
+                        st.progress(job.progress, text=f"{job.days_done}/{job.days_total} days, {job.rows} rows")
+                        if st.button("Stop download"):
+                            job.cancel()
 
-                if st.session_state.download:
-                    bulk_dl(
-                        start_date=datetime(start_date.year, start_date.month, start_date.day),
-                        end_date=datetime(end_date.year, end_date.month, end_date.day),
-                    )
+                bulk_job_status()
 
             st.subheader("Get the code")
 
-            code = provider['code']
-            code = code.replace('{start_date}',
-                                f'datetime({start_date.year}, {start_date.month}, {start_date.day}, {start_date.hour}, {start_date.minute}, 0, 0)')
-            code = code.replace('{end_date}',
-                                f'datetime({end_date.year}, {end_date.month}, {end_date.day}, {end_date.hour}, {end_date.minute}, 0, 0)')
-            code = code.replace('{feed_path}', f'"{feed_path}"')
-            file_name = f"{provider['name'].replace(' ', '_').lower()}_fetch_data.py"
+            code = generate_code(provider, feed_type_enum, start_date, end_date)
+            file_name = f"{provider.name.replace(' ', '_').lower()}_fetch_data.py"
             st.download_button(
                 label="Download Code",
                 data=code,
@@ -225,18 +203,67 @@ if feed:
             st.text(
                 "Once, you have downloaded the code, you can run it in your local environment to fetch the data, but first you need to install the required packages:")
             st.code("pip install pytz pyarrow minio pandas")
-            st.code(f"""from {file_name.split('.')[0]} import fetch_data
+            st.code(f"""from {file_name.split('.')[0]} import fetch_data_per_days
 from datetime import datetime
 
-df = fetch_data_per_days(
+fetch_data_per_days(
 start_date=datetime({start_date.year}, {start_date.month}, {start_date.day}, {start_date.hour}, {start_date.minute}),
 end_date=datetime({end_date.year}, {end_date.month}, {end_date.day}, {end_date.hour}, {end_date.minute}),
 access_key="YOUR_ACCESS_KEY",
 secret_key="YOUR_SECRET_KEY",
 )
 """)
+        with tab4:
+            st.write(
+                "Rows of the objects landing in the feed, as they land. The first poll reads the last hour, the next ones only fetch the new objects.")
+            live_key = f"live_{feed_path}"
+            if not st.toggle("Follow the feed", key="live_follow"):
+                st.session_state.pop(live_key, None)
+            else:
+                if live_key not in st.session_state:
+                    since = datetime.now(timezone(provider.timezone)).replace(tzinfo=None) - timedelta(hours=1)
+                    st.session_state[live_key] = {
+                        "tail": FeedTail(since=since, cache=object_cache,
+                                         **provider.fetch_kwargs(feed_type_enum, stream=True)),
+                        "rows": 0,
+                        "delta": None,
+                    }
+                live_state = st.session_state[live_key]
+
+                # Each run only lists past the newest object seen and fetches what landed since
+                @st.fragment(run_every=provider.tuning.poll_interval)
+                def live_view():
+                    tail = live_state["tail"]
+                    delta = tail.fetch_new()
+                    if delta is not None:
+                        live_state["rows"] += delta.num_rows
+                        live_state["delta"] = delta
+
+                    col1, col2 = st.columns(2)
+                    col1.metric("Rows received", live_state["rows"],
+                                delta=delta.num_rows if delta is not None else None)
+                    col2.metric("Last poll", datetime.now(timezone(provider.timezone)).strftime("%H:%M:%S"))
+                    st.caption(f"Newest object: {tail.cursor or 'none yet'}")
+
+                    delta = live_state["delta"]
+                    if delta is None:
+                        st.info("No object since the last hour yet.")
+                        return
+                    if feed_type_enum == FeedType.VEHICLE_POSITION:
+                        positions = delta.select([provider.column('longitude'), provider.column('latitude')])
+                        map_view(
+                            [points_layer(positions, provider.column('longitude'), provider.column('latitude'),
+                                          get_fill_color=[255, 0, 0, 160], radius_min_pixels=2, get_radius=5)],
+                            latitude=pc.mean(positions[provider.column('latitude')]).as_py(),
+                            longitude=pc.mean(positions[provider.column('longitude')]).as_py(),
+                            zoom=10,
+                            height=600,
+                        )
+                    st.dataframe(delta.slice(0, 100).to_pandas())
+
+                live_view()
         with tab1:
-            available_dates = get_available_dates(feed_path)
+            available_dates = get_available_dates(feed_path, listing=listing)
 
             st.write("Available Dates:")
             if not available_dates:
@@ -257,97 +284,78 @@ secret_key="YOUR_SECRET_KEY",
                         start_date = selected_date.replace(hour=hour, minute=0, second=0, microsecond=0)
                         end_date = start_date + timedelta(hours=1)
 
-                        tz = timezone(
-                            provider.get('timezone', 'Europe/Brussels')
-                        )
+                        tz = timezone(provider.timezone)
+                        limit = 100 if feed_type_enum == FeedType.TRIP_UPDATE else None
                         with st.spinner("Fetching data..."):
-                            data = fetch_data(start_date, end_date, feed_path=feed_path,
-                                              parse_date=provider.get('file_to_period', None),
-                                              timezone_str=provider.get('timezone', 'UTC'),
-                                              limit=100 if feed_type_enum == FeedType.TRIP_UPDATE else None
-                                              )
-
-                        if data:
-                            class ProxyParquetBytesIO(BytesIO):
-                                def __init__(self, table):
-                                    super().__init__()
-                                    self.table = table
-
-                                def getvalue(self, *args, **kwargs):
-                                    bytes_io = BytesIO()
-                                    pq.write_table(self.table, bytes_io)
-                                    bytes_io.seek(0)
-                                    return bytes_io.getvalue()
-
-
-                            class ProxyCSVBytesIO(BytesIO):
-                                def __init__(self, table):
-                                    super().__init__()
-                                    self.table = table
-
-                                def getvalue(self, *args, **kwargs):
-                                    bytes_io = BytesIO()
-                                    csv.write_csv(self.table, bytes_io)
-                                    bytes_io.seek(0)
-                                    return bytes_io.getvalue()
-
-
-                            class ProxyJSONBytesIO(BytesIO):
-                                def __init__(self, table):
-                                    super().__init__()
-                                    import pyarrow as pa
-                                    self.table: pa.Table = table
-
-                                def getvalue(self, *args, **kwargs):
-                                    bytes_io = BytesIO()
-                                    bytes_io.seek(0)
-                                    data = self.table.to_pylist()
-                                    bytes_io.write(json.dumps(data).encode('utf-8'))
+                            data = result_cache.get_or_fetch(
+                                feed_path,
+                                start_date,
+                                end_date,
+                                lambda: fetch_data(start_date, end_date,
+                                                   limit=limit,
+                                                   cache=object_cache,
+                                                   # The limited preview only needs the first row group
+                                                   range_reads=feed_type_enum == FeedType.TRIP_UPDATE,
+                                                   listing=listing,
+                                                   # Memory mapped, the sessions showing the same hour share its pages
+                                                   spill=True,
+                                                   **provider.fetch_kwargs(feed_type_enum),
+                                                   ),
+                                limit=limit,
+                                ttl=result_cache.ttl_for(end_date, provider.timezone, provider.tuning.cache_ttl),
+                            )
 
-                                    return bytes_io.getvalue()
+                        def export_hour(format):
+                            # Deferred until the button is clicked, then streamed batch by batch to a spooled file
+                            def export():
+                                with export_to_spool(fetch_batches(
+                                        start_date,
+                                        end_date,
+                                        cache=object_cache,
+                                        listing=listing,
+                                        **provider.fetch_kwargs(feed_type_enum, stream=True),
+                                ), format) as spool:
+                                    return spool.read()
 
+                            return export
 
+                        if data:
                             if st.button("Prepare Data for Download"):
                                 if feed == "ovapi" and feed_type_enum == FeedType.TRIP_UPDATE:
                                     st.warning(
                                         "The OVAPI Trip Update feed is too large to download. Please use the code provided below to fetch the data in your local environment.")
                                     st.stop()
                                 else:
-                                    data = fetch_data(
-                                        start_date,
-                                        end_date,
-                                        feed_path=feed_path,
-                                        parse_date=provider.get('file_to_period', None),
-                                        timezone_str=provider.get('timezone', 'UTC'),
-                                        limit=None
-                                    )
                                     col1, col2, col3 = st.columns(3)
 
                                     with col1:
                                         st.download_button(
                                             label="Download as Parquet",
-                                            data=ProxyParquetBytesIO(data),
+                                            data=export_hour("parquet"),
                                             file_name=f"{feed_type}_{start_date.strftime('%Y-%m-%d_%H-%M')}.parquet",
                                             mime="application/octet-stream"
                                         )
 
+                                    with col2:
+                                        st.download_button(
+                                            label="Download as CSV",
+                                            data=export_hour("csv"),
+                                            file_name=f"{feed_type}_{start_date.strftime('%Y-%m-%d_%H-%M')}.csv",
+                                            mime="text/csv"
+                                        )
+
                                     with col3:
                                         st.download_button(
                                             label="Download as JSON",
-                                            data=ProxyJSONBytesIO(data),
-                                            file_name=f"{feed_type}_{start_date.strftime('%Y-%m-%d_%H-%M')}.json",
-                                            mime="application/json"
+                                            data=export_hour("json"),
+                                            file_name=f"{feed_type}_{start_date.strftime('%Y-%m-%d_%H-%M')}.jsonl",
+                                            mime="application/x-ndjson"
                                         )
 
                         st.subheader("Get the code")
 
-                        code = provider['code']
-                        code = code.replace('{start_date}',
-                                            f'datetime({start_date.year}, {start_date.month}, {start_date.day}, {start_date.hour}, {start_date.minute}, 0, 0)')
-                        code = code.replace('{end_date}',
-                                            f'datetime({end_date.year}, {end_date.month}, {end_date.day}, {end_date.hour}, {end_date.minute}, 0, 0)')
-                        code = code.replace('{feed_path}', f'"{feed_path}"')
-                        file_name = f"{provider['name'].replace(' ', '_').lower()}_fetch_data.py"
+                        code = generate_code(provider, feed_type_enum, start_date, end_date)
+                        file_name = f"{provider.name.replace(' ', '_').lower()}_fetch_data.py"
                         st.download_button(
                             label="Download the code",
                             data=code,
@@ -375,7 +383,7 @@ df = fetch_data(
 
                         st.subheader("Data Preview")
                         st.write("First 100 rows of the data:")
-                        st.write(data[:100].to_pandas())
+                        st.write(to_pandas(data.slice(0, 100)))
 
                         with st.expander("Show data schema"):
                             schema_str = data.schema.to_string()
@@ -383,61 +391,47 @@ df = fetch_data(
 
                         if feed_type == FeedType.VEHICLE_POSITION.value and data:
                             st.subheader("Data Visualization")
-                            columns = provider.get('columns', {})
-                            fetch_time_column = provider.get('fetch_time_column', 'fetchTime')
-                            latitude_column = columns.get('latitude', 'position_latitude')
-                            longitude_column = columns.get('longitude', 'position_longitude')
-
-                            figure = plotly.express.scatter_mapbox(
-                                data_frame=data.to_pandas().head(10000),
-                                lat=latitude_column,
-                                lon=longitude_column,
+                            fetch_time_column = provider.time_column
+                            latitude_column = provider.column('latitude')
+                            longitude_column = provider.column('longitude')
+
+                            vehicle_id = provider.column('id')
+                            # Only the id, time and position columns are needed below, don't convert the rest
+                            data = data.select([vehicle_id, fetch_time_column, latitude_column, longitude_column])
+
+                            mean_lat = pc.mean(data[latitude_column]).as_py()
+                            mean_lon = pc.mean(data[longitude_column]).as_py()
+
+                            # Every position of the hour is sent, as binary, and aggregated on the GPU if needed
+                            map_type = st.radio(
+                                "Map",
+                                ["scatter", "hexagon", "screengrid"],
+                                horizontal=True,
+                                key="map_type",
+                                format_func=lambda value: {
+                                    "scatter": "Points",
+                                    "hexagon": "Hexagons",
+                                    "screengrid": "Screen grid",
+                                }[value],
+                            )
+                            layer_props = {
+                                "scatter": dict(get_fill_color=[255, 0, 0, 160], radius_min_pixels=2, get_radius=5),
+                                "hexagon": dict(radius=200, extruded=True, elevation_scale=4, coverage=0.9),
+                                "screengrid": dict(cell_size_pixels=15, opacity=0.8),
+                            }[map_type]
+                            st.markdown(f"Vehicle positions on {start_date.strftime('%Y-%m-%d %H:%M')}")
+                            map_view(
+                                [points_layer(data, longitude_column, latitude_column, map_type, **layer_props)],
+                                latitude=mean_lat,
+                                longitude=mean_lon,
                                 zoom=10,
-                                mapbox_style="carto-positron",
-                                title=f"Static plot, vehicle positions on {start_date.strftime('%Y-%m-%d %H:%M')}",
+                                pitch=40 if map_type == "hexagon" else 0,
+                                height=800,
                             )
-                            st.plotly_chart(figure, height=800)
-
-                            vehicle_id = columns.get('id', 'trip_tripId')
-                            df = data.to_pandas()[
-                                [
-                                    vehicle_id,
-                                    fetch_time_column,
-                                    latitude_column,
-                                    longitude_column,
-                                ]
-                            ]
-                            # order by id
-                            df = df.sort_values(by=[vehicle_id, fetch_time_column])
-
-                            groups = []
-
-                            start_timestamp = df[fetch_time_column].min()
-                            end_timestamp = df[fetch_time_column].max() - start_timestamp
-
-                            for _, group in df.groupby(vehicle_id):
-                                timestamps = group[fetch_time_column].tolist()
-                                path = group[[longitude_column, latitude_column]].values.tolist()
-                                groups.append({
-                                    "timestamps": list(
-                                        map(int, [timestamp - start_timestamp for timestamp in timestamps])),
-                                    "path": [
-                                        [float(coord) for coord in point] for point in path
-                                    ],
-                                    "color": [255, 0, 0]  # Red color for the path
-                                })
 
                             st.markdown(
                                 f"**Replaying data from {start_date.strftime('%Y-%m-%d %H:%M')} to {end_date.strftime('%Y-%m-%d %H:%M')}**")
 
-                            replay_speed = st.slider(
-                                "Replay speed (how many seconds to show per 1 second), 1 means same speed",
-                                min_value=1,
-                                max_value=60,
-                                value=1,
-                                step=1,
-                            )
-
                             number_of_trips_at_the_same_time = st.number_input(
                                 "Number of trips at the same time",
                                 min_value=1,
@@ -445,36 +439,85 @@ df = fetch_data(
                                 value=10,
                             )
 
-                            groups = groups[:number_of_trips_at_the_same_time]
+                            trips = build_trips(
+                                data,
+                                vehicle_id,
+                                fetch_time_column,
+                                longitude_column,
+                                latitude_column,
+                                top_n=number_of_trips_at_the_same_time,
+                            )
 
-                            trip_layer = pydeck.Layer(
-                                "TripsLayer",
-                                id="trips-layer",
-                                data=groups,
-                                get_timestamps="timestamps",
-                                get_path="path",
+                            trip_layer = trips_layer(
+                                trips,
                                 current_time=0,
                                 trail_length=100,
                                 width_min_pixels=8,
-                                get_color="color",
-                            )
-                            mean_lat = df[latitude_column].mean()
-                            mean_lon = df[longitude_column].mean()
-                            deck = pydeck.Deck(
-                                initial_view_state=pydeck.ViewState(
-                                    latitude=float(mean_lat),
-                                    longitude=float(mean_lon),
-                                    zoom=9,
-                                    pitch=50,
-                                ),
-                                layers=[trip_layer],
+                                get_color=[255, 0, 0],  # Red color for the path
                             )
 
-                            placeholder = st.empty()
+                            # Timestamps are seconds since the first position, the replay lasts until the last one
+                            duration = pc.max(pc.list_flatten(trips["timestamps"])).as_py() or 0
+                            map_view(
+                                [trip_layer],
+                                latitude=mean_lat,
+                                longitude=mean_lon,
+                                zoom=9,
+                                pitch=50,
+                                duration=duration,
+                            )
+        with tab3:
+            if feed_type_enum != FeedType.VEHICLE_POSITION:
+                st.info("The overview is only available for vehicle position feeds.")
+            else:
+                st.write(
+                    "Activity and coverage over several days, drawn from per-hour summaries. Summaries are derived once from the raw data, update them to include new hours.")
+                tile_store = get_tile_store(feed, feed_path)
+                tz = timezone(provider.timezone)
+                overview_start = st.date_input(key="overview_start", label="Start Date",
+                                               value=datetime.now() - timedelta(days=7))
+                overview_end = st.date_input(key="overview_end", label="End Date", value=datetime.now())
+                overview_start = tz.localize(datetime(overview_start.year, overview_start.month, overview_start.day))
+                overview_end = tz.localize(datetime(overview_end.year, overview_end.month, overview_end.day)
+                                           + timedelta(days=1))
+
+                if st.button("Update summaries"):
+                    bar = st.progress(0.0, text="Reading new hours...")
+                    built = tile_store.build(
+                        get_client(),
+                        overview_start,
+                        overview_end,
+                        cache=object_cache,
+                        progress=lambda done, total: bar.progress(done / total, text=f"{done}/{total} hours"),
+                    )
+                    bar.empty()
+                    st.success(f"{built} new hours summarised.")
+
+                activity = tile_store.activity(overview_start, overview_end)
+                if activity.num_rows == 0:
+                    st.info("No summaries for this period yet, click on \"Update summaries\".")
+                else:
+                    trips = tile_store.trips(overview_start, overview_end)
+                    col1, col2 = st.columns(2)
+                    col1.metric("Vehicles", trips.num_rows)
+                    col2.metric("Positions", pc.sum(activity["points"]).as_py())
+
+                    st.subheader("Active vehicles per minute")
+                    df = activity.to_pandas().set_index("minute")
+                    df.index = df.index.tz_convert(tz)
+                    st.line_chart(df["vehicles"])
+
+                    st.subheader("Coverage")
+                    coverage = tile_store.coverage(overview_start, overview_end)
+                    weights = coverage["points"]
+                    map_view(
+                        [points_layer(coverage, "longitude", "latitude", "screengrid", weight_column="points",
+                                      cell_size_pixels=10, opacity=0.8)],
+                        latitude=pc.divide(pc.sum(pc.multiply(coverage["latitude"], weights)), pc.sum(weights)).as_py(),
+                        longitude=pc.divide(pc.sum(pc.multiply(coverage["longitude"], weights)), pc.sum(weights)).as_py(),
+                        zoom=9,
+                        height=600,
+                    )
 
-                            for i in range(start_timestamp // replay_speed):
-                                with placeholder.container():
-                                    st.progress(round(i / (start_timestamp // replay_speed) * 100))
-                                    st.pydeck_chart(deck)
-                                    trip_layer.current_time += replay_speed
-                                    time.sleep(1)
+                    st.subheader("Most active vehicles")
+                    st.dataframe(trips.slice(0, 100).to_pandas())
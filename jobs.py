@@ -0,0 +1,197 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+from cache import DEFAULT_CACHE_DIR, ObjectCache
+from export import EXTENSIONS, ExportCancelled, _export_day, is_complete
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Job:
+    """
+    State of one background export, read by the sessions polling it.
+
+    ``days_done``/``days_total`` and ``rows`` give the progress, ``path`` is the archive (or dataset
+    directory) once the job is ``done``.
+    """
+
+    def __init__(self, job_id: str, directory: str, days_total: int):
+        self.id = job_id
+        self.directory = directory
+        self.status = PENDING
+        self.days_total = days_total
+        self.days_done = 0
+        self.rows = 0
+        self.path = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def progress(self) -> float:
+        return self.days_done / self.days_total if self.days_total else 1.0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _add_rows(self, batch):
+        with self._lock:
+            self.rows += batch.num_rows
+
+    def _day_done(self):
+        with self._lock:
+            self.days_done += 1
+
+    def __repr__(self):
+        return f"Job({self.id!r}, {self.status}, {self.days_done}/{self.days_total} days, {self.rows} rows)"
+
+
+class JobRunner:
+    """
+    Run range exports in background threads, so that a Streamlit session only submits a job and polls it.
+
+    Each job exports the days of its range concurrently (``day_workers`` at a time) to a Hive-partitioned
+    dataset in its own directory under ``directory``, then optionally packs it into a single zip archive.
+    Finished jobs are removed along with their files after ``retention`` seconds.
+    """
+
+    def __init__(self, directory: str = None, max_jobs: int = 2, day_workers: int = 4, retention: float = 3600):
+        self.directory = directory or os.path.join(DEFAULT_CACHE_DIR, "jobs")
+        os.makedirs(self.directory, exist_ok=True)
+        self.day_workers = day_workers
+        self.retention = retention
+        self._pool = ThreadPoolExecutor(max_workers=max_jobs)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(
+            self,
+            start_date: datetime,
+            end_date: datetime,
+            feed_path: str,
+            format: str = "parquet",
+            archive: bool = True,
+            cache: ObjectCache = None,
+            **fetch_kwargs,
+    ) -> Job:
+        """
+        Export every day of [start_date, end_date) of ``feed_path`` in the background. ``fetch_kwargs`` are
+        passed to ``fetch.fetch_batches``.
+        """
+        if format not in EXTENSIONS:
+            raise ValueError(f"Unsupported export format {format!r}, expected one of {list(EXTENSIONS)}")
+
+        self._expire()
+        days = [
+            (start_date + timedelta(days=i)).strftime("%Y-%m-%d")
+            for i in range((end_date - start_date).days)
+        ]
+        job_id = uuid.uuid4().hex
+        job = Job(job_id, os.path.join(self.directory, job_id), len(days))
+        with self._lock:
+            self._jobs[job_id] = job
+
+        cache_config = (cache.directory, cache.max_bytes) if cache is not None else None
+        self._pool.submit(self._run, job, days, feed_path, format, archive, cache_config, fetch_kwargs)
+        return job
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def remove(self, job_id: str):
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None:
+            job.cancel()
+            if job.finished:
+                self._remove_files(job)
+
+    def _run(self, job: Job, days, feed_path, format, archive, cache_config, fetch_kwargs):
+        job.status = RUNNING
+        dataset = os.path.join(job.directory, "dataset")
+        status = FAILED
+        try:
+            with ThreadPoolExecutor(max_workers=self.day_workers) as pool:
+                futures = [
+                    pool.submit(self._export_day, job, day, feed_path, dataset, format, cache_config, fetch_kwargs)
+                    for day in days
+                ]
+                try:
+                    for future in as_completed(futures):
+                        future.result()
+                except BaseException:
+                    # Stop the other days, a partial range is of no use
+                    job.cancel()
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+            if archive:
+                job.path = self._archive(dataset, job.directory + ".zip")
+                shutil.rmtree(job.directory, ignore_errors=True)
+            else:
+                job.path = dataset
+            status = DONE
+        except ExportCancelled:
+            status = CANCELLED
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+        finally:
+            # A finished job always has its finish time, which expiry reads from other threads
+            job.finished_at = time.time()
+            job.status = status
+            if status != DONE or self.get(job.id) is None:
+                self._remove_files(job)
+
+    def _export_day(self, job, day, feed_path, dataset, format, cache_config, fetch_kwargs):
+        if job._cancel.is_set():
+            raise ExportCancelled(day)
+        if not is_complete(dataset, day, format):
+            _export_day(day, feed_path, dataset, format, cache_config, fetch_kwargs,
+                        cancel=job._cancel, on_batch=job._add_rows)
+        job._day_done()
+
+    @staticmethod
+    def _archive(dataset: str, path: str) -> str:
+        tmp_path = path + ".part"
+        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for root, dirs, files in os.walk(dataset):
+                dirs.sort()
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    archive.write(file_path, os.path.relpath(file_path, dataset))
+        os.replace(tmp_path, path)
+        return path
+
+    @staticmethod
+    def _remove_files(job: Job):
+        shutil.rmtree(job.directory, ignore_errors=True)
+        if job.path is not None and os.path.isfile(job.path):
+            os.remove(job.path)
+
+    def _expire(self):
+        now = time.time()
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished and now - job.finished_at > self.retention
+            ]
+        for job_id in expired:
+            self.remove(job_id)
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from cache import DEFAULT_CACHE_DIR
+from planning import PLAN_SCHEMA, PlannedObject, day_folder, plan_day, planned_objects, select_overlapping
+from storage import DEFAULT_BUCKET
+
+
+class ListingIndex:
+    """
+    Local index of the objects of one feed: name, size, ETag and the UTC period each object covers.
+
+    The index is persisted as a Parquet file and refreshed incrementally: only the most recent day already
+    indexed (which may still be growing) and the days after it are listed again. Period queries go through
+    the start times sorted together with the running maximum of the end times, so they cost two binary
+    searches instead of a scan of the bucket.
+    """
+
+    def __init__(
+            self,
+            feed_path: str,
+            parse_date=None,
+            timezone_str="Europe/Brussels",
+            bucket: str = None,
+            directory: str = None,
+            refresh_interval: float = 60,
+            naming: str = None,
+    ):
+        self.feed_path = feed_path
+        self.parse_date = parse_date
+        # File names are parsed with the vectorised naming scheme unless a custom parse_date is given
+        self.naming = naming or (None if parse_date is not None else "range")
+        self.timezone_str = timezone_str
+        self.bucket = bucket or DEFAULT_BUCKET
+        self.refresh_interval = refresh_interval
+
+        directory = directory or os.path.join(DEFAULT_CACHE_DIR, "listings")
+        os.makedirs(directory, exist_ok=True)
+        key = hashlib.sha256(f"{self.bucket}/{feed_path}".encode("utf-8")).hexdigest()[:16]
+        self.path = os.path.join(directory, f"{feed_path.strip('/').replace('/', '_')}-{key}.parquet")
+
+        self._lock = threading.Lock()
+        self._synced_at = None
+        self._set_table(pq.read_table(self.path) if os.path.exists(self.path) else PLAN_SCHEMA.empty_table())
+
+    def refresh(self, client, force: bool = False):
+        """List the days newer than the last sync (and the last synced day itself) and update the index."""
+        with self._lock:
+            if not force and self._synced_at is not None and time.time() - self._synced_at < self.refresh_interval:
+                return
+
+            days = self.days_names()
+            start_after = self.feed_path + days[-1] if days else None
+            new_days = []
+            for prefix in client.list_objects(self.bucket, self.feed_path, start_after=start_after):
+                day = day_folder(self.feed_path, prefix.object_name)
+                if day is not None:
+                    new_days.append(day)
+
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                listed = list(pool.map(lambda day: self._list_day(client, day), new_days))
+
+            if listed:
+                kept = self.table.filter(pc.invert(pc.is_in(self.table["day"], pa.array(new_days, pa.string()))))
+                table = pa.concat_tables([kept] + listed)
+                self._set_table(table.sort_by([("start", "ascending"), ("object_name", "ascending")]))
+                self._save()
+
+            self._synced_at = time.time()
+
+    def days_names(self) -> List[str]:
+        return pc.unique(self.table["day"]).sort().to_pylist()
+
+    def days(self) -> List[datetime.date]:
+        return [datetime.strptime(day, "%Y-%m-%d").date() for day in self.days_names()]
+
+    def query(self, start_date: datetime, end_date: datetime) -> List[PlannedObject]:
+        """Return the objects overlapping [start_date, end_date) (timezone aware), sorted by start time."""
+        start_us = int(start_date.timestamp() * 1_000_000)
+        end_us = int(end_date.timestamp() * 1_000_000)
+
+        # One snapshot: a concurrent refresh replaces the table and its arrays together
+        table, starts, max_ends = self._state
+
+        # Objects starting before the end of the window, among which those ending after its start
+        last = np.searchsorted(starts, end_us, side="left")
+        first = np.searchsorted(max_ends, start_us, side="right")
+        if first >= last:
+            return []
+
+        candidates = table.slice(first, last - first)
+        return planned_objects(select_overlapping(candidates, start_date, end_date))
+
+    def _list_day(self, client, day) -> pa.Table:
+        files = client.list_objects(self.bucket, self.feed_path + day + "/")
+        return plan_day(files, day, self.timezone_str, naming=self.naming, parse_date=self.parse_date)
+
+    @property
+    def table(self) -> pa.Table:
+        return self._state[0]
+
+    def _set_table(self, table: pa.Table):
+        # Published as one tuple, so that readers never pair the arrays of one table with another table
+        table = table.cast(PLAN_SCHEMA)
+        starts = table["start"].cast(pa.int64()).to_numpy()
+        ends = table["end"].cast(pa.int64()).to_numpy()
+        max_ends = np.maximum.accumulate(ends) if len(ends) else ends
+        self._state = (table, starts, max_ends)
+
+    def _save(self):
+        tmp_path = self.path + ".part"
+        pq.write_table(self.table, tmp_path)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,247 @@
+import base64
+import json
+from string import Template
+
+import numpy as np
+import pyarrow as pa
+import streamlit as st
+
+DECKGL_URL = "https://unpkg.com/deck.gl@9.1.14/dist.min.js"
+MAPLIBRE_URL = "https://unpkg.com/maplibre-gl@4.7.1/dist/maplibre-gl"
+MAP_STYLE = "https://basemaps.cartocdn.com/gl/positron-gl-style/style.json"
+
+_TEMPLATE = Template("""<!DOCTYPE html>
+<html>
+<head>
+  <script src="$deckgl_url"></script>
+  <script src="$maplibre_url.js"></script>
+  <link href="$maplibre_url.css" rel="stylesheet" />
+  <style>
+    body { margin: 0; }
+    #map { width: 100%; height: ${height}px; }
+    #controls { display: $controls_display; align-items: center; gap: 8px; height: ${controls_height}px;
+                font-family: sans-serif; font-size: 14px; }
+    #seek { flex: 1; }
+  </style>
+</head>
+<body>
+  <div id="controls">
+    <button id="play">Pause</button>
+    <input id="seek" type="range" min="0" step="1" value="0" />
+    <span id="clock"></span>
+    <select id="speed"></select>
+  </div>
+  <div id="map"></div>
+  <script>
+    const config = $config;
+
+    function decode(text, Type) {
+      const bytes = Uint8Array.from(atob(text), (c) => c.charCodeAt(0));
+      return new Type(bytes.buffer);
+    }
+
+    function position(_, {index, data}) {
+      return [data.positions[2 * index], data.positions[2 * index + 1]];
+    }
+
+    function buildLayer(spec) {
+      const props = Object.assign({id: spec.id}, spec.props);
+      if (spec.type === "trips") {
+        const data = {
+          length: spec.length,
+          startIndices: decode(spec.startIndices, Int32Array),
+          attributes: {
+            getPath: {value: decode(spec.positions, Float32Array), size: 2},
+            getTimestamps: {value: decode(spec.timestamps, Float32Array), size: 1},
+          },
+        };
+        return new deck.TripsLayer(Object.assign({data, _pathType: "open"}, props));
+      }
+
+      const positions = decode(spec.positions, Float32Array);
+      if (spec.type === "scatter") {
+        const data = {length: spec.length, attributes: {getPosition: {value: positions, size: 2}}};
+        return new deck.ScatterplotLayer(Object.assign({data}, props));
+      }
+      // Aggregation layers read the positions through an accessor, one call per point at load time
+      const data = {length: spec.length, positions};
+      const weighted = {};
+      if (spec.weights) {
+        data.weights = decode(spec.weights, Float32Array);
+        const weight = (_, {index, data}) => data.weights[index];
+        Object.assign(weighted, spec.type === "hexagon"
+          ? {getColorWeight: weight, colorAggregation: "SUM", getElevationWeight: weight, elevationAggregation: "SUM"}
+          : {getWeight: weight, aggregation: "SUM"});
+      }
+      if (spec.type === "hexagon") {
+        return new deck.HexagonLayer(Object.assign({data, getPosition: position}, weighted, props));
+      }
+      return new deck.ScreenGridLayer(Object.assign({data, getPosition: position}, weighted, props));
+    }
+
+    const map = new maplibregl.Map({
+      container: "map",
+      style: config.mapStyle,
+      center: [config.viewState.longitude, config.viewState.latitude],
+      zoom: config.viewState.zoom,
+      pitch: config.viewState.pitch,
+    });
+    let layers = config.layers.map(buildLayer);
+    const overlay = new deck.MapboxOverlay({layers});
+    map.addControl(overlay);
+
+    // The replay runs here: only currentTime changes, the layers are cloned and keep their data buffers
+    const animation = config.animation;
+    if (animation) {
+      const play = document.getElementById("play");
+      const seek = document.getElementById("seek");
+      const clock = document.getElementById("clock");
+      const speed = document.getElementById("speed");
+      for (const value of animation.speeds) {
+        speed.add(new Option(value + "x", value, false, value === animation.speed));
+      }
+      seek.max = animation.duration;
+
+      let currentTime = 0;
+      let playing = true;
+      let last = null;
+
+      function format(seconds) {
+        const total = Math.floor(seconds);
+        return [Math.floor(total / 3600), Math.floor(total % 3600 / 60), total % 60]
+          .map((value) => String(value).padStart(2, "0")).join(":");
+      }
+
+      function render() {
+        layers = layers.map((layer) => layer instanceof deck.TripsLayer ? layer.clone({currentTime}) : layer);
+        overlay.setProps({layers});
+        seek.value = currentTime;
+        clock.textContent = format(currentTime) + " / " + format(animation.duration);
+      }
+
+      function frame(now) {
+        if (playing && last !== null) {
+          currentTime += (now - last) / 1000 * Number(speed.value);
+          if (currentTime > animation.duration) {
+            currentTime = 0;
+          }
+          render();
+        }
+        last = now;
+        requestAnimationFrame(frame);
+      }
+
+      play.onclick = () => {
+        playing = !playing;
+        play.textContent = playing ? "Pause" : "Play";
+      };
+      seek.oninput = () => {
+        currentTime = Number(seek.value);
+        render();
+      };
+      render();
+      requestAnimationFrame(frame);
+    }
+  </script>
+</body>
+</html>
+""")
+
+_LAYER_TYPES = ("scatter", "hexagon", "screengrid", "trips")
+_CONTROLS_HEIGHT = 40
+REPLAY_SPEEDS = (1, 5, 10, 30, 60, 120)
+
+
+def encode(array: np.ndarray) -> str:
+    """Base64 of the raw bytes of ``array``, decoded to a typed array in the browser."""
+    return base64.b64encode(np.ascontiguousarray(array).tobytes()).decode("ascii")
+
+
+def _camel_case(props: dict) -> dict:
+    def convert(name):
+        head, *tail = name.split("_")
+        return head + "".join(part.title() for part in tail)
+
+    return {convert(name): value for name, value in props.items()}
+
+
+def points_layer(table: pa.Table, longitude_column: str, latitude_column: str, type: str = "scatter",
+                 id: str = None, weight_column: str = None, **props) -> dict:
+    """
+    Layer of every position of ``table``: ``scatter`` draws the points, ``hexagon`` and ``screengrid`` aggregate
+    them on the GPU, summing ``weight_column`` if given instead of counting points. ``props`` are deck.gl layer
+    properties, in snake or camel case.
+    """
+    if type not in _LAYER_TYPES[:3]:
+        raise ValueError(f"Unsupported points layer {type!r}, expected one of {list(_LAYER_TYPES[:3])}")
+    columns = [longitude_column, latitude_column] + ([weight_column] if weight_column is not None else [])
+    table = table.select(columns).drop_null()
+    positions = np.column_stack([
+        table[longitude_column].cast(pa.float64()).to_numpy(),
+        table[latitude_column].cast(pa.float64()).to_numpy(),
+    ]).astype(np.float32)
+    layer = {
+        "type": type,
+        "id": id or f"{type}-layer",
+        "length": table.num_rows,
+        "positions": encode(positions),
+        "props": _camel_case(props),
+    }
+    if weight_column is not None:
+        layer["weights"] = encode(table[weight_column].cast(pa.float32()).to_numpy())
+    return layer
+
+
+def trips_layer(trips: pa.Table, id: str = "trips-layer", **props) -> dict:
+    """``TripsLayer`` of the trajectories built by ``trajectory.build_trips``, sent as flat binary attributes."""
+    paths = trips["path"].combine_chunks()
+    timestamps = trips["timestamps"].combine_chunks()
+    # Offsets of the paths are the start index of each trajectory in the flat attributes
+    offsets = paths.offsets.to_numpy()
+    start_indices = offsets[:-1] - offsets[0]
+    return {
+        "type": "trips",
+        "id": id,
+        "length": trips.num_rows,
+        "startIndices": encode(start_indices.astype(np.int32)),
+        "positions": encode(paths.flatten().flatten().to_numpy().astype(np.float32)),
+        "timestamps": encode(timestamps.flatten().to_numpy().astype(np.float32)),
+        "props": _camel_case(props),
+    }
+
+
+def render_html(layers, latitude: float, longitude: float, zoom: float = 9, pitch: float = 0, height: int = 600,
+                duration: float = None, speed: float = 1) -> str:
+    config = {
+        "mapStyle": MAP_STYLE,
+        "viewState": {"latitude": latitude, "longitude": longitude, "zoom": zoom, "pitch": pitch},
+        "layers": layers,
+        "animation": {
+            "duration": duration,
+            "speed": speed,
+            "speeds": sorted(set(REPLAY_SPEEDS) | {speed}),
+        } if duration is not None else None,
+    }
+    return _TEMPLATE.substitute(
+        deckgl_url=DECKGL_URL,
+        maplibre_url=MAPLIBRE_URL,
+        height=height,
+        controls_height=_CONTROLS_HEIGHT,
+        controls_display="flex" if duration is not None else "none",
+        config=json.dumps(config),
+    )
+
+
+def map_view(layers, latitude: float, longitude: float, zoom: float = 9, pitch: float = 0, height: int = 600,
+             duration: float = None, speed: float = 1):
+    """
+    Render deck.gl ``layers`` over a basemap in the Streamlit app.
+
+    Coordinates and timestamps travel as base64 typed arrays (8 bytes per position) and are handed to deck.gl
+    as binary attributes, instead of a JSON list per point that the browser has to parse and convert back.
+
+    With a ``duration`` (seconds) the trips layers are replayed in the browser, with play/pause, seek and
+    speed controls: the data is sent once and the server is not involved until the layers change.
+    """
+    html = render_html(layers, latitude, longitude, zoom, pitch, height, duration, speed)
+    st.iframe(html, height=height + (_CONTROLS_HEIGHT if duration is not None else 0))
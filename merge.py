@@ -0,0 +1,207 @@
+import logging
+from typing import Generator, Iterable, List, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from metrics import METRICS
+from trajectory import epoch_seconds
+
+logger = logging.getLogger(__name__)
+
+
+def sort_keys(time_column: str, id_column: str = None) -> list:
+    """Sort keys of merged rows, as for ``pyarrow.Table.sort_by``: time, then entity."""
+    return [(time_column, "ascending")] + ([(id_column, "ascending")] if id_column is not None else [])
+
+
+def merge_columns(columns: List[str], time_column: str, id_column: str = None, dedup_on: str = None) -> List[str]:
+    """``columns`` with the merge keys added, read even when not asked for and dropped after the merge."""
+    if columns is None:
+        return None
+    return list(columns) + [
+        name for name in (time_column, id_column, dedup_on)
+        if name is not None and name not in columns
+    ]
+
+
+def _is_sorted(column: pa.ChunkedArray) -> bool:
+    if len(column) < 2:
+        return True
+    column = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+    return pc.all(pc.greater_equal(column.slice(1), column.slice(0, len(column) - 1))).as_py() is not False
+
+
+def sort_object(table: pa.Table, time_column: str, id_column: str = None) -> pa.Table:
+    """Sort the rows of one object by time (then entity), unless they already are by time alone."""
+    if id_column is None and _is_sorted(table[time_column]):
+        return table
+    return table.take(pc.sort_indices(table, sort_keys=sort_keys(time_column, id_column)))
+
+
+def _merge_sorted(pending: pa.Table, table: pa.Table, time_column: str, id_column: str = None) -> pa.Table:
+    """
+    Merge two sorted tables. Only the rows of ``table`` up to the last time of ``pending`` are sorted together
+    with it, the rest follows as is: objects of consecutive periods only overlap at their boundary.
+    """
+    table = table.cast(pending.schema) if table.schema != pending.schema else table
+    overlap = int(np.searchsorted(epoch_seconds(table[time_column]), epoch_seconds(pending[time_column])[-1], "right"))
+    if overlap == 0:
+        return pa.concat_tables([pending, table])
+    merged = pa.concat_tables([pending, table.slice(0, overlap)])
+    merged = merged.take(pc.sort_indices(merged, sort_keys=sort_keys(time_column, id_column)))
+    return pa.concat_tables([merged, table.slice(overlap)])
+
+
+def deduplicate(table: pa.Table, time_column: str, id_column: str) -> pa.Table:
+    """Drop the rows repeating the (entity, time) of the row before them, in a table sorted by time then entity."""
+    if table.num_rows < 2:
+        return table
+    times = table[time_column]
+    ids = table[id_column]
+    repeated = pc.and_(
+        pc.equal(times.slice(1), times.slice(0, table.num_rows - 1)),
+        pc.equal(ids.slice(1), ids.slice(0, table.num_rows - 1)),
+    )
+    keep = np.concatenate([[True], ~pc.fill_null(repeated, False).to_numpy(zero_copy_only=False)])
+    kept = table.filter(pa.array(keep))
+    METRICS.increment("rows_deduplicated", table.num_rows - kept.num_rows)
+    return kept
+
+
+def deduplicate_reports(table: pa.Table, time_column: str, id_column: str, report_column: str,
+                        last_reports: dict) -> pa.Table:
+    """
+    Drop the rows repeating the ``report_column`` value of the previous row of the same entity, in time order:
+    the snapshots of polls during which the entity did not report again. ``last_reports`` maps each entity to
+    its last value in the tables already deduplicated, and is updated.
+    """
+    if table.num_rows == 0:
+        return table
+    order = pc.sort_indices(table, sort_keys=[(id_column, "ascending"), (time_column, "ascending")])
+    ids = table[id_column].take(order)
+    reports = table[report_column].take(order)
+
+    repeated = np.zeros(table.num_rows, dtype=bool)
+    same_entity = np.ones(table.num_rows, dtype=bool)
+    if table.num_rows > 1:
+        same_entity[1:] = pc.fill_null(pc.equal(ids.slice(1), ids.slice(0, table.num_rows - 1)), False) \
+            .to_numpy(zero_copy_only=False)
+        same_report = pc.fill_null(pc.equal(reports.slice(1), reports.slice(0, table.num_rows - 1)), False)
+        repeated[1:] = same_entity[1:] & same_report.to_numpy(zero_copy_only=False)
+
+    # The first row of each entity is compared to its last report in the previous tables
+    same_entity[0] = False
+    firsts = np.flatnonzero(~same_entity)
+    lasts = np.append(firsts[1:] - 1, table.num_rows - 1)
+    first_ids = ids.take(pa.array(firsts)).to_pylist()
+    first_reports = reports.take(pa.array(firsts)).to_pylist()
+    for index, entity, report in zip(firsts, first_ids, first_reports):
+        if report is not None and last_reports.get(entity) == report:
+            repeated[index] = True
+    last_reports.update(zip(ids.take(pa.array(lasts)).to_pylist(), reports.take(pa.array(lasts)).to_pylist()))
+
+    keep = np.empty(table.num_rows, dtype=bool)
+    keep[order.to_numpy()] = ~repeated
+    kept = table.filter(pa.array(keep))
+    METRICS.increment("rows_deduplicated", table.num_rows - kept.num_rows)
+    return kept
+
+
+class ObjectMerger:
+    """
+    Incremental state of ``merge_objects``: objects are pushed one at a time, in the order of their start, and
+    each push returns the rows that are ready. For callers that cannot hand ``merge_objects`` an iterator, as
+    the asyncio fetchers.
+    """
+
+    def __init__(self, time_column: str, id_column: str = None, deduplicate_rows: bool = False,
+                 lateness: float = 60, dedup_on: str = None):
+        if deduplicate_rows and id_column is None:
+            raise ValueError("Deduplicating rows needs an id_column")
+        self.time_column = time_column
+        self.id_column = id_column
+        self.deduplicate_rows = deduplicate_rows
+        self.lateness = lateness
+        self.dedup_on = dedup_on
+        self._pending = None
+        self._emitted_until = None
+        self._last_reports = {}
+
+    def push(self, batches: Iterable[pa.RecordBatch], following_start: float = None) -> pa.Table:
+        """
+        Merge the ``batches`` of the next object and return the rows no later object can precede, the start of
+        the following object being ``following_start`` (POSIX seconds, None after the last object). None if no
+        row is ready.
+        """
+        time_column, id_column = self.time_column, self.id_column
+        batches = [batch for batch in batches if batch.num_rows]
+        if batches:
+            with METRICS.timer("merge"):
+                table = sort_object(pa.Table.from_batches(batches), time_column, id_column)
+                if self._emitted_until is not None:
+                    late = int(np.count_nonzero(epoch_seconds(table[time_column]) < self._emitted_until))
+                    if late:
+                        METRICS.increment("rows_late", late)
+                        logger.debug("%d rows earlier than rows already merged", late)
+                self._pending = table if self._pending is None else _merge_sorted(
+                    self._pending, table, time_column, id_column,
+                )
+
+        if self._pending is None:
+            return None
+        with METRICS.timer("merge"):
+            if following_start is None:
+                ready, self._pending = self._pending, None
+            else:
+                self._emitted_until = following_start - self.lateness
+                cut = int(np.searchsorted(epoch_seconds(self._pending[time_column]), self._emitted_until, "left"))
+                ready, self._pending = self._pending.slice(0, cut), self._pending.slice(cut)
+                if self._pending.num_rows == 0:
+                    self._pending = None
+            if self.deduplicate_rows and self.dedup_on is not None:
+                ready = deduplicate_reports(ready, time_column, id_column, self.dedup_on, self._last_reports)
+            elif self.deduplicate_rows:
+                ready = deduplicate(ready, time_column, id_column)
+        return ready
+
+
+def merge_objects(
+        objects: Iterable[Tuple[int, Iterable[pa.RecordBatch]]],
+        time_column: str,
+        id_column: str = None,
+        deduplicate_rows: bool = False,
+        lateness: float = 60,
+        batch_size: int = 65536,
+        dedup_on: str = None,
+) -> Generator[pa.RecordBatch, None, None]:
+    """
+    K-way merge of the rows of consecutive objects into batches ordered by ``time_column``, then ``id_column``.
+
+    ``objects`` yields ``(start, batches)`` per object, in the order of their start (POSIX seconds of the
+    period in their name), as planned by the fetchers. Each object is sorted on its own, then merged with the
+    rows still pending from the previous ones: once the next object is known, every pending row earlier than
+    its start minus ``lateness`` seconds is emitted, no later object can precede it. Only the rows of the
+    objects being merged are held, never the whole window, and the objects of disjoint periods are merely
+    concatenated.
+
+    Rows of an object earlier than the start of its period by more than ``lateness`` may come after rows
+    already emitted; they are counted in the ``rows_late`` metric. With ``deduplicate_rows``, rows repeating
+    the (entity, time) of another one are dropped, or with ``dedup_on`` the rows repeating the value of that
+    column (the time the entity reported at) of the previous row of the same entity, as consecutive polls of a
+    vehicle that did not report do.
+    """
+    merger = ObjectMerger(time_column, id_column, deduplicate_rows, lateness, dedup_on)
+    objects = iter(objects)
+    current = next(objects, None)
+    while current is not None:
+        # The object is read before the next one is waited for
+        batches = list(current[1])
+        following = next(objects, None)
+        ready = merger.push(batches, None if following is None else following[0])
+        if ready is not None:
+            for batch in ready.to_batches(max_chunksize=batch_size):
+                if batch.num_rows:
+                    yield batch
+        current = following
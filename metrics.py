@@ -0,0 +1,254 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Port the Streamlit app serves its metrics to Prometheus on, not served if unset
+METRICS_PORT = int(os.environ["EMERALDS_METRICS_PORT"]) if os.environ.get("EMERALDS_METRICS_PORT") else None
+
+# Upper bounds (seconds) of the buckets of the stage duration histograms
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+# Metrics recorded by the fetchers, with their help text
+DESCRIPTIONS = {
+    "stage_seconds": "Time spent per stage: list, plan, download, range_read, decode, index, merge, concat, spill, to_pandas, write",
+    "objects_listed": "Objects listed in the bucket",
+    "objects_skipped": "Listed objects outside of the requested window",
+    "objects_fetched": "Objects downloaded or opened for range reads",
+    "bytes_transferred": "Bytes received from the object store",
+    "rows_decoded": "Rows decoded from Parquet objects",
+    "rows_deduplicated": "Rows dropped by the merge as repeated (entity, time) snapshots",
+    "rows_late": "Rows found by the merge earlier than rows already emitted",
+    "row_groups_skipped": "Row groups of indexed objects holding none of the entities or cells queried",
+    "cache_hits": "Lookups answered by a cache",
+    "cache_misses": "Lookups a cache could not answer",
+}
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters and duration histograms, keyed by name and labels.
+
+    Every update is also emitted as a DEBUG record of the ``metrics`` logger, with ``metric``, ``value`` and
+    ``labels`` attributes for structured log handlers, and passed to the listeners (see ``Collector``).
+    Each process has its own registry: days exported by worker processes are not counted in the parent.
+    """
+
+    def __init__(self, namespace: str = "emeralds"):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._counters = {}
+        # (name, labels) -> [count per bucket..., count, sum]
+        self._histograms = {}
+        self._listeners = ()
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._emit("counter", name, value, labels)
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(BUCKETS) + 2)
+            for index, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[index] += 1
+                    break
+            histogram[-2] += 1
+            histogram[-1] += value
+        self._emit("histogram", name, value, labels)
+
+    @contextmanager
+    def timer(self, stage: str, **labels):
+        """Time the block as ``stage``, in ``stage_seconds``."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - started, stage=stage, **labels)
+
+    def timed(self, iterable, stage: str, **labels):
+        """
+        Yield the items of ``iterable``, timing how long they take to produce (not to consume) as one ``stage``
+        observation, recorded once the iteration ends or is abandoned.
+        """
+        seconds = 0.0
+        iterator = iter(iterable)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - started
+                yield item
+        finally:
+            self.observe("stage_seconds", seconds, stage=stage, **labels)
+
+    def add_listener(self, listener: Callable):
+        """Call ``listener(kind, name, value, labels)`` on every update, ``kind`` being counter or histogram."""
+        with self._lock:
+            self._listeners = self._listeners + (listener,)
+
+    def remove_listener(self, listener: Callable):
+        with self._lock:
+            self._listeners = tuple(other for other in self._listeners if other is not listener)
+
+    def stages(self) -> Dict[str, dict]:
+        """Count and total seconds of each stage."""
+        with self._lock:
+            stages = {}
+            for (name, labels), histogram in self._histograms.items():
+                if name != "stage_seconds":
+                    continue
+                stage = stages.setdefault(dict(labels)["stage"], {"count": 0, "seconds": 0.0})
+                stage["count"] += histogram[-2]
+                stage["seconds"] += histogram[-1]
+            return stages
+
+    def snapshot(self) -> dict:
+        """Counter totals by name (summed over labels) and stage durations, for display."""
+        with self._lock:
+            counters = {}
+            for (name, _), value in self._counters.items():
+                counters[name] = counters.get(name, 0) + value
+        return {"counters": counters, "stages": self.stages()}
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+    def to_prometheus(self) -> str:
+        """The registry in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(value)) for key, value in self._histograms.items())
+
+        lines = []
+        described = set()
+
+        def header(name, kind, metric):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {DESCRIPTIONS.get(metric, metric)}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        def labelled(name, labels):
+            if not labels:
+                return name
+            values = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+            return f"{name}{{{values}}}"
+
+        for (metric, labels), value in counters:
+            name = f"{self.namespace}_{metric}_total"
+            header(name, "counter", metric)
+            lines.append(f"{labelled(name, labels)} {value}")
+
+        for (metric, labels), histogram in histograms:
+            name = f"{self.namespace}_{metric}"
+            header(name, "histogram", metric)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram):
+                cumulative += count
+                lines.append(f"{labelled(name + '_bucket', labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{labelled(name + '_bucket', labels + (('le', '+Inf'),))} {histogram[-2]}")
+            lines.append(f"{labelled(name + '_sum', labels)} {histogram[-1]}")
+            lines.append(f"{labelled(name + '_count', labels)} {histogram[-2]}")
+        return "\n".join(lines) + "\n"
+
+    def _emit(self, kind: str, name: str, value: float, labels: dict):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "%s %s %s", name, value, labels,
+                extra={"metric": name, "value": value, "labels": labels},
+            )
+        for listener in self._listeners:
+            listener(kind, name, value, labels)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Registry the fetchers record to
+METRICS = Metrics()
+
+
+class Collector:
+    """
+    In-process collector of the updates of a registry while it is active, to check what an operation did:
+
+        with Collector() as collector:
+            fetch_data(...)
+        collector.total("objects_fetched")
+    """
+
+    def __init__(self, metrics: Metrics = None):
+        self.metrics = metrics or METRICS
+        self.events: List[tuple] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, kind, name, value, labels):
+        with self._lock:
+            self.events.append((kind, name, value, labels))
+
+    def __enter__(self):
+        self.metrics.add_listener(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.remove_listener(self)
+
+    def total(self, name: str, **labels) -> float:
+        """Sum of the values recorded for ``name`` with (at least) ``labels``."""
+        with self._lock:
+            return sum(
+                value for _, event_name, value, event_labels in self.events
+                if event_name == name and all(event_labels.get(key) == label for key, label in labels.items())
+            )
+
+    def stages(self) -> Dict[str, float]:
+        """Total seconds per stage."""
+        stages = {}
+        with self._lock:
+            for _, name, value, labels in self.events:
+                if name == "stage_seconds":
+                    stages[labels["stage"]] = stages.get(labels["stage"], 0.0) + value
+        return stages
+
+
+def serve_prometheus(port: int, address: str = "", metrics: Metrics = None) -> ThreadingHTTPServer:
+    """Serve ``metrics`` (the fetchers' registry by default) to Prometheus scrapers from a daemon thread."""
+    metrics = metrics or METRICS
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,180 @@
+import calendar
+import os
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import lru_cache
+from typing import List, NamedTuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from pytz import timezone
+
+PLAN_SCHEMA = pa.schema([
+    ("object_name", pa.string()),
+    ("day", pa.string()),
+    ("size", pa.int64()),
+    ("etag", pa.string()),
+    ("start", pa.timestamp("us", tz="UTC")),
+    ("end", pa.timestamp("us", tz="UTC")),
+])
+
+# How the period of an object is encoded in its file name, relative to the day folder it is in (local time)
+NAMING_SCHEMES = {
+    # "HH-MM-SS_<anything>_HH-MM-SS.parquet", an end equal to the start means the whole day
+    "range": r"(?P<start_hour>\d{2})-(?P<start_minute>\d{2})-(?P<start_second>\d{2})_[^_/]*_"
+             r"(?P<end_hour>\d{2})-(?P<end_minute>\d{2})-(?P<end_second>\d{2})\.parquet$",
+    # "HH.parquet", covering HH:00:00 to HH:59:59
+    "hour": r"(?:^|/)(?P<start_hour>\d{1,2})\.parquet$",
+}
+
+# Seconds after the end of a period during which its objects may still land
+SETTLE_SECONDS = int(os.environ.get("EMERALDS_SETTLE_SECONDS", 15 * 60))
+
+
+class PlannedObject(NamedTuple):
+    object_name: str
+    size: int
+    etag: str
+    start: datetime
+    end: datetime
+
+
+def is_settled(end_date: datetime, timezone_str: str, grace: float = None) -> bool:
+    """
+    Whether a window ending at ``end_date`` (naive local time) can no longer change: objects of a period land
+    after it ends, so a window is only settled ``grace`` seconds (``SETTLE_SECONDS``) after its end.
+    """
+    grace = SETTLE_SECONDS if grace is None else grace
+    now = datetime.now(timezone(timezone_str)).replace(tzinfo=None)
+    return end_date + timedelta(seconds=grace) <= now
+
+
+@lru_cache(maxsize=None)
+def _offset_table(timezone_str):
+    """UTC transition instants (seconds) of the timezone and the UTC offset (seconds) in force from each one."""
+    time_zone = timezone(timezone_str)
+    transitions = getattr(time_zone, "_utc_transition_times", None)
+    if not transitions:
+        offset = time_zone.utcoffset(datetime(2000, 1, 1))
+        return np.array([np.iinfo(np.int64).min]), np.array([int(offset.total_seconds())])
+
+    times = np.array([calendar.timegm(transition.timetuple()) for transition in transitions], dtype=np.int64)
+    offsets = np.array([int(info[0].total_seconds()) for info in time_zone._transition_info], dtype=np.int64)
+    return times, offsets
+
+
+def to_utc(local_seconds: np.ndarray, timezone_str: str) -> np.ndarray:
+    """
+    Convert naive local times (seconds since the epoch, as if they were UTC) to UTC seconds.
+
+    Each time is converted with the offsets in force a day before and a day after it, which are those on
+    both sides of any DST transition near it, and the conversion whose offset is the one in force at its
+    result is kept. Ambiguous times resolve to the second occurrence and non-existent ones are shifted
+    forward, as ``pytz`` localizes them with ``is_dst=False``.
+    """
+    times, offsets = _offset_table(timezone_str)
+
+    def offset_at(utc_seconds):
+        return offsets[np.maximum(np.searchsorted(times, utc_seconds, side="right") - 1, 0)]
+
+    local_seconds = np.asarray(local_seconds, dtype=np.int64)
+    before = offset_at(local_seconds - 86400)
+    after = offset_at(local_seconds + 86400)
+    with_before = local_seconds - before
+    with_after = local_seconds - after
+    valid_before = offset_at(with_before) == before
+    valid_after = offset_at(with_after) == after
+
+    # Both valid in an overlap and neither in a gap, the later instant is then the expected one
+    return np.where(
+        valid_before != valid_after,
+        np.where(valid_before, with_before, with_after),
+        np.maximum(with_before, with_after),
+    )
+
+
+def parse_object_names(names: pa.Array, day: str, naming: str = "range"):
+    """
+    Parse the periods of the objects ``names`` of the day folder ``day`` according to the ``naming`` scheme.
+
+    Returns the naive local start and end times in seconds since the epoch, and the mask of the names that
+    follow the scheme.
+    """
+    day_seconds = calendar.timegm(datetime.strptime(day, "%Y-%m-%d").timetuple())
+    parts = pc.extract_regex(names, NAMING_SCHEMES[naming])
+    valid = parts.is_valid().to_numpy(zero_copy_only=False)
+
+    def field(name):
+        return pc.cast(pc.struct_field(parts, name), pa.int64()).fill_null(0).to_numpy()
+
+    start = day_seconds + field("start_hour") * 3600
+    if naming == "hour":
+        return start, start + 3599, valid
+
+    start = start + field("start_minute") * 60 + field("start_second")
+    end = day_seconds + field("end_hour") * 3600 + field("end_minute") * 60 + field("end_second")
+    end = np.where(end == start, start + 86400, end)
+    return start, end, valid
+
+
+def day_folder(feed_path: str, folder_name: str) -> str:
+    """The day (``YYYY-MM-DD``) of the folder ``folder_name`` listed under ``feed_path``, None if not a day folder."""
+    day = folder_name[len(feed_path):].strip("/")
+    try:
+        datetime.strptime(day, "%Y-%m-%d")
+    except ValueError:
+        # e.g. "latest" or "individual"
+        return None
+    return day
+
+
+def plan_day(objects, day: str, timezone_str: str, naming: str = None, parse_date=None) -> pa.Table:
+    """
+    Build the columnar plan (``PLAN_SCHEMA``) of the objects listed in the day folder ``day``.
+
+    With a ``naming`` scheme every object name is parsed in one vectorised pass. ``parse_date`` is the
+    fallback for custom file names, called once per object.
+    """
+    objects = [file for file in objects if not file.object_name.endswith("/")]
+    names = pa.array([file.object_name for file in objects], pa.string())
+    sizes = pa.array([file.size for file in objects], pa.int64())
+    etags = pa.array([file.etag for file in objects], pa.string())
+
+    if naming is not None:
+        start, end, valid = parse_object_names(names, day, naming)
+        start = to_utc(start, timezone_str) * 1_000_000
+        end = to_utc(end, timezone_str) * 1_000_000
+    else:
+        time_zone = timezone(timezone_str)
+        current_date = datetime.strptime(day, "%Y-%m-%d")
+        start, end = [], []
+        for file in objects:
+            file_start_date, file_end_date = parse_date(current_date, file.object_name)
+            start.append(time_zone.localize(file_start_date, is_dst=None).astimezone(dt_timezone.utc))
+            end.append(time_zone.localize(file_end_date, is_dst=None).astimezone(dt_timezone.utc))
+        valid = np.ones(len(objects), dtype=bool)
+
+    plan = pa.Table.from_arrays(
+        [
+            names,
+            pa.array([day] * len(objects), pa.string()),
+            sizes,
+            etags,
+            pa.array(start, pa.timestamp("us", tz="UTC")),
+            pa.array(end, pa.timestamp("us", tz="UTC")),
+        ],
+        schema=PLAN_SCHEMA,
+    )
+    return plan.filter(pa.array(valid))
+
+
+def select_overlapping(plan: pa.Table, start_date: datetime, end_date: datetime) -> pa.Table:
+    """Keep the objects of ``plan`` overlapping [start_date, end_date) (timezone aware), sorted by start time."""
+    start = pa.scalar(start_date.astimezone(dt_timezone.utc), pa.timestamp("us", tz="UTC"))
+    end = pa.scalar(end_date.astimezone(dt_timezone.utc), pa.timestamp("us", tz="UTC"))
+    selected = plan.filter(pc.and_(pc.less(plan["start"], end), pc.greater(plan["end"], start)))
+    return selected.sort_by([("start", "ascending"), ("object_name", "ascending")])
+
+
+def planned_objects(plan: pa.Table) -> List[PlannedObject]:
+    return [PlannedObject(**row) for row in plan.drop_columns(["day"]).to_pylist()]
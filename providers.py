@@ -0,0 +1,167 @@
+import enum
+import json
+import os
+from typing import Callable, Dict, NamedTuple, Tuple
+
+from spatial_index import IndexColumns
+
+
+class FeedType(enum.Enum):
+    VEHICLE_POSITION = "VehiclePosition"
+    TRIP_UPDATE = "TripUpdate"
+    ALERT = "Alert"
+
+
+# Column names used when a provider doesn't map a role to its own column
+DEFAULT_COLUMNS = {
+    "id": "trip_tripId",
+    "latitude": "position_latitude",
+    "longitude": "position_longitude",
+}
+
+
+class Tuning(NamedTuple):
+    # Concurrent object downloads
+    max_workers: int = 8
+    # Rows per record batch decoded from the Parquet files
+    batch_size: int = 65536
+    # Objects fetched ahead of the one being read when streaming
+    prefetch: int = 8
+    # Seconds results of a period still in progress are cached for
+    cache_ttl: float = 60
+    # Seconds between two listings of the feed by the live view
+    poll_interval: float = 30
+
+
+class Provider(NamedTuple):
+    """
+    Description of a GTFS-RT provider: where its feeds are, how their objects are named and what their data
+    looks like, along with fetch tuning suited to the size of its objects.
+    """
+    key: str
+    name: str
+    feeds: Dict[FeedType, str]
+    timezone: str = "UTC"
+    # Naming scheme of the objects (see ``planning.NAMING_SCHEMES``), or a custom ``parse_date`` function
+    naming: str = "range"
+    parse_date: Callable = None
+    time_column: str = "fetchTime"
+    # Time each entity reported at, repeated by the polls during which it did not report again
+    report_time_column: str = "timestamp"
+    # Role ("id", "latitude", "longitude") to column name, for the roles not named as in DEFAULT_COLUMNS
+    columns: Dict[str, str] = None
+    # Sort keys applied to fetched tables, as for ``pyarrow.Table.sort_by``
+    sort: Tuple[Tuple[str, str], ...] = None
+    tuning: Tuning = Tuning()
+
+    def column(self, role: str) -> str:
+        return (self.columns or {}).get(role, DEFAULT_COLUMNS[role])
+
+    def index_columns(self) -> IndexColumns:
+        """Columns the objects of the provider are indexed on, see ``spatial_index``."""
+        return IndexColumns(self.column("id"), self.column("latitude"), self.column("longitude"))
+
+    def fetch_kwargs(self, feed_type: FeedType, stream: bool = False) -> dict:
+        """Keyword arguments of ``fetch.fetch_data`` (``fetch.fetch_batches`` with ``stream``) for a feed."""
+        kwargs = {
+            "feed_path": self.feeds[feed_type],
+            "parse_date": self.parse_date,
+            "naming": self.naming if self.parse_date is None else None,
+            "timezone_str": self.timezone,
+            "max_workers": self.tuning.max_workers,
+            "batch_size": self.tuning.batch_size,
+        }
+        if stream:
+            kwargs["prefetch"] = self.tuning.prefetch
+        return kwargs
+
+
+PROVIDERS: Dict[str, Provider] = {}
+
+
+def register(provider: Provider) -> Provider:
+    PROVIDERS[provider.key] = provider
+    return provider
+
+
+def get_provider(key: str) -> Provider:
+    try:
+        return PROVIDERS[key]
+    except KeyError:
+        raise KeyError(f"Unknown provider {key!r}, expected one of {list(PROVIDERS)}") from None
+
+
+def load_providers(path: str):
+    """
+    Register the providers described in the JSON file ``path``, keyed by provider key, e.g.
+
+        {"york": {"name": "YORK", "feeds": {"VehiclePosition": "data/york/VehiclePosition/"},
+                  "timezone": "Europe/London", "tuning": {"max_workers": 4}}}
+
+    Fields are those of ``Provider`` except ``parse_date``, file names must follow a naming scheme.
+    """
+    with open(path) as file:
+        described = json.load(file)
+
+    for key, fields in described.items():
+        fields = dict(fields)
+        fields["feeds"] = {FeedType(feed_type): path for feed_type, path in fields["feeds"].items()}
+        if "sort" in fields:
+            fields["sort"] = tuple(tuple(sort_key) for sort_key in fields["sort"])
+        fields["tuning"] = Tuning(**fields.get("tuning", {}))
+        register(Provider(key=key, **fields))
+
+
+register(Provider(
+    key="riga",
+    name="Riga Public Transport",
+    feeds={
+        FeedType.VEHICLE_POSITION: "data/riga/flattened_position/",
+        FeedType.TRIP_UPDATE: "data/riga/flattened_trip_update/",
+    },
+    timezone="Europe/Riga",
+    naming="hour",
+    time_column="timestamp",
+    columns={
+        "latitude": "vehicle_position_latitude",
+        "longitude": "vehicle_position_longitude",
+        "id": "id",
+    },
+    # Small hourly objects, latency bound
+    tuning=Tuning(max_workers=16),
+))
+
+register(Provider(
+    key="ovapi",
+    name="OVAPI",
+    feeds={
+        FeedType.VEHICLE_POSITION: "data/ovapi/VehiclePosition/",
+        FeedType.ALERT: "data/ovapi/Alert/",
+        FeedType.TRIP_UPDATE: "data/ovapi/TripUpdate/",
+    },
+    timezone="Europe/Brussels",
+    # Large objects, fewer of them in flight and bigger batches
+    tuning=Tuning(max_workers=4, batch_size=131072, prefetch=4),
+))
+
+register(Provider(
+    key="ovapi-train",
+    name="OVAPI train",
+    feeds={
+        FeedType.TRIP_UPDATE: "data/ovapi-train/TripUpdate/",
+    },
+    timezone="Europe/Brussels",
+))
+
+register(Provider(
+    key="york",
+    name="YORK",
+    feeds={
+        FeedType.VEHICLE_POSITION: "data/york/VehiclePosition/",
+    },
+    timezone="Europe/London",
+))
+
+if os.environ.get("EMERALDS_PROVIDERS_FILE"):
+    load_providers(os.environ["EMERALDS_PROVIDERS_FILE"])
+
@@ -0,0 +1,200 @@
+import bisect
+import io
+import threading
+import time
+
+from metrics import METRICS
+from storage import RETRIED_ERRORS, backoff_delay
+
+
+class RemoteFile(io.RawIOBase):
+    """
+    Read-only, seekable file over a MinIO object, served by HTTP range requests.
+
+    Only the byte ranges that are actually read come over the wire: ``pq.ParquetFile`` (or a dataset fragment)
+    opened on it fetches the footer, then the column chunks it needs. Every request is extended by
+    ``readahead`` bytes, and missing ranges separated by less than ``hole_size`` bytes are fetched as one.
+    The footer is fetched upfront since it is always the first thing a Parquet reader asks for.
+
+    Fetched ranges are kept as separate chunks, so that reading an object costs its size whatever the order of
+    the reads, and the least recently read chunks are dropped beyond ``max_bytes``.
+    """
+
+    def __init__(
+            self,
+            client,
+            bucket: str,
+            object_name: str,
+            size: int = None,
+            readahead: int = 1024 * 1024,
+            hole_size: int = 64 * 1024,
+            footer_size: int = 64 * 1024,
+            retries: int = 3,
+            max_bytes: int = 64 * 1024 * 1024,
+    ):
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.object_name = object_name
+        self.size = size if size is not None else client.stat_object(bucket, object_name).size
+        self.readahead = readahead
+        self.hole_size = hole_size
+        self.retries = retries
+        self.max_bytes = max_bytes
+
+        self.requests = 0
+        self.bytes_fetched = 0
+
+        self._position = 0
+        # Sorted, non-overlapping chunks already fetched: their starts, data and last read (a read counter)
+        self._starts = []
+        self._chunks = {}
+        self._last_read = {}
+        self._reads = 0
+        self._held = 0
+        self._lock = threading.Lock()
+
+        if footer_size and self.size:
+            start = max(0, self.size - footer_size)
+            self._store(start, self._get(start, self.size))
+
+    def __repr__(self):
+        return f"RemoteFile({self.bucket}/{self.object_name})"
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+        self._position = position
+        return self._position
+
+    def readinto(self, buffer):
+        data = self.read_at(self._position, len(buffer))
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def read_at(self, offset: int, length: int) -> bytes:
+        end = min(offset + length, self.size)
+        if end <= offset:
+            return b""
+
+        with self._lock:
+            self._ensure(offset, end)
+            self._reads += 1
+            pieces = []
+            cursor = offset
+            for chunk_start, data in self._overlapping(offset, end):
+                if chunk_start > cursor:
+                    break
+                pieces.append(data[cursor - chunk_start:end - chunk_start])
+                self._last_read[chunk_start] = self._reads
+                cursor = chunk_start + len(data)
+            self._evict()
+
+        if cursor < end:
+            raise RuntimeError(f"Range {offset}-{end} of {self.object_name} is not available after fetching it")
+        return bytes(pieces[0]) if len(pieces) == 1 else b"".join(pieces)
+
+    def _overlapping(self, start, end):
+        """The chunks overlapping [start, end), in order."""
+        index = max(bisect.bisect_right(self._starts, start) - 1, 0)
+        for chunk_start in self._starts[index:]:
+            if chunk_start >= end:
+                break
+            data = self._chunks[chunk_start]
+            if chunk_start + len(data) > start:
+                yield chunk_start, data
+
+    def _missing(self, start, end):
+        gaps = []
+        cursor = start
+        for chunk_start, data in self._overlapping(start, end):
+            if chunk_start > cursor:
+                gaps.append((cursor, chunk_start))
+            cursor = max(cursor, chunk_start + len(data))
+        if cursor < end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def _ensure(self, start, end):
+        gaps = self._missing(start, end)
+        if not gaps:
+            return
+
+        # Read ahead after the last gap, without overlapping what is already there
+        last_start, last_end = gaps[-1]
+        readahead_end = min(self.size, max(last_end, last_start + self.readahead))
+        index = bisect.bisect_left(self._starts, last_end)
+        if index < len(self._starts):
+            readahead_end = min(readahead_end, self._starts[index])
+        gaps[-1] = (last_start, readahead_end)
+
+        # Coalesce gaps separated by small cached chunks into a single request
+        requests = [gaps[0]]
+        for gap_start, gap_end in gaps[1:]:
+            if gap_start - requests[-1][1] <= self.hole_size:
+                requests[-1] = (requests[-1][0], gap_end)
+            else:
+                requests.append((gap_start, gap_end))
+
+        for request_start, request_end in requests:
+            self._store(request_start, self._get(request_start, request_end))
+
+    def _store(self, start, data):
+        """Keep the parts of ``data`` (at ``start``) not held yet, as views of it."""
+        data = memoryview(data)
+        for gap_start, gap_end in self._missing(start, start + len(data)):
+            bisect.insort(self._starts, gap_start)
+            self._chunks[gap_start] = data[gap_start - start:gap_end - start]
+            self._last_read[gap_start] = self._reads
+            self._held += gap_end - gap_start
+
+    def _evict(self):
+        # The chunks of the current read are kept, whatever their size
+        while self._held > self.max_bytes:
+            chunk_start = min(self._last_read, key=self._last_read.get)
+            if self._last_read[chunk_start] == self._reads:
+                break
+            self._starts.remove(chunk_start)
+            self._held -= len(self._chunks.pop(chunk_start))
+            del self._last_read[chunk_start]
+
+    def _get(self, start, end):
+        for attempt in range(self.retries + 1):
+            try:
+                # Range reads mostly happen while decoding, their time is then also part of the decode stage
+                with METRICS.timer("range_read"):
+                    response = self.client.get_object(self.bucket, self.object_name, offset=start, length=end - start)
+                    try:
+                        data = response.read()
+                    finally:
+                        response.close()
+                        response.release_conn()
+                break
+            except RETRIED_ERRORS:
+                if attempt == self.retries:
+                    raise
+                time.sleep(backoff_delay(attempt))
+
+        self.requests += 1
+        self.bytes_fetched += len(data)
+        METRICS.increment("bytes_transferred", len(data))
+        return data
@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import List
+
+import pyarrow as pa
+
+from metrics import METRICS
+from planning import is_settled
+
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+
+class ResultCache:
+    """
+    In-memory cache of fetched tables keyed by (feed, window, columns, limit), meant to be shared across sessions.
+
+    Entries expire after their own TTL (``None`` never expires, but empty results always get one) and the least recently used ones are evicted
+    once the tables held exceed ``max_bytes``. A request is also answered from a cached superset: a limited
+    result from the full one, a projection from a result with all columns.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, open_ttl: float = 60):
+        self.max_bytes = max_bytes
+        self.open_ttl = open_ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def ttl_for(self, end_date: datetime, timezone_str: str, open_ttl: float = None):
+        """
+        Settled windows (see ``planning.is_settled``) never change, the others are refetched after ``open_ttl``
+        (the cache default if not given).
+        """
+        if is_settled(end_date, timezone_str):
+            return None
+        return self.open_ttl if open_ttl is None else open_ttl
+
+    def get(self, feed_path: str, start_date: datetime, end_date: datetime, columns: List[str] = None, limit: int = None):
+        """Return ``(found, table)``, a cached table can be None when the window had no data."""
+        columns = tuple(columns) if columns is not None else None
+        candidates = [(columns, limit)]
+        if limit is not None:
+            candidates.append((columns, None))
+        if columns is not None:
+            candidates += [(None, limit), (None, None)] if limit is not None else [(None, None)]
+
+        with self._lock:
+            for cached_columns, cached_limit in candidates:
+                key = (feed_path, start_date, end_date, cached_columns, cached_limit)
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                table, expires_at = entry
+                if expires_at is not None and expires_at < time.monotonic():
+                    self._remove(key)
+                    continue
+
+                if table is not None and cached_columns != columns and \
+                        not set(columns).issubset(table.schema.names):
+                    continue
+
+                self._entries.move_to_end(key)
+                self._hits += 1
+                if table is not None and cached_columns != columns:
+                    table = table.select(list(columns))
+                if table is not None and cached_limit != limit:
+                    table = table.slice(0, limit)
+                found = True
+                break
+            else:
+                self._misses += 1
+                table = None
+                found = False
+
+        METRICS.increment("cache_hits" if found else "cache_misses", cache="result")
+        return found, table
+
+    def put(self, feed_path: str, start_date: datetime, end_date: datetime, table: pa.Table,
+            columns: List[str] = None, limit: int = None, ttl: float = None):
+        key = (feed_path, start_date, end_date, tuple(columns) if columns is not None else None, limit)
+        size = table.get_total_buffer_size() if table is not None else 0
+        if size > self.max_bytes:
+            return
+        if table is None and ttl is None:
+            # No data may only mean that the objects have not landed yet, and costs nothing to the byte budget
+            ttl = self.open_ttl
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (table, time.monotonic() + ttl if ttl is not None else None)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def get_or_fetch(self, feed_path: str, start_date: datetime, end_date: datetime, fetch,
+                     columns: List[str] = None, limit: int = None, ttl: float = None):
+        found, table = self.get(feed_path, start_date, end_date, columns, limit)
+        if found:
+            return table
+
+        table = fetch()
+        self.put(feed_path, start_date, end_date, table, columns, limit, ttl)
+        return table
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        table, _ = self._entries.pop(key)
+        self._bytes -= table.get_total_buffer_size() if table is not None else 0
@@ -0,0 +1,217 @@
+import logging
+import os
+import tempfile
+from typing import Generator, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Side of the grid cells, in degrees (about 1 km of latitude)
+CELL_SIZE = 0.01
+
+# Suffix of the index stored next to a cached object, ``<entry>.index`` for ``<entry>.parquet``
+INDEX_SUFFIX = ".index"
+
+# One row per entity and per grid cell of each row group: the range of rows of the object it spans
+INDEX_SCHEMA = pa.schema([
+    ("row_group", pa.int32()),
+    # Entity id as a string, null on the rows of grid cells
+    ("id", pa.string()),
+    # Grid cell, see ``cells``, null on the rows of entities
+    ("cell", pa.int64()),
+    ("first_row", pa.int64()),
+    ("last_row", pa.int64()),
+])
+
+
+class IndexColumns(NamedTuple):
+    """Columns an object index is built on, any of them may be missing from the objects or left out."""
+    id: str = None
+    latitude: str = None
+    longitude: str = None
+    cell_size: float = CELL_SIZE
+
+    def metadata(self) -> dict:
+        return {f"index_{key}".encode(): str(value).encode() for key, value in self._asdict().items()}
+
+
+def cells(latitudes: np.ndarray, longitudes: np.ndarray, cell_size: float = CELL_SIZE) -> np.ndarray:
+    """Grid cell of each position: its row (from the south pole) times the cells per row, plus its column."""
+    per_row = int(np.ceil(360 / cell_size))
+    rows = np.floor((np.asarray(latitudes, dtype=np.float64) + 90) / cell_size).astype(np.int64)
+    columns = np.floor((np.asarray(longitudes, dtype=np.float64) + 180) / cell_size).astype(np.int64)
+    return rows * per_row + np.clip(columns, 0, per_row - 1)
+
+
+def _ranges(keys: pa.Array, rows: np.ndarray, row_group: int, key_name: str) -> pa.Table:
+    """First and last row of each distinct key, as ``INDEX_SCHEMA`` rows."""
+    grouped = pa.table({"key": keys, "row": rows}).drop_null().group_by("key").aggregate(
+        [("row", "min"), ("row", "max")])
+    columns = {
+        "row_group": pa.array(np.full(grouped.num_rows, row_group, dtype=np.int32)),
+        "id": pa.nulls(grouped.num_rows, pa.string()),
+        "cell": pa.nulls(grouped.num_rows, pa.int64()),
+        "first_row": grouped["row_min"],
+        "last_row": grouped["row_max"],
+    }
+    columns[key_name] = grouped["key"]
+    return pa.table(columns, schema=INDEX_SCHEMA)
+
+
+def build_index(source, index_columns: IndexColumns) -> pa.Table:
+    """
+    Index the Parquet file ``source`` row group by row group: the rows each entity spans and the rows in each
+    grid cell of ``index_columns.cell_size`` degrees. Only the indexed columns are read.
+    """
+    with METRICS.timer("index"):
+        parquet = pq.ParquetFile(source)
+        names = parquet.schema_arrow.names
+        id_column = index_columns.id if index_columns.id in names else None
+        spatial = index_columns.latitude in names and index_columns.longitude in names
+        read_columns = ([id_column] if id_column else []) + (
+            [index_columns.latitude, index_columns.longitude] if spatial else [])
+
+        parts = []
+        offset = 0
+        for row_group in range(parquet.num_row_groups):
+            num_rows = parquet.metadata.row_group(row_group).num_rows
+            if read_columns:
+                table = parquet.read_row_group(row_group, columns=read_columns)
+                rows = np.arange(offset, offset + num_rows, dtype=np.int64)
+                if id_column:
+                    parts.append(_ranges(table[id_column].cast(pa.string()), rows, row_group, "id"))
+                if spatial:
+                    valid = pc.and_(pc.is_valid(table[index_columns.latitude]),
+                                    pc.is_valid(table[index_columns.longitude]))
+                    positions = table.filter(valid)
+                    keys = cells(
+                        positions[index_columns.latitude].to_numpy(),
+                        positions[index_columns.longitude].to_numpy(),
+                        index_columns.cell_size,
+                    )
+                    rows = rows[valid.to_numpy(zero_copy_only=False)]
+                    parts.append(_ranges(pa.array(keys), rows, row_group, "cell"))
+            offset += num_rows
+
+        index = pa.concat_tables(parts) if parts else INDEX_SCHEMA.empty_table()
+        return index.replace_schema_metadata(index_columns.metadata())
+
+
+def index_path(path: str) -> str:
+    """Path of the index of the local Parquet file ``path``."""
+    return os.path.splitext(path)[0] + INDEX_SUFFIX
+
+
+def load_index(path: str, index_columns: IndexColumns, build: bool = True) -> pa.Table:
+    """
+    The index of the local Parquet file ``path``, read from next to it. A missing index, or one built on
+    other columns, is built and stored (unless ``build`` is False, then None is returned).
+    """
+    sidecar = index_path(path)
+    try:
+        index = pq.read_table(sidecar)
+        if index.schema.metadata == index_columns.metadata():
+            return index
+    except (FileNotFoundError, pa.ArrowInvalid):
+        pass
+    if not build:
+        return None
+
+    index = build_index(path, index_columns)
+    # Written aside and renamed, concurrent readers never see a partial index
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(sidecar), suffix=".part")
+    os.close(fd)
+    try:
+        pq.write_table(index, tmp_path)
+        os.replace(tmp_path, sidecar)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    logger.debug("Indexed %s (%d entries)", path, index.num_rows)
+    return index
+
+
+def matching_row_groups(
+        index: pa.Table,
+        ids: Sequence = None,
+        bbox: Tuple[float, float, float, float] = None,
+        cell_size: float = CELL_SIZE,
+) -> List[int]:
+    """
+    Row groups holding rows of one of ``ids`` and, with ``bbox`` (min longitude, min latitude, max longitude,
+    max latitude), rows in a grid cell overlapping it.
+    """
+    groups = None
+    if ids is not None:
+        selected = index.filter(pc.is_in(index["id"], pa.array([str(value) for value in ids], pa.string())))
+        groups = set(selected["row_group"].to_pylist())
+    if bbox is not None:
+        min_longitude, min_latitude, max_longitude, max_latitude = bbox
+        per_row = int(np.ceil(360 / cell_size))
+        # Cells are compared on their row and column, a bbox may span any number of them
+        index_cells = index["cell"].drop_null().to_numpy()
+        index_groups = index.filter(pc.is_valid(index["cell"]))["row_group"].to_numpy()
+        low, high = cells([min_latitude, max_latitude], [min_longitude, max_longitude], cell_size)
+        rows, columns = index_cells // per_row, index_cells % per_row
+        inside = ((rows >= low // per_row) & (rows <= high // per_row)
+                  & (columns >= low % per_row) & (columns <= high % per_row))
+        spatial = set(index_groups[inside].tolist())
+        groups = spatial if groups is None else groups & spatial
+    if groups is None:
+        groups = set(index["row_group"].to_pylist())
+    return sorted(groups)
+
+
+def read_matching(
+        path: str,
+        index_columns: IndexColumns,
+        ids: Sequence = None,
+        bbox: Tuple[float, float, float, float] = None,
+        columns: List[str] = None,
+        batch_size: int = 65536,
+) -> Generator[pa.RecordBatch, None, None]:
+    """
+    Yield the rows of the local Parquet file ``path`` of one of ``ids`` and inside ``bbox`` (min longitude,
+    min latitude, max longitude, max latitude), reading only the row groups the index of the file points to.
+    The index is built on first use, see ``load_index``.
+    """
+    index = load_index(path, index_columns)
+    parquet_format = ds.ParquetFileFormat()
+    schema = parquet_format.make_fragment(path, filesystem=fs.LocalFileSystem()).physical_schema
+    if (ids is not None and index_columns.id not in schema.names) or (bbox is not None and not (
+            index_columns.latitude in schema.names and index_columns.longitude in schema.names)):
+        raise ValueError(f"{path} has none of the columns to select rows by, expected {index_columns}")
+
+    row_groups = matching_row_groups(index, ids, bbox, index_columns.cell_size)
+    num_row_groups = pq.ParquetFile(path).num_row_groups
+    METRICS.increment("row_groups_skipped", num_row_groups - len(row_groups))
+    if not row_groups:
+        return
+
+    expression = None
+    if ids is not None:
+        values = pa.array([str(value) for value in ids], pa.string()).cast(schema.field(index_columns.id).type)
+        expression = ds.field(index_columns.id).isin(values)
+    if bbox is not None:
+        min_longitude, min_latitude, max_longitude, max_latitude = bbox
+        inside = ((ds.field(index_columns.latitude) >= min_latitude)
+                  & (ds.field(index_columns.latitude) <= max_latitude)
+                  & (ds.field(index_columns.longitude) >= min_longitude)
+                  & (ds.field(index_columns.longitude) <= max_longitude))
+        expression = inside if expression is None else expression & inside
+
+    fragment = parquet_format.make_fragment(path, filesystem=fs.LocalFileSystem(), row_groups=row_groups)
+    for batch in METRICS.timed(fragment.to_batches(columns=columns, filter=expression, batch_size=batch_size),
+                               "decode"):
+        if batch.num_rows:
+            METRICS.increment("rows_decoded", batch.num_rows)
+            yield batch
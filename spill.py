@@ -0,0 +1,124 @@
+import hashlib
+import os
+import tempfile
+
+import pandas as pd
+import pyarrow as pa
+
+from cache import DEFAULT_CACHE_DIR
+from metrics import METRICS
+
+DEFAULT_SPILL_MAX_BYTES = int(os.environ.get("EMERALDS_SPILL_MAX_BYTES", 4 * 1024 ** 3))
+
+# Bytes of incoming batches concatenated into one record batch of the spill file
+SPILL_BATCH_BYTES = 64 * 1024 ** 2
+
+
+def spill_path(directory: str, *key) -> str:
+    """Path of the spill file of the request identified by ``key``, in ``<directory>/spill``."""
+    digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+    return os.path.join(directory or DEFAULT_CACHE_DIR, "spill", digest + ".arrow")
+
+
+def open_spilled(path: str) -> pa.Table:
+    """
+    Open a spill file as a table backed by a memory map of the file: nothing is read until used, and every
+    process opening the same file shares its pages in the page cache.
+    """
+    os.utime(path)
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+def spill(batches, path: str, max_bytes: int = None, batch_bytes: int = SPILL_BATCH_BYTES) -> pa.Table:
+    """
+    Write ``batches`` to an uncompressed Arrow IPC file at ``path`` and return it memory mapped, or None if
+    there were no batches. The file is written once, as they come: consecutive batches are concatenated into
+    record batches of about ``batch_bytes``, so that columns come in few large chunks while the heap holds at
+    most one of them.
+
+    Other spill files of the directory are then evicted, least recently opened first, down to ``max_bytes``.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+    os.close(fd)
+
+    writer = None
+    try:
+        with pa.OSFile(tmp_path, "wb") as sink:
+            for batch in _coalesce(batches, batch_bytes):
+                if writer is None:
+                    writer = pa.ipc.new_file(sink, batch.schema)
+                with METRICS.timer("spill"):
+                    writer.write_batch(batch)
+            if writer is not None:
+                writer.close()
+        if writer is None:
+            os.remove(tmp_path)
+            return None
+        # Readers of a previous version keep their mapping of the replaced file
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    _evict(directory, DEFAULT_SPILL_MAX_BYTES if max_bytes is None else max_bytes, keep=path)
+    return open_spilled(path)
+
+
+def _coalesce(batches, batch_bytes: int):
+    """Concatenate consecutive ``batches`` into record batches of about ``batch_bytes``."""
+    pending = []
+    size = 0
+    for batch in batches:
+        pending.append(batch)
+        size += batch.nbytes
+        if size >= batch_bytes:
+            yield _concat(pending)
+            pending = []
+            size = 0
+    if pending:
+        yield _concat(pending)
+
+
+def _concat(batches) -> pa.RecordBatch:
+    if len(batches) == 1:
+        return batches[0]
+    with METRICS.timer("spill"):
+        return pa.Table.from_batches(batches).combine_chunks().to_batches()[0]
+
+
+def to_pandas(table: pa.Table) -> pd.DataFrame:
+    """
+    Convert ``table`` to a DataFrame without consolidating columns into 2D blocks, so that numeric columns
+    without nulls in a single chunk are views of the Arrow buffers (of the memory map for a spilled table)
+    rather than copies. Columns of several chunks are concatenated by the conversion.
+    """
+    with METRICS.timer("to_pandas"):
+        return table.to_pandas(split_blocks=True)
+
+
+def _evict(directory: str, max_bytes: int, keep: str = None):
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith(".arrow"):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+        except FileNotFoundError:
+            pass
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            # Mapped by a reader, the file stays readable until it is unmapped
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
@@ -0,0 +1,67 @@
+import os
+import threading
+
+import certifi
+import minio
+import urllib3
+from minio.error import ServerError
+
+DEFAULT_ENDPOINT = os.environ.get("EMERALDS_MINIO_ENDPOINT", "minio-api.apps.emeralds.ari-aidata.eu")
+DEFAULT_BUCKET = os.environ.get("EMERALDS_MINIO_BUCKET", "public")
+DEFAULT_SECURE = os.environ.get("EMERALDS_MINIO_SECURE", "true").lower() not in ("0", "false", "no")
+
+# Errors a request to the object store is retried on
+RETRIED_ERRORS = (ServerError, urllib3.exceptions.HTTPError, OSError)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(
+        access_key=os.environ.get("MINIO_ACCESS_KEY"),
+        secret_key=os.environ.get("MINIO_SECRET_KEY"),
+        endpoint: str = None,
+        secure: bool = None,
+        pool_size: int = 16,
+        connect_timeout: float = 10,
+        read_timeout: float = 60,
+        retries: int = 3,
+) -> minio.Minio:
+    """
+    Return a MinIO client for ``endpoint``, shared by every caller asking for the same configuration.
+
+    Sharing the client shares its connection pool, so repeated fetches reuse open (TLS) connections instead
+    of doing a handshake each time. ``pool_size`` should be at least the number of concurrent downloads.
+    The endpoint defaults to ``EMERALDS_MINIO_ENDPOINT`` and ``EMERALDS_MINIO_SECURE``, which can point at
+    an on-prem mirror or a local MinIO-compatible server (e.g. ``localhost:9000`` without TLS).
+    """
+    endpoint = endpoint or DEFAULT_ENDPOINT
+    secure = DEFAULT_SECURE if secure is None else secure
+    key = (endpoint, secure, access_key, secret_key, pool_size, connect_timeout, read_timeout, retries)
+
+    with _clients_lock:
+        if key not in _clients:
+            http_client = urllib3.PoolManager(
+                timeout=urllib3.Timeout(connect=connect_timeout, read=read_timeout),
+                maxsize=pool_size,
+                cert_reqs="CERT_REQUIRED",
+                ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+                retries=urllib3.Retry(
+                    total=retries,
+                    backoff_factor=0.2,
+                    status_forcelist=[500, 502, 503, 504],
+                ),
+            )
+            _clients[key] = minio.Minio(
+                endpoint,
+                access_key=access_key,
+                secret_key=secret_key,
+                secure=secure,
+                http_client=http_client,
+            )
+        return _clients[key]
+
+
+def backoff_delay(attempt: int, backoff: float = 0.5) -> float:
+    """Seconds to wait before retrying a request that failed ``attempt`` times before: 0.5s, 1s, 2s, ..."""
+    return backoff * 2 ** attempt
@@ -0,0 +1,182 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Generator, List
+
+import minio
+import pyarrow as pa
+from pyarrow import Table
+from pytz import timezone
+
+from cache import ObjectCache
+from fetch import ObjectPipeline, default_parse_date
+from metrics import METRICS
+from planning import PlannedObject, day_folder, plan_day, planned_objects
+from storage import DEFAULT_BUCKET, get_client
+
+logger = logging.getLogger(__name__)
+
+# Naming schemes whose object names sort as their periods do, so that the objects listed past the name of
+# the newest one are exactly the newer ones. "HH.parquet" names do not: "10.parquet" sorts before "9.parquet".
+ORDERED_NAMINGS = {"range"}
+
+
+class FeedTail:
+    """
+    Follows one feed as new objects land in it, fetching each object once.
+
+    The tail keeps a cursor on the newest object consumed. Polling lists the day folder of the cursor past it
+    (``start_after``) along with the day folders created since, so the objects already consumed are neither
+    listed again (with ordered names, see ``ORDERED_NAMINGS``) nor fetched again. Other naming schemes list
+    the day folder of the cursor whole and compare periods instead.
+
+    The first poll returns the objects ending after ``since`` (timezone-naive local time, now by default),
+    unless the tail resumes after the object named ``cursor``. Objects landing after a newer one has already
+    been consumed are skipped, as are those of days before the cursor.
+
+    Objects are fetched and decoded as ``fetch.fetch_batches`` does, with the same arguments.
+    """
+
+    def __init__(
+            self,
+            feed_path: str,
+            since: datetime = None,
+            cursor: str = None,
+            parse_date=None,
+            access_key=os.environ.get("MINIO_ACCESS_KEY"),
+            secret_key=os.environ.get("MINIO_SECRET_KEY"),
+            timezone_str="Europe/Brussels",
+            max_workers: int = 4,
+            retries: int = 3,
+            cache: ObjectCache = None,
+            prefetch: int = 2,
+            batch_size: int = 65536,
+            columns: List[str] = None,
+            filters=None,
+            client: minio.Minio = None,
+            bucket: str = None,
+            naming: str = None,
+    ):
+        if naming is None and parse_date in (None, default_parse_date):
+            naming = "range"
+
+        self.feed_path = feed_path
+        self.parse_date = parse_date
+        self.naming = naming
+        self.timezone_str = timezone_str
+        self.max_workers = max_workers
+        self.retries = retries
+        self.cache = cache
+        self.prefetch = prefetch
+        self.batch_size = batch_size
+        self.columns = columns
+        self.filters = filters
+        self.client = client or get_client(access_key, secret_key)
+        self.bucket = bucket or DEFAULT_BUCKET
+
+        time_zone = timezone(timezone_str)
+        self.since = time_zone.localize(since) if since is not None else datetime.now(time_zone)
+        self.cursor = cursor
+        # Period start of the cursor object, looked up when resuming after an unordered name
+        self._cursor_start = None
+
+    @property
+    def day(self) -> str:
+        """Day folder of the cursor, that of ``since`` before the first object."""
+        if self.cursor is not None:
+            return self.cursor[len(self.feed_path):].split("/")[0]
+        return self.since.strftime("%Y-%m-%d")
+
+    def poll(self) -> List[PlannedObject]:
+        """The objects landed past the cursor, in time order. The cursor only moves as they are read."""
+        ordered = self.naming in ORDERED_NAMINGS
+        with METRICS.timer("list"):
+            folders = list(self.client.list_objects(
+                self.bucket, self.feed_path, start_after=self.feed_path + self.day))
+
+        new = []
+        for folder in folders:
+            day = day_folder(self.feed_path, folder.object_name)
+            if day is None:
+                continue
+
+            start_after = self.cursor if ordered and day == self.day else None
+            with METRICS.timer("list"):
+                objects = [
+                    file for file in self.client.list_objects(self.bucket, self.feed_path + day + "/",
+                                                              start_after=start_after)
+                    if not file.object_name.endswith("/")
+                ]
+            METRICS.increment("objects_listed", len(objects))
+
+            with METRICS.timer("plan"):
+                plan = plan_day(objects, day, self.timezone_str, naming=self.naming, parse_date=self.parse_date)
+                files = planned_objects(plan.sort_by([("start", "ascending"), ("object_name", "ascending")]))
+            if self.cursor is not None and self._cursor_start is None:
+                self._cursor_start = next((file.start for file in files if file.object_name == self.cursor), None)
+            selected = [file for file in files if self._is_new(file)]
+            METRICS.increment("objects_skipped", len(files) - len(selected))
+            new += selected
+        return new
+
+    def read(self, files: List[PlannedObject]) -> Generator[pa.RecordBatch, None, None]:
+        """
+        Yield the record batches of ``files``, in order, moving the cursor past each object once its last batch
+        has been consumed. At most ``prefetch`` objects are fetched ahead of the one being read.
+        """
+        with ObjectPipeline(self.client, self.bucket, self.retries, self.cache, batch_size=self.batch_size,
+                            columns=self.columns, filters=self.filters) as pipeline:
+            for file, source in pipeline.sources(files, self.max_workers, self.prefetch):
+                yield from pipeline.read([source])
+                self._advance(file)
+
+    def fetch_new(self, max_objects: int = None) -> Table:
+        """The rows of the objects landed since the last call as one table (the delta), or None if there are none."""
+        batches = list(self.read(self.poll()[:max_objects]))
+        if not batches:
+            return None
+
+        with METRICS.timer("concat"):
+            return Table.from_batches(batches)
+
+    def follow(
+            self,
+            poll_interval: float = 30,
+            max_objects: int = None,
+            stop: threading.Event = None,
+    ) -> Generator[pa.RecordBatch, None, None]:
+        """
+        Yield the record batches of new objects as they land, polling every ``poll_interval`` seconds while there
+        are none, until ``stop`` is set.
+
+        Nothing is listed or fetched while the consumer is busy with a batch, past the ``prefetch`` objects:
+        a slow consumer falls behind the feed instead of buffering it. Catching up reads ``max_objects`` per
+        listing at most, so that a tail far behind does not plan the whole backlog at once.
+        """
+        while stop is None or not stop.is_set():
+            files = self.poll()
+            if files:
+                yield from self.read(files[:max_objects])
+                # More may have landed in the meantime
+                continue
+
+            logger.debug("No new object after %s, next poll in %ss", self.cursor, poll_interval)
+            if stop is not None:
+                stop.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+
+    def _is_new(self, file: PlannedObject) -> bool:
+        if self.cursor is None:
+            return file.end > self.since
+        if self._cursor_start is None:
+            # Ordered names, or the cursor object is gone
+            return file.object_name > self.cursor
+        return (file.start, file.object_name) > (self._cursor_start, self.cursor)
+
+    def _advance(self, file: PlannedObject):
+        self.cursor = file.object_name
+        self._cursor_start = file.start
+
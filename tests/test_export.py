@@ -0,0 +1,48 @@
+import os
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from benchmarks.fake_minio import FakeMinio
+from export import export_days, part_path
+
+FEED = "data/test/VehiclePosition/"
+
+
+def _write_object(directory, day, hour, rows):
+    folder = directory / FEED / day
+    folder.mkdir(parents=True, exist_ok=True)
+    table = pa.table({"id": [str(i) for i in range(rows)], "fetchTime": list(range(rows))})
+    pq.write_table(table, folder / f"{hour:02d}-00-00_x_{hour:02d}-59-59.parquet")
+
+
+def _export(source, output_dir, **kwargs):
+    return export_days(datetime(2024, 3, 4), datetime(2024, 3, 5), FEED, output_dir=str(output_dir),
+                       client=FakeMinio(str(source), latency=0), bucket="bucket", timezone_str="UTC", **kwargs)
+
+
+def test_other_format_is_exported_again(tmp_path):
+    _write_object(tmp_path / "bucket", "2024-03-04", 8, 5)
+    output_dir = tmp_path / "out"
+
+    assert _export(tmp_path / "bucket", output_dir, format="csv")[0].rows == 5
+    skipped = _export(tmp_path / "bucket", output_dir, format="csv")[0]
+    assert skipped.skipped and skipped.path == part_path(str(output_dir), "2024-03-04", "csv")
+
+    exported = _export(tmp_path / "bucket", output_dir, format="json")[0]
+    assert not exported.skipped and exported.rows == 5
+    assert sorted(os.listdir(os.path.dirname(exported.path))) == ["_SUCCESS", "part-0.jsonl"]
+
+
+def test_overwrite_with_no_rows_removes_the_previous_file(tmp_path):
+    _write_object(tmp_path / "bucket", "2024-03-04", 8, 5)
+    output_dir = tmp_path / "out"
+    path = _export(tmp_path / "bucket", output_dir)[0].path
+
+    os.remove(tmp_path / "bucket" / FEED / "2024-03-04" / "08-00-00_x_08-59-59.parquet")
+    _write_object(tmp_path / "bucket", "2024-03-04", 9, 0)
+    exported = _export(tmp_path / "bucket", output_dir, overwrite=True)[0]
+
+    assert exported.rows == 0 and exported.path is None
+    assert not os.path.exists(path)
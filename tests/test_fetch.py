@@ -0,0 +1,28 @@
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from fetch import read_batches
+
+START = 1711843200  # 2024-03-31 00:00 UTC
+
+
+def _read_times(path, start_date, end_date):
+    batches = read_batches([str(path)], time_column="fetchTime", start_date=start_date, end_date=end_date)
+    return [value for batch in batches for value in batch.column("fetchTime").to_pylist()]
+
+
+def test_integer_time_column_bounds_straddling_row_groups(tmp_path):
+    # One row per minute over two hours, in row groups of half an hour
+    times = [START + seconds for seconds in range(0, 7200, 60)]
+    path = tmp_path / "object.parquet"
+    pq.write_table(pa.table({"fetchTime": pa.array(times, pa.int64())}), path, row_group_size=30)
+
+    # Both bounds fall inside a row group, and between two whole seconds
+    start_date = datetime.fromtimestamp(START + 1200.5, timezone.utc)
+    end_date = datetime.fromtimestamp(START + 5400.5, timezone.utc)
+
+    assert _read_times(path, start_date, end_date) == [
+        time for time in times if start_date.timestamp() <= time < end_date.timestamp()
+    ]
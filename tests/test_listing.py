@@ -0,0 +1,60 @@
+from datetime import datetime, timezone
+
+from benchmarks.fake_minio import FakeMinio
+from listing import ListingIndex
+
+FEED_PATH = "data/feed/"
+
+
+def _add_objects(directory, day, hours):
+    folder = directory / "objects" / FEED_PATH / day
+    folder.mkdir(parents=True, exist_ok=True)
+    for hour in hours:
+        (folder / f"{hour:02d}-00-00_feed_{hour + 1:02d}-00-00.parquet").write_bytes(b"x" * (hour + 1))
+
+
+def _client(directory):
+    # The fake server lists the files present when it is created
+    return FakeMinio(str(directory / "objects"), latency=0)
+
+
+def _names(objects):
+    """``day/HH`` of each object, the day folder and start hour of its name."""
+    return [planned.object_name[len(FEED_PATH):len(FEED_PATH) + 13] for planned in objects]
+
+
+def _utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_query_returns_overlapping_objects_in_start_order(tmp_path):
+    _add_objects(tmp_path, "2024-03-01", [10, 8, 9])
+    index = ListingIndex(FEED_PATH, directory=str(tmp_path / "listings"), timezone_str="UTC")
+    index.refresh(_client(tmp_path), force=True)
+
+    assert _names(index.query(_utc(2024, 3, 1, 8, 30), _utc(2024, 3, 1, 10))) == ["2024-03-01/08", "2024-03-01/09"]
+    assert index.query(_utc(2024, 3, 1, 11), _utc(2024, 3, 1, 12)) == []
+
+
+def test_refresh_lists_the_last_day_again_and_the_days_landed_since(tmp_path):
+    _add_objects(tmp_path, "2024-03-01", [8, 9])
+    _add_objects(tmp_path, "2024-03-02", [0])
+    directory = str(tmp_path / "listings")
+    index = ListingIndex(FEED_PATH, directory=directory, timezone_str="UTC")
+    index.refresh(_client(tmp_path), force=True)
+    assert index.days_names() == ["2024-03-01", "2024-03-02"]
+
+    # The last day indexed keeps growing and a new day lands
+    _add_objects(tmp_path, "2024-03-02", [1])
+    _add_objects(tmp_path, "2024-03-03", [0])
+    # Reopened from its file, as another session would
+    index = ListingIndex(FEED_PATH, directory=directory, timezone_str="UTC")
+    client = _client(tmp_path)
+    index.refresh(client, force=True)
+
+    assert index.days_names() == ["2024-03-01", "2024-03-02", "2024-03-03"]
+    assert _names(index.query(_utc(2024, 3, 1), _utc(2024, 3, 4))) == [
+        "2024-03-01/08", "2024-03-01/09", "2024-03-02/00", "2024-03-02/01", "2024-03-03/00",
+    ]
+    # Only the folders from the last indexed day on are listed: the folders, then each of the two days
+    assert client.requests == 3
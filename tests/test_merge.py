@@ -0,0 +1,60 @@
+import pyarrow as pa
+
+from merge import merge_objects
+
+
+def _object(start, rows):
+    """An object starting at ``start`` with (vehicle, poll time, report time) ``rows``."""
+    ids, polls, reports = zip(*rows) if rows else ((), (), ())
+    batch = pa.record_batch({
+        "id": pa.array(ids, pa.string()),
+        "fetchTime": pa.array(polls, pa.int64()),
+        "timestamp": pa.array(reports, pa.int64()),
+    })
+    return start, [batch]
+
+
+def _merge(objects, **kwargs):
+    batches = list(merge_objects(objects, "fetchTime", "id", lateness=10, batch_size=2, **kwargs))
+    return pa.Table.from_batches(batches).to_pylist() if batches else []
+
+
+def test_rows_are_ordered_across_overlapping_objects():
+    objects = [
+        _object(0, [("b", 95, 90), ("a", 30, 25), ("a", 0, 0)]),
+        # Rows up to ``lateness`` before the start of the object are merged with the previous one
+        _object(100, [("a", 130, 125), ("a", 92, 91), ("b", 100, 99)]),
+        _object(200, []),
+        _object(300, [("c", 300, 300)]),
+    ]
+
+    rows = _merge(objects)
+
+    assert [(row["fetchTime"], row["id"]) for row in rows] == [
+        (0, "a"), (30, "a"), (92, "a"), (95, "b"), (100, "b"), (130, "a"), (300, "c"),
+    ]
+
+
+def test_deduplicate_drops_repeated_time_and_entity_across_objects():
+    objects = [
+        _object(0, [("a", 0, 0), ("b", 95, 95)]),
+        _object(100, [("b", 95, 95), ("a", 100, 100), ("a", 100, 100)]),
+    ]
+
+    rows = _merge(objects, deduplicate_rows=True)
+
+    assert [(row["fetchTime"], row["id"]) for row in rows] == [(0, "a"), (95, "b"), (100, "a")]
+
+
+def test_dedup_on_drops_polls_repeating_the_report_time_across_objects():
+    # Polled every 30 seconds, "a" reports at 0 and 60 only, "b" at 0, 30 and 90
+    objects = [
+        _object(0, [("a", 0, 0), ("b", 0, 0), ("a", 30, 0), ("b", 30, 30), ("a", 60, 60), ("b", 60, 30)]),
+        _object(90, [("a", 90, 60), ("b", 90, 90), ("a", 120, 60)]),
+    ]
+
+    rows = _merge(objects, deduplicate_rows=True, dedup_on="timestamp")
+
+    assert [(row["id"], row["fetchTime"]) for row in rows] == [
+        ("a", 0), ("b", 0), ("b", 30), ("a", 60), ("b", 90),
+    ]
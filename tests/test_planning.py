@@ -0,0 +1,32 @@
+import calendar
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from pytz import timezone
+
+from planning import to_utc
+
+
+def _local_seconds(value: datetime) -> int:
+    return calendar.timegm(value.timetuple())
+
+
+@pytest.mark.parametrize("timezone_str, day", [
+    # Spring forward and fall back
+    ("Europe/Brussels", datetime(2024, 3, 31)),
+    ("Europe/Brussels", datetime(2024, 10, 27)),
+    ("Europe/Riga", datetime(2024, 3, 31)),
+    ("Europe/London", datetime(2024, 10, 27)),
+    ("America/New_York", datetime(2024, 3, 10)),
+    ("UTC", datetime(2024, 3, 31)),
+])
+def test_to_utc_matches_pytz_across_transitions(timezone_str, day):
+    time_zone = timezone(timezone_str)
+    times = [day - timedelta(hours=2) + timedelta(minutes=15 * i) for i in range(4 * 28)]
+
+    converted = to_utc(np.array([_local_seconds(value) for value in times], dtype=np.int64), timezone_str)
+
+    # Ambiguous times resolve to the second occurrence, non-existent ones are shifted forward
+    expected = [int(time_zone.localize(value, is_dst=False).timestamp()) for value in times]
+    assert converted.tolist() == expected
@@ -0,0 +1,35 @@
+import random
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from benchmarks.fake_minio import FakeMinio
+from fetch import read_batches
+from remote import RemoteFile
+
+
+def test_reads_match_the_object_and_hold_at_most_max_bytes(tmp_path):
+    content = random.Random(0).randbytes(4 * 1024 * 1024)
+    (tmp_path / "object").write_bytes(content)
+    remote = RemoteFile(FakeMinio(str(tmp_path), latency=0), "bucket", "object", readahead=64 * 1024,
+                        max_bytes=512 * 1024)
+
+    rng = random.Random(1)
+    for _ in range(500):
+        offset = rng.randrange(len(content))
+        length = rng.randrange(1, 256 * 1024)
+        assert remote.read_at(offset, length) == content[offset:offset + length]
+        assert remote._held <= 512 * 1024 + 256 * 1024 + 64 * 1024
+
+
+def test_full_read_fetches_every_byte_once(tmp_path):
+    table = pa.table({"value": np.arange(1_000_000)})
+    pq.write_table(table, tmp_path / "object.parquet", row_group_size=100_000, compression=None)
+    client = FakeMinio(str(tmp_path), latency=0)
+
+    remote = RemoteFile(client, "bucket", "object.parquet")
+    batches = list(read_batches([remote]))
+
+    assert pa.Table.from_batches(batches)["value"].equals(table["value"])
+    assert remote.bytes_fetched <= (tmp_path / "object.parquet").stat().st_size
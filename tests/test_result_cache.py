@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+from pytz import timezone
+
+from result_cache import ResultCache
+
+TIMEZONE = "Europe/Brussels"
+
+
+def _now():
+    return datetime.now(timezone(TIMEZONE)).replace(tzinfo=None, microsecond=0)
+
+
+def test_window_just_closed_is_not_settled():
+    cache = ResultCache(open_ttl=60)
+    end_date = _now() - timedelta(minutes=1)
+
+    assert cache.ttl_for(end_date, TIMEZONE) == 60
+    assert cache.ttl_for(end_date - timedelta(days=1), TIMEZONE) is None
+
+
+def test_empty_result_is_refetched():
+    cache = ResultCache(open_ttl=0)
+    start_date = datetime(2024, 3, 4)
+    end_date = start_date + timedelta(hours=1)
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        return None
+
+    for _ in range(3):
+        cache.get_or_fetch("feed/", start_date, end_date, fetch, ttl=None)
+    assert len(fetches) == 3
+
+
+def test_settled_result_is_kept():
+    cache = ResultCache()
+    start_date = datetime(2024, 3, 4)
+    end_date = start_date + timedelta(hours=1)
+    table = pa.table({"a": [1, 2, 3]})
+
+    cache.put("feed/", start_date, end_date, table, ttl=cache.ttl_for(end_date, TIMEZONE))
+    assert cache.get("feed/", start_date, end_date) == (True, table)
+    assert cache.get("feed/", start_date, end_date, limit=2)[1].num_rows == 2
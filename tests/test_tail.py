@@ -0,0 +1,61 @@
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from benchmarks.fake_minio import FakeMinio
+from tail import FeedTail
+
+FEED_PATH = "data/feed/"
+
+NAMES = {
+    "range": lambda hour: f"{hour:02d}-00-00_feed_{hour + 1:02d}-00-00.parquet",
+    "hour": lambda hour: f"{hour}.parquet",
+}
+
+
+def _add_object(directory, naming, day, hour):
+    folder = directory / FEED_PATH / day
+    folder.mkdir(parents=True, exist_ok=True)
+    pq.write_table(pa.table({"object": [f"{day}/{hour}"] * 2}), folder / NAMES[naming](hour))
+
+
+def _delta(tail, directory):
+    # The fake server lists the files present when it is created
+    tail.client = FakeMinio(str(directory), latency=0)
+    table = tail.fetch_new()
+    # The objects read, in the order of their rows
+    return [] if table is None else list(dict.fromkeys(table["object"].to_pylist()))
+
+
+@pytest.mark.parametrize("naming", ["range", "hour"])
+def test_each_poll_returns_only_the_objects_landed_since(tmp_path, naming):
+    for hour in (7, 8, 9):
+        _add_object(tmp_path, naming, "2024-03-01", hour)
+    tail = FeedTail(FEED_PATH, since=datetime(2024, 3, 1, 8, 30), client=FakeMinio(str(tmp_path), latency=0),
+                    naming=naming, timezone_str="UTC")
+
+    assert _delta(tail, tmp_path) == ["2024-03-01/8", "2024-03-01/9"]
+    assert _delta(tail, tmp_path) == []
+
+    # "10.parquet" sorts before "9.parquet", the cursor must still be past it
+    _add_object(tmp_path, naming, "2024-03-01", 10)
+    assert _delta(tail, tmp_path) == ["2024-03-01/10"]
+
+    # Rolls over to the next day folder
+    _add_object(tmp_path, naming, "2024-03-01", 23)
+    _add_object(tmp_path, naming, "2024-03-02", 0)
+    assert _delta(tail, tmp_path) == ["2024-03-01/23", "2024-03-02/0"]
+    assert tail.cursor == FEED_PATH + "2024-03-02/" + NAMES[naming](0)
+    assert _delta(tail, tmp_path) == []
+
+
+@pytest.mark.parametrize("naming", ["range", "hour"])
+def test_resumes_after_the_cursor(tmp_path, naming):
+    for hour in (8, 9, 10):
+        _add_object(tmp_path, naming, "2024-03-01", hour)
+    tail = FeedTail(FEED_PATH, cursor=FEED_PATH + "2024-03-01/" + NAMES[naming](9),
+                    client=FakeMinio(str(tmp_path), latency=0), naming=naming, timezone_str="UTC")
+
+    assert _delta(tail, tmp_path) == ["2024-03-01/10"]
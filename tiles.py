@@ -0,0 +1,260 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import List
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from cache import ObjectCache
+from fetch import ObjectPipeline
+from listing import ListingIndex
+from planning import PlannedObject
+from trajectory import epoch_seconds
+
+# Aggregates kept per object, all of them carry the object they were derived from
+TILE_SCHEMAS = {
+    # Vehicles seen and positions received per minute
+    "activity": pa.schema([
+        ("object_name", pa.string()),
+        ("minute", pa.timestamp("s", tz="UTC")),
+        ("vehicles", pa.int64()),
+        ("points", pa.int64()),
+    ]),
+    # Positions per grid cell, cells are ``grid_size`` degrees wide and identified by their centre
+    "coverage": pa.schema([
+        ("object_name", pa.string()),
+        ("hour", pa.timestamp("s", tz="UTC")),
+        ("latitude", pa.float64()),
+        ("longitude", pa.float64()),
+        ("points", pa.int64()),
+    ]),
+    # Positions and time bounds of each vehicle
+    "trips": pa.schema([
+        ("object_name", pa.string()),
+        ("id", pa.string()),
+        ("points", pa.int64()),
+        ("first", pa.timestamp("s", tz="UTC")),
+        ("last", pa.timestamp("s", tz="UTC")),
+    ]),
+}
+
+MANIFEST_SCHEMA = pa.schema([
+    ("object_name", pa.string()),
+    ("etag", pa.string()),
+    ("day", pa.string()),
+])
+
+
+def summarise(
+        table: pa.Table,
+        object_name: str,
+        id_column: str,
+        time_column: str,
+        latitude_column: str,
+        longitude_column: str,
+        grid_size: float = 0.01,
+) -> dict:
+    """Aggregate the positions of one object into its tiles, ``{kind: table}`` following ``TILE_SCHEMAS``."""
+    table = table.select([id_column, time_column, latitude_column, longitude_column]).drop_null()
+    seconds = epoch_seconds(table[time_column])
+    latitudes = table[latitude_column].cast(pa.float64()).to_numpy()
+    longitudes = table[longitude_column].cast(pa.float64()).to_numpy()
+    points = pa.table({
+        "id": table[id_column].cast(pa.string()),
+        "seconds": seconds,
+        "minute": seconds // 60 * 60,
+        "hour": seconds // 3600 * 3600,
+        "cell_latitude": np.floor(latitudes / grid_size).astype(np.int64),
+        "cell_longitude": np.floor(longitudes / grid_size).astype(np.int64),
+    })
+
+    activity = points.group_by("minute").aggregate([("id", "count_distinct"), ("id", "count")])
+    coverage = points.group_by(["hour", "cell_latitude", "cell_longitude"]).aggregate([("id", "count")])
+    trips = points.group_by("id").aggregate([("id", "count"), ("seconds", "min"), ("seconds", "max")])
+
+    def timestamps(column):
+        return column.cast(pa.int64()).cast(pa.timestamp("s", tz="UTC"))
+
+    def with_object(columns, kind):
+        names = [name for name in TILE_SCHEMAS[kind].names if name != "object_name"]
+        table = pa.table(dict(zip(names, columns)))
+        table = table.add_column(0, "object_name", pa.array([object_name] * table.num_rows, pa.string()))
+        return table.cast(TILE_SCHEMAS[kind])
+
+    return {
+        "activity": with_object(
+            [timestamps(activity["minute"]), activity["id_count_distinct"], activity["id_count"]], "activity"),
+        "coverage": with_object(
+            [
+                timestamps(coverage["hour"]),
+                pc.multiply(pc.add(coverage["cell_latitude"].cast(pa.float64()), 0.5), grid_size),
+                pc.multiply(pc.add(coverage["cell_longitude"].cast(pa.float64()), 0.5), grid_size),
+                coverage["id_count"],
+            ],
+            "coverage",
+        ),
+        "trips": with_object(
+            [trips["id"], trips["id_count"], timestamps(trips["seconds_min"]), timestamps(trips["seconds_max"])],
+            "trips",
+        ),
+    }
+
+
+class TileStore:
+    """
+    Per-hour summary tiles of one feed, derived once from the raw objects and stored next to its listing index.
+
+    Each object listed by the ``ListingIndex`` is read once and reduced to its activity per minute, its coverage
+    on a grid and its per-vehicle point counts and time bounds (``TILE_SCHEMAS``). Tiles are kept in one
+    Parquet file per kind and day, along with a manifest of the object ETags they were derived from, so objects
+    are only read again when they change. Overviews over days or weeks then read a few small files instead of
+    the raw data.
+    """
+
+    def __init__(
+            self,
+            listing: ListingIndex,
+            id_column: str,
+            time_column: str,
+            latitude_column: str,
+            longitude_column: str,
+            grid_size: float = 0.01,
+            directory: str = None,
+    ):
+        self.listing = listing
+        self.id_column = id_column
+        self.time_column = time_column
+        self.latitude_column = latitude_column
+        self.longitude_column = longitude_column
+        self.grid_size = grid_size
+        self.directory = directory or os.path.splitext(listing.path)[0] + ".tiles"
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def build(self, client, start_date: datetime, end_date: datetime, cache: ObjectCache = None,
+              max_workers: int = 4, progress=None) -> int:
+        """
+        Derive the tiles of the objects overlapping [start_date, end_date) (timezone aware) that are missing or
+        out of date, and return how many objects were read. ``progress`` is called with (done, total).
+        """
+        self.listing.refresh(client)
+        manifest = self._manifest()
+        derived = dict(zip(manifest["object_name"].to_pylist(), manifest["etag"].to_pylist()))
+        todo = [
+            file for file in self.listing.query(start_date, end_date)
+            if derived.get(file.object_name) != file.etag
+        ]
+        if not todo:
+            return 0
+
+        columns = [self.id_column, self.time_column, self.latitude_column, self.longitude_column]
+        with ObjectPipeline(client, self.listing.bucket, cache=cache) as pipeline, \
+                ThreadPoolExecutor(max_workers=max_workers) as pool:
+            def derive(index: int, file: PlannedObject):
+                path = pipeline.fetch(index, file)
+                table = pq.read_table(path, columns=columns)
+                if cache is None:
+                    os.remove(path)
+                return file, summarise(table, file.object_name, *columns, grid_size=self.grid_size)
+
+            results = []
+            for done, result in enumerate(pool.map(derive, range(len(todo)), todo), 1):
+                results.append(result)
+                if progress is not None:
+                    progress(done, len(todo))
+
+        with self._lock:
+            by_day = {}
+            for file, tiles in results:
+                by_day.setdefault(file.start.strftime("%Y-%m-%d"), []).append((file, tiles))
+            for day, day_results in by_day.items():
+                names = pa.array([file.object_name for file, _ in day_results], pa.string())
+                for kind in TILE_SCHEMAS:
+                    self._update(kind, day, names, [tiles[kind] for _, tiles in day_results])
+
+            manifest = self._manifest()
+            names = pa.array([file.object_name for file, _ in results], pa.string())
+            manifest = pa.concat_tables([
+                manifest.filter(pc.invert(pc.is_in(manifest["object_name"], names))),
+                pa.table(
+                    {
+                        "object_name": names,
+                        "etag": [file.etag for file, _ in results],
+                        "day": [file.start.strftime("%Y-%m-%d") for file, _ in results],
+                    },
+                    schema=MANIFEST_SCHEMA,
+                ),
+            ])
+            self._write(manifest, os.path.join(self.directory, "manifest.parquet"))
+        return len(todo)
+
+    def read(self, kind: str, start_date: datetime, end_date: datetime) -> pa.Table:
+        """Tiles of ``kind`` of the UTC days overlapping [start_date, end_date), without any raw data read."""
+        # Tiles are filed by the UTC day their object starts on, which may be the day before the window
+        first = (start_date.astimezone(dt_timezone.utc) - timedelta(days=1)).date()
+        last = end_date.astimezone(dt_timezone.utc).date()
+        days = [(first + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((last - first).days + 1)]
+        paths = [self._path(kind, day) for day in days if os.path.exists(self._path(kind, day))]
+        if not paths:
+            return TILE_SCHEMAS[kind].empty_table()
+        return pa.concat_tables([pq.read_table(path, schema=TILE_SCHEMAS[kind]) for path in paths])
+
+    def activity(self, start_date: datetime, end_date: datetime) -> pa.Table:
+        """Vehicles active and positions received per minute of [start_date, end_date)."""
+        tiles = self.read("activity", start_date, end_date)
+        tiles = tiles.filter(self._between(tiles["minute"], start_date, end_date))
+        # Objects cover distinct periods, the counts of a minute split over two objects add up
+        activity = tiles.group_by("minute").aggregate([("vehicles", "sum"), ("points", "sum")])
+        return activity.rename_columns(["minute", "vehicles", "points"]).sort_by("minute")
+
+    def coverage(self, start_date: datetime, end_date: datetime) -> pa.Table:
+        """Positions per grid cell over the hours of [start_date, end_date)."""
+        tiles = self.read("coverage", start_date, end_date)
+        tiles = tiles.filter(self._between(tiles["hour"], start_date, end_date))
+        coverage = tiles.group_by(["latitude", "longitude"]).aggregate([("points", "sum")])
+        return coverage.rename_columns(["latitude", "longitude", "points"])
+
+    def trips(self, start_date: datetime, end_date: datetime) -> pa.Table:
+        """Positions and time bounds of every vehicle seen in [start_date, end_date), most active first."""
+        tiles = self.read("trips", start_date, end_date)
+        tiles = tiles.filter(pc.and_(
+            self._between(tiles["first"], None, end_date),
+            self._between(tiles["last"], start_date, None),
+        ))
+        trips = tiles.group_by("id").aggregate([("points", "sum"), ("first", "min"), ("last", "max")])
+        trips = trips.rename_columns(["id", "points", "first", "last"])
+        return trips.sort_by([("points", "descending")])
+
+    @staticmethod
+    def _between(column, start_date, end_date):
+        condition = pc.is_valid(column)
+        if start_date is not None:
+            condition = pc.and_(condition, pc.greater_equal(column, pa.scalar(start_date, column.type)))
+        if end_date is not None:
+            condition = pc.and_(condition, pc.less(column, pa.scalar(end_date, column.type)))
+        return condition
+
+    def _update(self, kind: str, day: str, names: pa.Array, tables: List[pa.Table]):
+        path = self._path(kind, day)
+        existing = pq.read_table(path, schema=TILE_SCHEMAS[kind]) if os.path.exists(path) \
+            else TILE_SCHEMAS[kind].empty_table()
+        kept = existing.filter(pc.invert(pc.is_in(existing["object_name"], names)))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._write(pa.concat_tables([kept] + tables), path)
+
+    def _manifest(self) -> pa.Table:
+        path = os.path.join(self.directory, "manifest.parquet")
+        return pq.read_table(path, schema=MANIFEST_SCHEMA) if os.path.exists(path) else MANIFEST_SCHEMA.empty_table()
+
+    def _path(self, kind: str, day: str) -> str:
+        return os.path.join(self.directory, kind, f"{day}.parquet")
+
+    @staticmethod
+    def _write(table: pa.Table, path: str):
+        tmp_path = path + ".part"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
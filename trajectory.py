@@ -0,0 +1,98 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+TRIPS_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("timestamps", pa.list_(pa.int64())),
+    ("path", pa.list_(pa.list_(pa.float64(), 2))),
+])
+
+
+def epoch_seconds(column: pa.ChunkedArray) -> np.ndarray:
+    """POSIX seconds of a timestamp or numeric time column."""
+    if pa.types.is_timestamp(column.type):
+        column = column.cast(pa.timestamp("s", tz=column.type.tz), safe=False)
+    return column.cast(pa.int64(), safe=False).to_numpy()
+
+
+def _offsets(codes: np.ndarray, count: int) -> np.ndarray:
+    """List offsets of the runs of ``codes`` (sorted, in [0, count))."""
+    return np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=count))]).astype(np.int32)
+
+
+def build_trips(
+        table: pa.Table,
+        id_column: str,
+        time_column: str,
+        longitude_column: str,
+        latitude_column: str,
+        max_points: int = None,
+        top_n: int = None,
+        start_time: int = None,
+) -> pa.Table:
+    """
+    Build one trajectory per vehicle of ``table`` (``TRIPS_SCHEMA``), ready for a deck.gl ``TripsLayer``.
+
+    Rows are sorted by vehicle then time with one sort of the encoded ids, and the per-vehicle runs become
+    the offsets of the ``timestamps`` and ``path`` list arrays, so no Python object is built per point.
+    Timestamps are seconds since ``start_time`` (the earliest time of the table by default).
+
+    ``top_n`` keeps the vehicles with the most points, ``max_points`` downsamples every trajectory to at most
+    that many points: every nth point by rank, so spacing follows the sampling rather than time, and always
+    the last one, so the replayed path ends where the vehicle did.
+    """
+    table = table.select([id_column, time_column, longitude_column, latitude_column]).drop_null()
+    if table.num_rows == 0:
+        return TRIPS_SCHEMA.empty_table()
+
+    encoded = pc.dictionary_encode(table[id_column].cast(pa.string())).combine_chunks()
+    codes = encoded.indices.to_numpy()
+    ids = encoded.dictionary
+    times = epoch_seconds(table[time_column])
+    if start_time is None:
+        start_time = int(times.min())
+
+    order = np.lexsort((times, codes))
+    sorted_codes = codes[order]
+    counts = np.bincount(sorted_codes, minlength=len(ids))
+
+    keep = np.ones(len(ids), dtype=bool)
+    if top_n is not None and top_n < len(ids):
+        keep[:] = False
+        keep[np.argsort(-counts, kind="stable")[:top_n]] = True
+
+    selected = keep[sorted_codes]
+    if max_points is not None:
+        # Rank of each point within its trajectory, every stride-th point is kept along with the last one
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        rank = np.arange(len(sorted_codes)) - starts[sorted_codes]
+        last = rank == (counts - 1)[sorted_codes]
+        if max_points == 1:
+            selected &= last
+        else:
+            # Strides over the points after the first one, which leaves room for the last one
+            stride = np.maximum(-(-(counts - 1) // (max_points - 1)), 1)
+            selected &= (rank % stride[sorted_codes] == 0) | last
+
+    order = order[selected]
+    sorted_codes = sorted_codes[selected]
+
+    # Renumber the kept vehicles so that the offsets have no empty runs
+    kept = np.flatnonzero(keep)
+    renumber = np.full(len(ids), -1, dtype=np.int64)
+    renumber[kept] = np.arange(len(kept))
+    offsets = pa.array(_offsets(renumber[sorted_codes], len(kept)), pa.int32())
+
+    longitudes = table[longitude_column].cast(pa.float64()).to_numpy()[order]
+    latitudes = table[latitude_column].cast(pa.float64()).to_numpy()[order]
+    points = pa.FixedSizeListArray.from_arrays(pa.array(np.column_stack([longitudes, latitudes]).ravel()), 2)
+
+    return pa.Table.from_arrays(
+        [
+            ids.take(pa.array(kept)),
+            pa.ListArray.from_arrays(offsets, pa.array(times[order] - start_time, pa.int64())),
+            pa.ListArray.from_arrays(offsets, points),
+        ],
+        schema=TRIPS_SCHEMA,
+    )